@@ -0,0 +1,149 @@
+import numpy as np
+import pandas as pd
+
+# dtype schema per query family (template name), applied by WRDSManager right after the fetch.
+#   'int32'          -> int32 (nullable Int32 if the column has missing values), kept as is if out of range
+#   'category'       -> pandas categorical (dictionary-encoded strings)
+#   'datetime'       -> datetime64[ns], kept as is if a date is out of bounds
+#   ('float32', d)   -> float32 if the values have at most d decimals and survive the downcast, float64 otherwise
+#   'float64'        -> plain float64 (NaN instead of the nullable Float64 mask)
+# Columns not listed keep the dtype raw_sql returns them with.
+_IBES_NAMES = {
+    'cusip': 'category',
+    'namedt': 'datetime',
+    'nameendt': 'datetime',
+    'permco': 'int32',
+    'permno': 'int32',
+}
+
+SCHEMAS = {
+    'pricevol/crsp_dsf.sql.j2': {
+        'permco': 'int32',
+        'permno': 'int32',
+        'cusip': 'category',
+        'date': 'datetime',
+        'prc': 'float64', # prices up to 6 digits before the decimal point, and marketcap truncates prc * shrout
+        'ret': 'float64', # compounded over up to 252 days
+        'retx': 'float64',
+        'vol': 'float64',
+        'shrout': 'int32',
+        'cfacpr': ('float32', 6),
+        'cfacshr': ('float32', 6),
+        'openprc': 'float64',
+    },
+    'analyst_estimation/price_target.sql.j2': {
+        **_IBES_NAMES,
+        'ticker': 'category',
+        'estimid': 'category',
+        'alysnam': 'category',
+        'value': 'float64', # .astype(float) downstream would widen float32 to 18.290001
+        'amaskcd': 'int32',
+        'ann_deemed_date': 'datetime',
+    },
+    'analyst_estimation/eps_detail.sql.j2': {
+        **_IBES_NAMES,
+        'oftic': 'category',
+        'estimator': 'int32',
+        'analys': 'int32',
+        'value': 'float64',
+        'fpi': 'category',
+        'fpedats': 'datetime',
+        'ann_deemed_date': 'datetime',
+    },
+    'analyst_estimation/price_target_summary.sql.j2': {
+        **_IBES_NAMES,
+        'ticker': 'category',
+        'meanptg': 'float64',
+        'medptg': 'float64',
+        'stdev': 'float64',
+        'ptghigh': 'float64',
+        'ptglow': 'float64',
+        'numest': 'int32',
+        'numdown1m': 'int32',
+        'numup1m': 'int32',
+        'numdown4w': 'int32',
+        'numup4w': 'int32',
+        'statpers': 'datetime',
+    },
+    # the fund_list columns are rounded to 3 decimals as float64 by get_fundq / get_funda (values reach billions)
+    'fundamentals/fundq.sql.j2': {
+        'datadate': 'datetime',
+        'rdq': 'datetime',
+        'fyearq': 'int32',
+        'fqtr': 'int32',
+    },
+    'fundamentals/funda.sql.j2': {
+        'datadate': 'datetime',
+        'fyear': 'int32',
+    },
+    'link_table/ccmxpf_linktable.sql.j2': {
+        'iid': 'category',
+        'linkprim': 'category',
+        'permno': 'int32',
+        'permco': 'int32',
+    },
+}
+
+
+def _to_int32(s: pd.Series) -> pd.Series:
+    info = np.iinfo(np.int32)
+    if s.notna().any() and (s.min() < info.min or s.max() > info.max):
+        return s
+    return s.astype('Int32' if s.isna().any() else 'int32')
+
+
+def _to_float32(s: pd.Series, decimals: int) -> pd.Series:
+    values = s.astype('float64')
+    downcast = values.astype('float32')
+    # only downcast if the values are reported with at most `decimals` decimals and rounding the float32 gives them back exactly
+    if np.array_equal(downcast.astype('float64').round(decimals).to_numpy(), values.to_numpy(), equal_nan=True):
+        return downcast
+    return values
+
+
+def _to_datetime(s: pd.Series) -> pd.Series:
+    try:
+        return pd.to_datetime(s)
+    except (pd.errors.OutOfBoundsDatetime, OverflowError):
+        return s
+
+
+def _convert(s: pd.Series, spec) -> pd.Series:
+    if isinstance(spec, tuple) and spec[0] == 'float32':
+        return _to_float32(s, spec[1])
+    if spec == 'int32':
+        return _to_int32(s)
+    if spec == 'category':
+        return s.astype('category')
+    if spec == 'datetime':
+        return _to_datetime(s)
+    if spec == 'float64':
+        return s.astype('float64')
+    raise ValueError(f"unknown dtype spec {spec!r}")
+
+
+def compact_dtypes(df: pd.DataFrame, schema: dict):
+    """
+    Apply a dtype `schema` (see SCHEMAS) to `df` in place of the columns it lists.
+
+    Returns
+    -------
+    (pandas.DataFrame, dict)
+        The converted frame and a report: rows, bytes_before, bytes_after, ratio and, per converted
+        column, its dtype and bytes before and after.
+    """
+    report = {'rows': len(df), 'bytes_before': 0, 'bytes_after': 0, 'ratio': 1.0, 'columns': {}}
+    bytes_before = df.memory_usage(deep=True, index=False)
+    df = df.copy(deep=False)
+    for col, spec in schema.items():
+        if col not in df.columns:
+            continue
+        df[col] = _convert(df[col], spec)
+    bytes_after = df.memory_usage(deep=True, index=False)
+    for col in schema:
+        if col in df.columns:
+            report['columns'][col] = {'dtype': str(df[col].dtype), 'bytes_before': int(bytes_before[col]), 'bytes_after': int(bytes_after[col])}
+    report['bytes_before'] = int(bytes_before.sum())
+    report['bytes_after'] = int(bytes_after.sum())
+    report['ratio'] = round(report['bytes_before'] / max(report['bytes_after'], 1), 2)
+    return df, report
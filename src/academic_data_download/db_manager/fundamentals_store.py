@@ -0,0 +1,175 @@
+import os
+import glob
+import json
+import time
+import shutil
+import hashlib
+import pandas as pd
+
+from academic_data_download.db_manager.query_cache import DAY
+
+# columns the fundq/funda templates always return on top of the requested fund_list
+KEY_COLUMNS = {
+    'fundq': ['gvkey', 'datadate', 'fyearq', 'fqtr', 'rdq'],
+    'funda': ['gvkey', 'datadate', 'fyear'],
+}
+# a row of comp.fundq / comp.funda (after the INDL/STD/C/D filters) is identified by these;
+# (gvkey, datadate) alone is not unique, a change of fiscal year end reports the same datadate twice
+ROW_KEYS = {
+    'fundq': ['gvkey', 'datadate', 'fyearq', 'fqtr'],
+    'funda': ['gvkey', 'datadate', 'fyear'],
+}
+
+# union of the fundq/funda columns used by the factors of FactorBuilder, fetched once into the local fundamentals store
+FUNDQ_COLUMNS = [
+    'actq', 'atq', 'ceqq', 'cheq', 'cogsq', 'cshopq', 'cshoq', 'dlcq', 'dlttq', 'dpq', 'dvpq', 'dvpsxq',
+    'ibq', 'invtq', 'ivstq', 'lctq', 'ltq', 'mibq', 'mibtq', 'oiadpq', 'oibdpq', 'ppegtq', 'ppentq',
+    'prcraq', 'pstkq', 'revtq', 'saleq', 'seqq', 'txdbq', 'txditcq', 'txpq', 'xintq', 'xrdq', 'xsgaq',
+]
+FUNDA_COLUMNS = ['capx', 'dlcch', 'dltis', 'dltr', 'ivao', 'prstkc', 'sstk', 'xad']
+
+
+class FundamentalsStore():
+    """
+    Column-level local store for Compustat FUNDQ/FUNDA.
+
+    The first request for a table fetches the key columns together with the requested
+    fund columns and saves every column to its own parquet file. Later requests are served
+    from disk; only the columns that are not stored yet are fetched from WRDS and aligned
+    to the stored keys on the full row key (ROW_KEYS). If WRDS returns other rows than the
+    stored ones (new filings, restatements), the stored columns are fetched again with them.
+
+    A table is fetched again from scratch once its keys are older than `ttl` seconds (one day
+    by default, like the query cache; None keeps it until `refresh`).
+
+    Layout::
+
+        {path}/{scope}_{start_year}/fundq/_keys.parquet
+        {path}/{scope}_{start_year}/fundq/_meta.json
+        {path}/{scope}_{start_year}/fundq/atq.parquet
+        ...
+
+    where scope is 'all' when gvkey_list is None, otherwise a short hash of the gvkey list.
+    """
+    def __init__(self, wrds_manager, gvkey_list=None, start_year=2000, path='data/fundamentals', ttl=DAY, verbose=True):
+        self.wrds_manager = wrds_manager
+        self.gvkey_list = gvkey_list
+        self.start_year = start_year
+        self.ttl = ttl
+        self.verbose = verbose
+
+        if gvkey_list is None:
+            scope = 'all'
+        else:
+            scope = hashlib.md5(','.join(sorted(gvkey_list)).encode()).hexdigest()[:10]
+        self.root = f'{path}/{scope}_{start_year}'
+
+    def _table_dir(self, table):
+        return f'{self.root}/{table}'
+
+    def stored_columns(self, table):
+        """
+        Fund columns of `table` that are already on disk.
+        """
+        files = glob.glob(f'{self._table_dir(table)}/*.parquet')
+        names = [os.path.basename(f)[:-len('.parquet')] for f in files]
+        return [n for n in names if n != '_keys']
+
+    def fetched_at(self, table):
+        """
+        Time (seconds since the epoch) the stored keys of `table` were fetched, None if nothing is stored.
+        """
+        meta_path = f'{self._table_dir(table)}/_meta.json'
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path) as f:
+            return json.load(f)['fetched_at']
+
+    def is_stale(self, table):
+        fetched_at = self.fetched_at(table)
+        return fetched_at is not None and self.ttl is not None and time.time() - fetched_at > self.ttl
+
+    def _fetch(self, table, fund_list):
+        """
+        Fetch `fund_list` from WRDS and persist it column by column.
+        """
+        if self.verbose:
+            print(f"Fetching {len(fund_list)} column(s) of {table} from WRDS: {fund_list}")
+        if table == 'fundq':
+            df = self.wrds_manager.get_fundq(fund_list=fund_list, gvkey_list=self.gvkey_list, start_year=self.start_year)
+        else:
+            df = self.wrds_manager.get_funda(fund_list=fund_list, gvkey_list=self.gvkey_list, start_year=self.start_year)
+
+        table_dir = self._table_dir(table)
+        os.makedirs(table_dir, exist_ok=True)
+        keys_path = f'{table_dir}/_keys.parquet'
+        row_keys = ROW_KEYS[table]
+
+        if os.path.exists(keys_path):
+            # align the new columns to the rows we already hold, if WRDS still returns exactly those rows
+            keys = pd.read_parquet(keys_path)
+            fresh = df[row_keys]
+            same_rows = (
+                len(fresh) == len(keys)
+                and not fresh.duplicated().any()
+                and len(keys[row_keys].merge(fresh, on=row_keys, how='inner')) == len(keys)
+            )
+            if not same_rows:
+                stored = self.stored_columns(table)
+                if self.verbose:
+                    print(f"The {table} rows on WRDS changed since they were stored, fetching the stored columns again too.")
+                shutil.rmtree(table_dir)
+                return self._fetch(table, stored + [col for col in fund_list if col not in stored])
+            df = keys[row_keys].merge(df[row_keys + fund_list], on=row_keys, how='left')
+        else:
+            df = df.reset_index(drop=True)
+            df[KEY_COLUMNS[table]].to_parquet(keys_path, index=False)
+            with open(f'{table_dir}/_meta.json', 'w') as f:
+                json.dump({'fetched_at': time.time()}, f)
+
+        for col in fund_list:
+            df[[col]].to_parquet(f'{table_dir}/{col}.parquet', index=False)
+
+    def prefetch(self, table, fund_list):
+        """
+        Make sure all of `fund_list` is stored locally, fetching the missing columns in one query.
+        """
+        if self.is_stale(table):
+            if self.verbose:
+                print(f"The stored {table} columns are older than {self.ttl / DAY:g} day(s), fetching them again.")
+            self.refresh(table)
+        missing = [col for col in dict.fromkeys(fund_list) if col not in self.stored_columns(table)]
+        if missing:
+            self._fetch(table, missing)
+        elif self.verbose:
+            print(f"All requested {table} columns are already stored locally.")
+
+    def get(self, table, fund_list):
+        """
+        Get the key columns plus `fund_list` of `table`, fetching only what is not stored yet.
+        """
+        self.prefetch(table, fund_list)
+        table_dir = self._table_dir(table)
+        parts = [pd.read_parquet(f'{table_dir}/_keys.parquet')]
+        parts += [pd.read_parquet(f'{table_dir}/{col}.parquet') for col in dict.fromkeys(fund_list)]
+        return pd.concat(parts, axis=1)
+
+    def get_fundq(self, fund_list):
+        """
+        Drop-in for WRDSManager.get_fundq served from the local store.
+        """
+        return self.get('fundq', fund_list)
+
+    def get_funda(self, fund_list):
+        """
+        Drop-in for WRDSManager.get_funda served from the local store.
+        """
+        return self.get('funda', fund_list)
+
+    def refresh(self, table=None):
+        """
+        Drop the stored columns (of one table, or all of them) so they are fetched again.
+        """
+        target = self.root if table is None else self._table_dir(table)
+        if os.path.exists(target):
+            shutil.rmtree(target)
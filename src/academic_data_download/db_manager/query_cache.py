@@ -0,0 +1,251 @@
+import atexit
+import fnmatch
+from contextlib import contextmanager
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Optional
+
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError: # Windows: the index is then merged without a lock
+    fcntl = None
+
+from academic_data_download.db_manager.sql_params import params_fingerprint
+
+DAY = 24 * 3600
+
+# time to live (seconds) per query family, i.e. template name; first matching pattern wins,
+# None = never expires, 0 = not cached
+DEFAULT_TTL = {
+    'taq/taq_retail_markethour*': 0,  # TAQBuilder keeps every day in its part files, a cached copy would double them
+    'link_table/*': DAY,
+    'taq/taq_link_table*': DAY,
+    'sp500/*': DAY,
+    'ravenpack/*': 7 * DAY,
+    '*': DAY,
+}
+
+
+class QueryCache():
+    """
+    Persistent cache of query results, one parquet file per query.
+
+    Entries are keyed by the hash of the rendered SQL and its bound parameters, so a query is
+    only re-executed when its text (template, columns, filters, identifier lists) changes or its
+    entry expired. The index (`index.json`) records per entry its family (the template name),
+    size, row count, dtypes, creation and last access time:
+
+        cache = QueryCache('data/query_cache', max_bytes=5e9)
+        df = cache.get(sql, params, family='link_table/ccmxpf_linktable.sql.j2')
+        if df is None:
+            df = db.raw_sql(sql)
+            cache.put(sql, params, df, family='link_table/ccmxpf_linktable.sql.j2')
+
+    Entries older than the TTL of their family are dropped on lookup, families with a TTL of 0 are
+    not cached; when the cache grows beyond `max_bytes` the least recently used entries are evicted.
+    Several processes can share the directory: the index is merged with the one on disk under a
+    file lock (`index.lock`) every time it is written.
+    """
+    def __init__(self, path='data/query_cache', max_bytes=5e9, ttl: Optional[dict] = None, verbose=True):
+        self.path = os.path.abspath(path) # the atexit flush may run from another working directory
+        self.index_path = f'{self.path}/index.json'
+        self.max_bytes = max_bytes
+        # user patterns are tried before the defaults
+        ttl = ttl or {}
+        self.ttl = {**ttl, **{k: v for k, v in DEFAULT_TTL.items() if k not in ttl}}
+        self.verbose = verbose
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._dirty = False
+        os.makedirs(path, exist_ok=True)
+        self.entries = self._load()
+        atexit.register(self.flush) # access times of hits are written lazily
+
+    # -------------------------- bookkeeping --------------------------
+    def _load(self) -> dict:
+        if not os.path.exists(self.index_path):
+            return {}
+        with open(self.index_path) as f:
+            return json.load(f)
+
+    @contextmanager
+    def _index_lock(self):
+        # one writer of index.json at a time across processes, from reading it to replacing it
+        with open(f'{self.path}/index.lock', 'a') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _save(self, evict=False):
+        with self._index_lock():
+            # merge with entries written meanwhile by another process/manager on the same directory,
+            # and forget the ones another process evicted
+            on_disk = self._load()
+            for key, entry in on_disk.items():
+                if key not in self.entries:
+                    self.entries[key] = entry
+            self.entries = {key: entry for key, entry in self.entries.items() if os.path.exists(self._file(key))}
+            if evict:
+                self._evict()
+            tmp_path = f'{self.index_path}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(self.entries, f)
+            os.replace(tmp_path, self.index_path)
+        self._dirty = False
+
+    def flush(self):
+        with self._lock:
+            if self._dirty:
+                self._save()
+
+    def _file(self, key: str) -> str:
+        return f'{self.path}/{key}.parquet'
+
+    def _count(self, family: str, event: str):
+        self._stats.setdefault(family, {'hits': 0, 'misses': 0, 'stores': 0, 'expired': 0, 'evictions': 0})[event] += 1
+
+    @staticmethod
+    def key(sql: str, params=None, scope: str = 'wrds') -> str:
+        return hashlib.sha256(f'{scope}\n{sql}{params_fingerprint(params)}'.encode()).hexdigest()[:32]
+
+    def ttl_of(self, family: str) -> Optional[float]:
+        for pattern, ttl in self.ttl.items():
+            if fnmatch.fnmatch(family, pattern):
+                return ttl
+        return None
+
+    def caches(self, family: str) -> bool:
+        return self.ttl_of(family) != 0
+
+    def _is_expired(self, entry: dict) -> bool:
+        ttl = self.ttl_of(entry['family'])
+        return ttl is not None and time.time() - entry['created'] > ttl
+
+    def _drop(self, key: str):
+        self.entries.pop(key, None)
+        if os.path.exists(self._file(key)):
+            os.remove(self._file(key))
+
+    # -------------------------- lookup and store --------------------------
+    def get(self, sql: str, params=None, family: str = 'unknown', scope: str = 'wrds') -> Optional[pd.DataFrame]:
+        """
+        Cached result of the query, or None if it is not cached (or expired). `scope` names the
+        database the query ran on, so e.g. an offline replay database never serves WRDS queries.
+        """
+        key = self.key(sql, params, scope)
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None and (self._is_expired(entry) or not os.path.exists(self._file(key))):
+                self._count(family, 'expired')
+                self._drop(key)
+                self._save()
+                entry = None
+            if entry is None:
+                self._count(family, 'misses')
+                return None
+            self._count(family, 'hits')
+            entry['last_access'] = time.time()
+            entry['hits'] = entry.get('hits', 0) + 1
+            self._dirty = True
+        df = pd.read_parquet(self._file(key))
+        # parquet does not keep the nullable dtypes raw_sql returns
+        df = df.astype(entry['dtypes'])
+        if self.verbose:
+            print(f"query cache hit ({family}, {entry['rows']} rows)")
+        return df
+
+    def put(self, sql: str, params, df: pd.DataFrame, family: str = 'unknown', scope: str = 'wrds'):
+        if not self.caches(family):
+            return
+        key = self.key(sql, params, scope)
+        tmp_path = f'{self._file(key)}.tmp'
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, self._file(key))
+        now = time.time()
+        with self._lock:
+            self.entries[key] = {
+                'family': family,
+                'bytes': os.path.getsize(self._file(key)),
+                'rows': len(df),
+                'dtypes': {col: str(dtype) for col, dtype in df.dtypes.items()},
+                'created': now,
+                'last_access': now,
+                'hits': 0,
+            }
+            self._count(family, 'stores')
+            self._save(evict=True)
+
+    def _evict(self):
+        """
+        Drop the least recently used entries until the cache fits in max_bytes.
+        """
+        total = sum(e['bytes'] for e in self.entries.values())
+        for key in sorted(self.entries, key=lambda k: self.entries[k]['last_access']):
+            if total <= self.max_bytes:
+                break
+            total -= self.entries[key]['bytes']
+            self._count(self.entries[key]['family'], 'evictions')
+            self._drop(key)
+
+    # -------------------------- invalidation and statistics --------------------------
+    def invalidate(self, family: Optional[str] = None, sql: Optional[str] = None, params=None, older_than: Optional[float] = None, scope: str = 'wrds') -> int:
+        """
+        Drop entries: the one of a given query (`sql`, `params`), all entries whose family matches
+        the pattern `family` (e.g. 'taq/*'), and/or those created more than `older_than` seconds ago.
+        Without any argument the whole cache is cleared. Returns the number of dropped entries.
+        """
+        with self._lock:
+            if sql is not None:
+                keys = [k for k in [self.key(sql, params, scope)] if k in self.entries]
+            else:
+                keys = [
+                    k for k, e in self.entries.items()
+                    if (family is None or fnmatch.fnmatch(e['family'], family))
+                    and (older_than is None or time.time() - e['created'] > older_than)
+                ]
+            for key in keys:
+                self._drop(key)
+            self._save()
+        if self.verbose:
+            print(f"query cache: invalidated {len(keys)} entries")
+        return len(keys)
+
+    def clear(self) -> int:
+        return self.invalidate()
+
+    def stats(self) -> pd.DataFrame:
+        """
+        Hits, misses, stores, expirations and evictions of this session plus entries and bytes on disk, by family.
+        """
+        stats = pd.DataFrame.from_dict(self._stats, orient='index')
+        on_disk = pd.DataFrame.from_dict(self.entries, orient='index')
+        if not on_disk.empty:
+            on_disk = on_disk.groupby('family').agg(entries=('rows', 'size'), bytes=('bytes', 'sum'), rows=('rows', 'sum'))
+            stats = stats.join(on_disk, how='outer')
+        stats = stats.fillna(0).astype('int64')
+        if 'hits' in stats:
+            stats['hit_rate'] = (stats['hits'] / (stats['hits'] + stats['misses'])).round(3)
+        stats.index.name = 'family'
+        return stats.sort_index()
+
+
+_open_caches = {}
+
+
+def open_query_cache(path='data/query_cache', **kwargs) -> QueryCache:
+    """
+    One QueryCache per directory and process, shared by all WRDSManagers (every builder creates its own manager).
+    """
+    path = os.path.normpath(path)
+    if path not in _open_caches:
+        _open_caches[path] = QueryCache(path, **kwargs)
+    return _open_caches[path]
@@ -0,0 +1,170 @@
+import hashlib
+import inspect
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Callable, Optional
+
+import pandas as pd
+
+from academic_data_download.db_manager.sql_params import params_fingerprint
+
+FETCH_CHUNKSIZE = 500_000 # rows per fetch of raw_sql, the wrds default
+RUN_ID = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}" # one per process, shared by all WRDSManagers
+
+
+def query_fingerprint(sql: str, params=None) -> str:
+    """
+    Short hash of the rendered SQL and its parameters: equal for repeated runs of the same query.
+    """
+    return hashlib.sha256(f'{sql}{params_fingerprint(params)}'.encode()).hexdigest()[:16]
+
+
+def _supports_iter(db) -> bool:
+    raw_sql = getattr(db, 'raw_sql', None)
+    try:
+        return raw_sql is not None and 'return_iter' in inspect.signature(raw_sql).parameters
+    except (TypeError, ValueError):
+        return False
+
+
+def timed_raw_sql(db, sql: str, params=None):
+    """
+    Run `db.raw_sql` and time its two phases.
+
+    `execute` is the time until the query has run and the cursor holds the result (server
+    execution plus, for a client-side cursor, the transfer), `fetch` the time to build the
+    DataFrame from it. Connections whose raw_sql cannot return an iterator are timed as a whole
+    (all of it counted as `execute`).
+
+    Returns
+    -------
+    (pandas.DataFrame, dict)
+        The result, identical to `db.raw_sql(sql, params=params)`, and {'execute_s', 'fetch_s'}.
+    """
+    kwargs = {} if params is None else {'params': params}
+    start = time.perf_counter()
+    if not _supports_iter(db):
+        df = db.raw_sql(sql, **kwargs)
+        return df, {'execute_s': time.perf_counter() - start, 'fetch_s': 0.0}
+    chunks = db.raw_sql(sql, chunksize=FETCH_CHUNKSIZE, return_iter=True, **kwargs)
+    executed = time.perf_counter()
+    df = pd.concat(list(chunks)) # as raw_sql does without return_iter
+    return df, {'execute_s': executed - start, 'fetch_s': time.perf_counter() - executed}
+
+
+class JsonlSink():
+    """
+    Appends every query record as one JSON line to `path`, across runs.
+    """
+    def __init__(self, path='data/query_metrics/queries.jsonl'):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    def __call__(self, record: dict):
+        line = json.dumps(record, default=str)
+        with self._lock, open(self.path, 'a') as f:
+            f.write(line + '\n')
+
+
+class QueryMetrics():
+    """
+    Collects one record per executed query and hands it to the sinks.
+
+    A record holds the run id (RUN_ID, one per process), timestamp, template name, query fingerprint,
+    source ('wrds', 'cache', 'chunk' or 'stream'), the render, execute and fetch times, the total,
+    rows, approximate bytes in memory and the error if the query failed. A sink is any callable
+    taking the record dict:
+
+        metrics = QueryMetrics(sinks=[JsonlSink('data/query_metrics/queries.jsonl'), print])
+        metrics.add_sink(lambda record: my_dashboard.send(record))
+        ...
+        metrics.summary()  # total time per template, slowest first
+    """
+    def __init__(self, sinks: Optional[list] = None, run_id: Optional[str] = None):
+        self.sinks = list(sinks or [])
+        self.run_id = run_id or RUN_ID
+        self.records = []
+        self._lock = threading.Lock()
+
+    def add_sink(self, sink: Callable):
+        self.sinks.append(sink)
+
+    def record(self, template: Optional[str], sql: str, params=None, source='wrds', render_s=0.0, execute_s=0.0, fetch_s=0.0, rows=None, nbytes=None, error=None, **extra) -> dict:
+        record = {
+            'run_id': self.run_id,
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'template': template or 'unknown',
+            'fingerprint': query_fingerprint(sql, params),
+            'source': source,
+            'render_s': round(render_s, 6),
+            'execute_s': round(execute_s, 6),
+            'fetch_s': round(fetch_s, 6),
+            'total_s': round(render_s + execute_s + fetch_s, 6),
+            'rows': rows,
+            'bytes': nbytes,
+            'error': error,
+            **extra,
+        }
+        with self._lock:
+            self.records.append(record)
+        for sink in self.sinks:
+            sink(record)
+        return record
+
+    def summary(self) -> pd.DataFrame:
+        return summarize(pd.DataFrame(self.records))
+
+
+def summarize(records: pd.DataFrame) -> pd.DataFrame:
+    """
+    Per template: number of queries (and of cache hits and errors), total / mean / max time,
+    time per phase, rows and bytes, ranked by total time.
+    """
+    columns = ['queries', 'cache_hits', 'errors', 'total_s', 'mean_s', 'max_s', 'render_s', 'execute_s', 'fetch_s', 'rows', 'bytes']
+    if records.empty:
+        return pd.DataFrame(columns=columns)
+    records = records.assign(
+        cache_hit=records['source'] == 'cache',
+        failed=records['error'].notna(),
+    )
+    summary = records.groupby('template').agg(
+        queries=('total_s', 'size'),
+        cache_hits=('cache_hit', 'sum'),
+        errors=('failed', 'sum'),
+        total_s=('total_s', 'sum'),
+        mean_s=('total_s', 'mean'),
+        max_s=('total_s', 'max'),
+        render_s=('render_s', 'sum'),
+        execute_s=('execute_s', 'sum'),
+        fetch_s=('fetch_s', 'sum'),
+        rows=('rows', 'sum'),
+        bytes=('bytes', 'sum'),
+    )
+    return summary[columns].sort_values('total_s', ascending=False).round(3)
+
+
+def read_metrics(path='data/query_metrics/queries.jsonl') -> pd.DataFrame:
+    """
+    All records of a JSONL metrics log, e.g. to compare runs:
+
+        records = read_metrics()
+        records.groupby(['template', 'run_id'])['total_s'].sum().unstack()
+    """
+    if not os.path.exists(path):
+        return pd.DataFrame()
+    return pd.read_json(path, lines=True, dtype=False)
+
+
+def metrics_report(path='data/query_metrics/queries.jsonl', run_id: Optional[str] = None) -> pd.DataFrame:
+    """
+    `summarize` over the records of a JSONL metrics log, of all runs or only of `run_id`.
+    """
+    records = read_metrics(path)
+    if run_id is not None and not records.empty:
+        records = records[records['run_id'] == run_id]
+    return summarize(records)
+
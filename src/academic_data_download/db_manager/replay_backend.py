@@ -0,0 +1,526 @@
+import os
+import re
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from academic_data_download.db_manager.fundamentals_store import FUNDQ_COLUMNS, FUNDA_COLUMNS
+
+
+# ---------------------------------------------------------------------------
+# connection
+# ---------------------------------------------------------------------------
+def from_pg_array_literal(text: str, sql_type: str = 'text') -> list:
+    """
+    Inverse of `sql_params.to_pg_array_literal`, e.g. '{1,2}' -> [1, 2] and '{"A","B\\"C"}' -> ['A', 'B"C'].
+    """
+    items = []
+    for quoted, bare in re.findall(r'"((?:[^"\\]|\\.)*)"|([^,{}]+)', text.strip()[1:-1]):
+        items.append(re.sub(r'\\(.)', r'\1', quoted) if quoted or not bare else bare.strip())
+    if sql_type in ('integer', 'int', 'bigint'):
+        items = [int(v) for v in items]
+    return items
+
+
+def translate_sql(sql: str, params=None):
+    """
+    Rewrite the Postgres flavour used in `sql_inventory/` into DuckDB.
+
+    - `%(name)s` placeholders (psycopg2) become `$name`, `%%` becomes `%`
+    - array parameters (`CAST(%(name)s AS integer[])` with a '{...}' literal) are passed as python lists
+    - `x ~ 'pat'` / `x !~ 'pat'` become `regexp_matches`, since DuckDB's `~` is a full match
+      while Postgres' is a partial one
+    """
+    if params:
+        params = dict(params)
+        for name, value in params.items():
+            cast = re.search(r'CAST\(%\(' + name + r'\)s AS (\w+)\[\]\)', sql)
+            if cast is not None and isinstance(value, str):
+                params[name] = from_pg_array_literal(value, cast.group(1).lower())
+        sql = re.sub(r'%\((\w+)\)s', r'$\1', sql).replace('%%', '%')
+    sql = re.sub(r"([\w.]+)\s*!~\s*('(?:[^']|'')*')", r"NOT regexp_matches(\1, \2)", sql)
+    sql = re.sub(r"([\w.]+)\s*~\s*('(?:[^']|'')*')", r"regexp_matches(\1, \2)", sql)
+    return sql, (params or None)
+
+
+class _ReplayCursor():
+    """
+    DB-API cursor translating the SQL before execution (used by `sql_streaming.open_stream_cursor`).
+    """
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, sql, params=None):
+        sql, params = translate_sql(sql, params)
+        if params is None:
+            self._cursor.execute(sql)
+        else:
+            self._cursor.execute(sql, params)
+        return self
+
+    def fetchmany(self, size):
+        return self._cursor.fetchmany(size)
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def close(self):
+        self._cursor.close()
+
+
+class ReplayConnection():
+    """
+    Offline stand-in for wrds.Connection on top of a DuckDB database.
+
+    It exposes the same `raw_sql` (same pandas read path and dtypes as wrds), so it can be
+    passed as `db` to `WRDSManager` and to every builder:
+
+        db = build_synthetic_wrds(scale=0.5)
+        PriceVolComputer(verbose=False, db=db, permno_list=None).pricevol_processed()
+
+    The database is either filled by `build_synthetic_wrds` or any other DuckDB file holding
+    the WRDS schemas (comp, crsp, ibes, rpna, taqm_YYYY, wrdsapps).
+    """
+    def __init__(self, path=':memory:', connection=None, read_only=False):
+        import duckdb # optional dependency, only needed offline
+
+        self.path = path
+        self.connection = connection if connection is not None else duckdb.connect(path, read_only=read_only)
+
+    @property
+    def cache_scope(self):
+        """
+        Identity of the database for the query cache of WRDSManager; in-memory databases are not cached.
+        """
+        return None if self.path == ':memory:' else f'replay:{os.path.abspath(self.path)}'
+
+    def raw_sql(self, sql, params=None, coerce_float=True, date_cols=None, dtype_backend="numpy_nullable", chunksize=None, return_iter=False, **kwargs):
+        sql, params = translate_sql(sql, params)
+        with warnings.catch_warnings():
+            # pandas warns about DB-API connections other than sqlite3, the read path is the same as wrds'
+            warnings.simplefilter('ignore', UserWarning)
+            df = pd.read_sql_query(
+                sql,
+                self.connection,
+                params=params,
+                coerce_float=coerce_float,
+                parse_dates=date_cols,
+                chunksize=chunksize,
+                dtype_backend=dtype_backend,
+            )
+            if return_iter or chunksize is None:
+                return df
+            return pd.concat(list(df))
+
+    def cursor(self):
+        return _ReplayCursor(self.connection.cursor())
+
+    def new_connection(self):
+        """
+        Another connection on the same database, for pooled execution (see `utils/connection_pool.py`).
+        """
+        return ReplayConnection(self.path, connection=self.connection.cursor())
+
+    def list_tables(self) -> pd.DataFrame:
+        return self.connection.execute(
+            "SELECT table_schema, table_name FROM information_schema.tables ORDER BY table_schema, table_name"
+        ).df()
+
+    def close(self):
+        self.connection.close()
+
+
+# ---------------------------------------------------------------------------
+# synthetic data
+# ---------------------------------------------------------------------------
+# a few securities the scripts refer to by permno, kept alive over the whole sample
+_FIXED_SECURITIES = [
+    # permno, ticker, sym_root, sym_suffix
+    (14542, 'GOOG', 'GOOG', None),
+    (14593, 'AAPL', 'AAPL', None),
+    (17778, 'BRKA', 'BRK', 'A'),
+]
+
+
+def _create_table(con, name: str, df: pd.DataFrame, date_cols=(), time_cols=()):
+    """
+    Create table `name` from `df`; datetime columns in `date_cols` become DATE, microseconds since midnight in `time_cols` become TIME.
+    """
+    schema = name.split('.')[0] if '.' in name else None
+    if schema is not None:
+        con.execute(f'CREATE SCHEMA IF NOT EXISTS {schema}')
+    select = []
+    for col in df.columns:
+        if col in date_cols:
+            select.append(f'CAST("{col}" AS DATE) AS "{col}"')
+        elif col in time_cols:
+            select.append(f'CAST(TIME \'00:00:00\' + to_microseconds("{col}") AS TIME) AS "{col}"')
+        else:
+            select.append(f'"{col}"')
+    con.register('_replay_src', df)
+    try:
+        con.execute(f'CREATE OR REPLACE TABLE {name} AS SELECT {", ".join(select)} FROM _replay_src')
+    finally:
+        con.unregister('_replay_src')
+
+
+def _letters(i: int, width: int = 4) -> str:
+    s = ''
+    for _ in range(width):
+        i, r = divmod(i, 26)
+        s = chr(65 + r) + s
+    return s
+
+
+def _universe(n_securities: int, n_days: int, rng) -> pd.DataFrame:
+    """
+    One row per security: identifiers, listing window (as calendar positions) and size.
+    """
+    fixed = pd.DataFrame(_FIXED_SECURITIES, columns=['permno', 'ticker', 'sym_root', 'sym_suffix'])
+    n_random = max(n_securities - len(fixed), 1)
+    random = pd.DataFrame({
+        'permno': 10001 + np.arange(n_random + len(fixed)) * 7,
+        'ticker': [_letters(i) for i in range(n_random + len(fixed))],
+    })
+    clash = random['permno'].isin(fixed['permno']) | random['ticker'].isin(fixed['sym_root'])
+    random = random[~clash].head(n_random)
+    random['sym_root'] = random['ticker']
+    random['sym_suffix'] = None
+    u = pd.concat([fixed, random], ignore_index=True)
+    n = len(u)
+
+    # every 20th security is a second share class of the previous company (same permco and gvkey)
+    company = np.arange(n)
+    second_class = (np.arange(n) % 20 == 19)
+    company[second_class] = company[np.where(second_class)[0] - 1]
+    u['permco'] = 20001 + company
+    u['gvkey'] = [f'{1001 + c:06d}' for c in company]
+    u['cusip'] = [f'{100000 + i:06d}10' for i in range(n)]
+    u['rp_entity_id'] = [f'{0xA00000 + c:06X}' for c in company]
+    u['gsector'] = rng.choice(['10', '15', '20', '25', '30', '35', '40', '45', '50', '55', '60'], n)
+
+    # listing window: most securities live the whole sample, some list late or delist early
+    first = np.where(rng.random(n) < 0.2, rng.integers(0, n_days // 2, n), 0)
+    last = np.where(rng.random(n) < 0.2, rng.integers(n_days // 2, n_days, n), n_days - 1)
+    first[:len(fixed)], last[:len(fixed)] = 0, n_days - 1
+    u['first'], u['last'] = first, last
+
+    u['price0'] = np.exp(rng.normal(3.5, 1.0, n)).round(2)
+    u['shrout'] = (np.exp(rng.normal(11, 1.3, n)) // 1).astype(np.int64) # thousands of shares
+    u['sp500'] = rng.random(n) < 0.3
+    return u
+
+
+def _daily_prices(universe: pd.DataFrame, calendar: pd.DatetimeIndex, rng) -> pd.DataFrame:
+    """
+    Long frame (security x listed day) of prices, returns and volumes, ordered by date.
+    """
+    lengths = (universe['last'] - universe['first'] + 1).to_numpy()
+    row = np.repeat(np.arange(len(universe)), lengths)
+    day = np.concatenate([np.arange(f, l + 1) for f, l in zip(universe['first'], universe['last'])])
+    n = len(row)
+
+    ret = rng.normal(0.0004, 0.02, n)
+    is_first = np.r_[True, row[1:] != row[:-1]]
+    log_level = pd.Series(np.log1p(ret)).groupby(row).cumsum().to_numpy()
+    prc = universe['price0'].to_numpy()[row] * np.exp(log_level)
+    dividend = np.where(rng.random(n) < 1 / 63, rng.uniform(0.002, 0.01, n), 0.0)
+
+    df = pd.DataFrame({
+        'permno': universe['permno'].to_numpy()[row],
+        'permco': universe['permco'].to_numpy()[row],
+        'cusip': universe['cusip'].to_numpy()[row],
+        'date': calendar[day],
+        'prc': prc.round(4),
+        'ret': np.where(is_first, np.nan, ret).round(6),
+        'retx': np.where(is_first, np.nan, ret - dividend).round(6),
+        'vol': (np.exp(rng.normal(12, 1.5, n)) // 1).astype(np.int64),
+        'shrout': universe['shrout'].to_numpy()[row],
+        'cfacpr': 1.0,
+        'cfacshr': 1.0,
+        'openprc': (prc * (1 + rng.normal(0, 0.005, n))).round(4),
+        '_row': row,
+    })
+    # a few missing returns, as in CRSP
+    df.loc[rng.random(n) < 0.001, 'ret'] = np.nan
+    return df.sort_values(['date', 'permno'], kind='stable').reset_index(drop=True)
+
+
+def _fundamentals(universe: pd.DataFrame, calendar: pd.DatetimeIndex, columns: list, annual: bool, rng) -> pd.DataFrame:
+    companies = universe.drop_duplicates('gvkey')
+    freq = 'YE-DEC' if annual else 'QE-DEC'
+    periods = pd.date_range(f'{calendar[0].year - 2}-01-01', calendar[-1], freq=freq)
+    df = pd.MultiIndex.from_product([companies['gvkey'], periods], names=['gvkey', 'datadate']).to_frame(index=False)
+    n = len(df)
+    scale = np.repeat(np.exp(rng.normal(6, 1.5, len(companies))), len(periods))
+    for col in columns:
+        df[col] = (scale * rng.lognormal(-1, 1, n)).round(3)
+        df.loc[rng.random(n) < 0.03, col] = np.nan
+    # items that are often negative
+    for col in {'ibq', 'oiadpq', 'dlcch', 'txdbq'} & set(columns):
+        df[col] = df[col] * np.where(rng.random(n) < 0.25, -1, 1)
+
+    df['indfmt'], df['datafmt'], df['consol'], df['popsrc'] = 'INDL', 'STD', 'C', 'D'
+    if annual:
+        df['fyear'] = df['datadate'].dt.year
+        df['curncd'] = 'USD'
+    else:
+        df['fyearq'] = df['datadate'].dt.year
+        df['fqtr'] = df['datadate'].dt.quarter
+        df['rdq'] = df['datadate'] + pd.to_timedelta(rng.integers(20, 60, n), unit='D')
+        df['curncdq'] = 'USD'
+    return df
+
+
+def _analyst_events(prices: pd.DataFrame, universe: pd.DataFrame, rate: float, rng) -> pd.DataFrame:
+    """
+    Sample (security, day) pairs from the price panel with probability `rate`, adding analyst ids and time stamps.
+    """
+    events = prices[rng.random(len(prices)) < rate][['permno', 'cusip', 'date', 'prc', '_row']].reset_index(drop=True)
+    n = len(events)
+    events['ticker'] = universe['ticker'].to_numpy()[events['_row']]
+    events['amaskcd'] = rng.integers(70000, 70000 + 300, n)
+    events['anntims'] = rng.integers(6 * 3600, 20 * 3600, n).astype(np.int64) * 1_000_000
+    events['acttims'] = events['anntims'] + rng.integers(0, 3600, n).astype(np.int64) * 1_000_000
+    return events
+
+
+def _taq_day(active: pd.DataFrame, trades_per_symbol: int, rng) -> pd.DataFrame:
+    """
+    Trades of one day: `active` has one row per listed security with its sym_root, sym_suffix and price.
+    """
+    row = np.repeat(np.arange(len(active)), rng.poisson(trades_per_symbol, len(active)))
+    n = len(row)
+    mid = active['prc'].to_numpy()[row]
+    half_spread = np.round(mid * 0.0005 + 0.005, 2)
+    nbb, nbo = np.round(mid - half_spread, 2), np.round(mid + half_spread, 2)
+    location = rng.random(n)
+    # about half of the prints carry sub-penny price improvement (retail flow), the rest trade on the penny grid
+    sub_penny = rng.random(n) < 0.5
+    price = np.where(sub_penny, nbb + location * (nbo - nbb) + 0.0013, np.round(nbb + location * (nbo - nbb), 2))
+    return pd.DataFrame({
+        'date': active['date'].to_numpy()[row],
+        'time_m': rng.integers(9 * 3600, 16 * 3600 + 1800, n).astype(np.int64) * 1_000_000 + rng.integers(0, 1_000_000, n),
+        'sym_root': active['sym_root'].to_numpy()[row],
+        'sym_suffix': active['sym_suffix'].to_numpy()[row],
+        'price': price.round(4),
+        'size': np.maximum(1, np.exp(rng.normal(4, 1.5, n)) // 1).astype(np.int64),
+        'nbb': nbb,
+        'nbo': nbo,
+        'type': np.where(rng.random(n) < 0.97, 'T', 'Y'),
+        'tr_scond': rng.choice(np.array([None, '@', '@ F', 'O', 'Q', '6'], dtype=object), n, p=[0.6, 0.2, 0.12, 0.03, 0.03, 0.02]),
+        'ex': np.where(rng.random(n) < 0.45, 'D', rng.choice(np.array(['N', 'P', 'Q', 'Z']), n)),
+    })
+
+
+def populate_synthetic_wrds(con, scale: float = 1.0, start_date='2013-01-01', end_date='2014-12-31', seed: int = 0, taq_trades_per_symbol: int = 20, taq_days=None, verbose=True):
+    """
+    Fill a DuckDB connection with synthetic versions of the WRDS tables queried by `sql_inventory/`.
+
+    Parameters
+    ----------
+    con : duckdb.DuckDBPyConnection
+    scale : float, optional
+        Size of the universe: 100 securities per unit of scale (at least 5).
+    start_date, end_date : str, optional
+        Sample period. Trading days are business days; rpna tables are created for every year of the period.
+    seed : int, optional
+        Seed of the random generator; the same arguments always give the same database.
+    taq_trades_per_symbol : int, optional
+        Average number of TAQ trades per security and day.
+    taq_days : int, optional
+        Only create the `taqm_YYYY.wct_YYYYMMDD` tables of the last `taq_days` trading days (default: all).
+    verbose : bool, optional
+    """
+    rng = np.random.default_rng(seed)
+    calendar = pd.bdate_range(start_date, end_date)
+    universe = _universe(max(5, int(round(100 * scale))), len(calendar), rng)
+    first_date = calendar[universe['first'].to_numpy()]
+    last_date = calendar[universe['last'].to_numpy()]
+    delisted = universe['last'].to_numpy() < len(calendar) - 1
+    if verbose:
+        print(f"generating synthetic WRDS data: {len(universe)} securities, {len(calendar)} trading days ({start_date} to {end_date})")
+
+    # -------------------------- crsp --------------------------
+    prices = _daily_prices(universe, calendar, rng)
+    _create_table(con, 'crsp.dsf', prices.drop(columns='_row'), date_cols=['date'])
+    _create_table(con, 'crsp.dsenames', pd.DataFrame({
+        'permno': universe['permno'],
+        'permco': universe['permco'],
+        'cusip': universe['cusip'],
+        'ticker': universe['ticker'],
+        'namedt': first_date,
+        'nameendt': last_date,
+    }), date_cols=['namedt', 'nameendt'])
+    links = pd.DataFrame({
+        'gvkey': universe['gvkey'],
+        'liid': '01',
+        'linkdt': first_date - pd.Timedelta(days=365),
+        'linkenddt': pd.Series(last_date).where(delisted),
+        'lpermno': universe['permno'],
+        'lpermco': universe['permco'],
+        'linktype': 'LC',
+        'linkprim': np.where(universe['permno'].duplicated() | universe['gvkey'].duplicated(), 'J', 'P'),
+    })
+    # non-standard links the queries must filter out
+    junk = links.sample(frac=0.1, random_state=seed).assign(linktype='NU', linkprim='N')
+    _create_table(con, 'crsp.ccmxpf_linktable', pd.concat([links, junk], ignore_index=True), date_cols=['linkdt', 'linkenddt'])
+    sp500 = universe[universe['sp500']]
+    _create_table(con, 'crsp.msp500list', pd.DataFrame({
+        'permno': sp500['permno'],
+        'start': pd.Timestamp(f'{calendar[0].year - 5}-01-01'),
+        'ending': calendar[sp500['last'].to_numpy()],
+    }), date_cols=['start', 'ending'])
+
+    # -------------------------- compustat --------------------------
+    _create_table(con, 'comp.fundq', _fundamentals(universe, calendar, FUNDQ_COLUMNS, annual=False, rng=rng), date_cols=['datadate', 'rdq'])
+    _create_table(con, 'comp.funda', _fundamentals(universe, calendar, FUNDA_COLUMNS, annual=True, rng=rng), date_cols=['datadate'])
+    _create_table(con, 'comp.co_hgic', pd.DataFrame({
+        'gvkey': universe['gvkey'].drop_duplicates(),
+        'gsector': universe.drop_duplicates('gvkey')['gsector'],
+        'indfrom': pd.Timestamp(f'{calendar[0].year - 10}-01-01'),
+        'indthru': pd.NaT,
+        'indtype': 'GICS',
+    }), date_cols=['indfrom', 'indthru'])
+    _create_table(con, 'comp.secd', pd.DataFrame({
+        'gvkey': universe['gvkey'].to_numpy()[prices['_row']],
+        'iid': '01',
+        'datadate': prices['date'],
+        'tic': universe['ticker'].to_numpy()[prices['_row']],
+        'prccd': prices['prc'],
+        'cshtrd': prices['vol'],
+        'cshoc': prices['shrout'] * 1000,
+        'tpci': '0',
+        'curcdd': 'USD',
+        'exchg': rng.choice([11, 12, 14], len(prices)),
+    }), date_cols=['datadate'])
+
+    # -------------------------- ibes --------------------------
+    pt = _analyst_events(prices, universe, 1 / 15, rng)
+    _create_table(con, 'ibes.ptgdetu', pd.DataFrame({
+        'ticker': pt['ticker'],
+        'estimid': 'BRK' + (pt['amaskcd'] % 40).astype(str),
+        'alysnam': 'ANALYST' + pt['amaskcd'].astype(str),
+        'value': (pt['prc'] * rng.normal(1.1, 0.15, len(pt))).round(2),
+        'cusip': pt['cusip'],
+        'amaskcd': pt['amaskcd'],
+        'anndats': pt['date'],
+        'anntims': pt['anntims'],
+        'actdats': pt['date'],
+        'acttims': pt['acttims'],
+        'usfirm': 1,
+        'horizon': '12',
+        'measure': 'PTG',
+        'curr': 'USD',
+        'estcur': 'USD',
+    }), date_cols=['anndats', 'actdats'], time_cols=['anntims', 'acttims'])
+
+    month_ends = prices[prices['date'].isin(pd.Series(calendar).groupby(calendar.to_period('M')).max())]
+    mean_ptg = month_ends['prc'].to_numpy() * rng.normal(1.1, 0.1, len(month_ends))
+    _create_table(con, 'ibes.ptgsumu', pd.DataFrame({
+        'ticker': universe['ticker'].to_numpy()[month_ends['_row']],
+        'cusip': month_ends['cusip'].to_numpy(),
+        'meanptg': mean_ptg.round(2),
+        'medptg': (mean_ptg * rng.normal(1, 0.02, len(month_ends))).round(2),
+        'stdev': (mean_ptg * 0.1).round(2),
+        'numest': rng.integers(1, 30, len(month_ends)),
+        'ptghigh': (mean_ptg * 1.3).round(2),
+        'ptglow': (mean_ptg * 0.7).round(2),
+        'statpers': month_ends['date'].to_numpy(),
+        'numdown1m': rng.integers(0, 3, len(month_ends)),
+        'numup1m': rng.integers(0, 3, len(month_ends)),
+        'numdown4w': rng.integers(0, 3, len(month_ends)),
+        'numup4w': rng.integers(0, 3, len(month_ends)),
+        'usfirm': 1,
+        'measure': 'PTG',
+        'curr': 'USD',
+    }), date_cols=['statpers'])
+
+    eps = _analyst_events(prices, universe, 1 / 10, rng)
+    fpi = rng.choice(['1', '2', '6', '7'], len(eps))
+    horizon_days = np.select([fpi == '1', fpi == '2', fpi == '6'], [365, 730, 90], 180)
+    _create_table(con, 'ibes.ndetu_epsus', pd.DataFrame({
+        'oftic': eps['ticker'],
+        'estimator': (eps['amaskcd'] % 40).astype(np.int64),
+        'analys': eps['amaskcd'],
+        'value': (eps['prc'] * rng.normal(0.05, 0.03, len(eps))).round(2),
+        'cusip': eps['cusip'],
+        'usfirm': 1,
+        'anndats': eps['date'],
+        'anntims': eps['anntims'],
+        'actdats': eps['date'],
+        'acttims': eps['acttims'],
+        'fpi': fpi,
+        'measure': 'EPS',
+        'curr': 'USD',
+        'fpedats': eps['date'] + pd.to_timedelta(horizon_days, unit='D'),
+    }), date_cols=['anndats', 'actdats', 'fpedats'], time_cols=['anntims', 'acttims'])
+
+    # -------------------------- ravenpack --------------------------
+    companies = universe.drop_duplicates('rp_entity_id')
+    _create_table(con, 'rpna.wrds_all_mapping', pd.DataFrame({
+        'rp_entity_id': companies['rp_entity_id'],
+        'cusip': companies['cusip'] + '1', # 9 character cusip with check digit
+    }))
+    for year in range(calendar[0].year, calendar[-1].year + 1):
+        days = pd.date_range(f'{year}-01-01', f'{year}-12-31', freq='D')
+        n = int(len(companies) * 60)
+        _create_table(con, f'rpna.rpa_full_equities_{year}', pd.DataFrame({
+            'rp_entity_id': rng.choice(companies['rp_entity_id'].to_numpy(), n),
+            'entity_type': np.where(rng.random(n) < 0.95, 'COMP', 'PROD'),
+            'country_code': np.where(rng.random(n) < 0.9, 'US', 'GB'),
+            # utc time stamps, the late ones of Dec 31 fall on Jan 1 of the next trading year
+            'rpa_date_utc': rng.choice(days, n),
+            'rpa_time_utc': rng.integers(0, 24 * 3600, n).astype(np.int64) * 1_000_000,
+            'event_sentiment_score': np.where(rng.random(n) < 0.1, np.nan, rng.uniform(-1, 1, n).round(2)),
+            'relevance': rng.integers(0, 101, n),
+            'event_similarity_days': rng.uniform(0, 365, n).round(2),
+            **{col: rng.uniform(-1, 1, n).round(2) for col in ['bmq', 'bee', 'bam', 'bca', 'css', 'ber']},
+        }), date_cols=['rpa_date_utc'], time_cols=['rpa_time_utc'])
+        n = 20 * len(days)
+        _create_table(con, f'rpna.rpa_full_global_macro_{year}', pd.DataFrame({
+            'rp_entity_id': 'PLCE' + pd.Series(rng.integers(0, 50, n)).astype(str),
+            'entity_type': np.where(rng.random(n) < 0.9, 'PLCE', 'ORGA'),
+            'country_code': rng.choice(['US', 'GB', 'DE', 'JP', 'CN'], n),
+            'rpa_date_utc': rng.choice(days, n),
+            'rpa_time_utc': rng.integers(0, 24 * 3600, n).astype(np.int64) * 1_000_000,
+            'event_sentiment_score': np.where(rng.random(n) < 0.1, np.nan, rng.uniform(-1, 1, n).round(2)),
+            'relevance': rng.integers(0, 101, n),
+            'event_similarity_days': rng.uniform(0, 365, n).round(2),
+        }), date_cols=['rpa_date_utc'], time_cols=['rpa_time_utc'])
+
+    # -------------------------- taq --------------------------
+    sym = prices[['date', 'permno', 'prc', '_row']].copy()
+    sym['sym_root'] = universe['sym_root'].to_numpy()[sym['_row']]
+    sym['sym_suffix'] = universe['sym_suffix'].to_numpy()[sym['_row']]
+    _create_table(con, 'wrdsapps.taqmclink', sym[['date', 'sym_root', 'sym_suffix', 'permno']], date_cols=['date'])
+    taq_calendar = calendar if taq_days is None else calendar[-taq_days:]
+    for date, active in sym[sym['date'].isin(taq_calendar)].groupby('date', sort=True):
+        _create_table(con, f'taqm_{date.year}.wct_{date:%Y%m%d}', _taq_day(active, taq_trades_per_symbol, rng), date_cols=['date'], time_cols=['time_m'])
+
+    if verbose:
+        print(f"created {len(con.execute('SELECT * FROM information_schema.tables').fetchall())} tables ({len(prices)} crsp.dsf rows, {len(taq_calendar)} TAQ days)")
+
+
+def build_synthetic_wrds(path=':memory:', scale: float = 1.0, start_date='2013-01-01', end_date='2014-12-31', seed: int = 0, taq_trades_per_symbol: int = 20, taq_days=None, overwrite=False, verbose=True) -> ReplayConnection:
+    """
+    Open a `ReplayConnection` on synthetic WRDS data (see `populate_synthetic_wrds` for the arguments).
+
+    With a file `path`, an existing database is reused as is unless `overwrite` is set, so a
+    benchmark can generate its data once and replay it in every run.
+    """
+    if path != ':memory:' and os.path.exists(path):
+        if not overwrite:
+            if verbose:
+                print(f"replaying existing database {path}")
+            return ReplayConnection(path)
+        os.remove(path)
+    db = ReplayConnection(path)
+    populate_synthetic_wrds(db.connection, scale=scale, start_date=start_date, end_date=end_date, seed=seed,
+                            taq_trades_per_symbol=taq_trades_per_symbol, taq_days=taq_days, verbose=verbose)
+    return db
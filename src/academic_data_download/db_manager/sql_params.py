@@ -0,0 +1,79 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+
+def to_pg_array_literal(values) -> str:
+    """
+    Postgres array literal, e.g. [1, 2] -> '{1,2}' and ['A', 'B"C'] -> '{"A","B\\"C"}'.
+    """
+    items = []
+    for v in values:
+        if isinstance(v, str):
+            items.append('"' + v.replace('\\', '\\\\').replace('"', '\\"') + '"')
+        else:
+            items.append(str(v))
+    return '{' + ','.join(items) + '}'
+
+
+class BoundList():
+    """
+    Identifier list passed to a query as one bound array parameter instead of an inline IN (...) literal.
+
+    Rendered by the `in_list` macro of `sql_inventory/macros.sql.j2` as
+    `column = ANY(CAST(%(name)s AS integer[]))` (or `text[]`). The whole list travels as a single
+    string constant, so the SQL text stays small and the server parses one literal instead of
+    thousands of expressions.
+    """
+    def __init__(self, name, values):
+        self.name = name
+        self.values = pd.Series(list(values)).dropna().tolist() # numpy scalars -> python scalars
+        self.sql_type = 'text[]' if any(isinstance(v, str) for v in self.values) else 'integer[]'
+        if self.sql_type == 'integer[]':
+            self.values = [int(v) for v in self.values]
+
+    @property
+    def placeholder(self):
+        return f'CAST(%({self.name})s AS {self.sql_type})'
+
+    @property
+    def param(self):
+        return to_pg_array_literal(self.values)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __bool__(self):
+        return len(self.values) > 0
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __repr__(self):
+        return f'BoundList({self.name!r}, n={len(self.values)})'
+
+
+def bind_params(render_kwargs: dict, threshold: int, names=('permno_list', 'gvkey_list', 'sym_root_list', 'symbol_root')):
+    """
+    Replace the identifier lists among `names` that are longer than `threshold` by a `BoundList`.
+
+    Returns the new render arguments and the query parameters to pass along with the SQL
+    (None when nothing was bound, so the SQL can be executed without parameter interpolation).
+    """
+    params = {}
+    bound_kwargs = {}
+    for key, value in render_kwargs.items():
+        is_list = isinstance(value, (list, tuple, set, np.ndarray, pd.Series, pd.Index))
+        if key in names and is_list and len(value) > threshold:
+            value = BoundList(key, value)
+            params[key] = value.param
+        bound_kwargs[key] = value
+    return bound_kwargs, (params or None)
+
+
+def params_fingerprint(params) -> str:
+    """
+    Stable text of query parameters, used to identify a rendered query.
+    """
+    return '' if not params else json.dumps(params, sort_keys=True, default=str)
@@ -1,25 +1,138 @@
 import os
+import time
 import pandas as pd
 import tqdm
 import numpy as np
 import glob
+import fastparquet
 from jinja2 import Environment, FileSystemLoader
 
 from academic_data_download.utils.merger import merge_link_table_crsp, merge_link_table_msp500list
 from academic_data_download.utils.clean import crsp_clean
 from academic_data_download.utils.sneak_peek import sneak_peek
 from academic_data_download.utils.sql_execution import sql_execution_in_chunks
+from academic_data_download.utils.sql_streaming import stream_sql_to_parquet
+from academic_data_download.db_manager.sql_params import BoundList, bind_params
+from academic_data_download.db_manager.query_cache import open_query_cache
+from academic_data_download.db_manager.dtype_schema import SCHEMAS, compact_dtypes
+from academic_data_download.db_manager.query_metrics import QueryMetrics, JsonlSink, timed_raw_sql
+from academic_data_download.utils.partitioned_parquet import write_partitions, read_partitions, max_date, partition_files, remove_dataset
 
 # hyperparameter
 # set up environment, assuming your template lives in sql/
 env = Environment(loader=FileSystemLoader("src/academic_data_download/sql_inventory"))
+env.tests['bound'] = lambda value: isinstance(value, BoundList) # used by the in_list macro
 
 class WRDSManager():
-    def __init__(self, db, verbose=True):
+    def __init__(self, db, verbose=True, stream_batch_size=100_000, bind_threshold=500, cache_path='data/query_cache', cache_max_bytes=5e9, cache_ttl=None, compact=True, metrics_path='data/query_metrics/queries.jsonl', metrics_sinks=None):
         self.db = db
         self.verbose = verbose
+        self.stream_batch_size = stream_batch_size
+        # identifier lists longer than this are sent as one bound array parameter instead of an IN (...) literal
+        self.bind_threshold = bind_threshold
+        # persistent cache of query results (see db_manager/query_cache.py); cache_path=None disables it,
+        # so does a database without a stable identity (e.g. an in-memory replay database)
+        self.cache_scope = getattr(db, 'cache_scope', 'wrds')
+        use_cache = cache_path and self.cache_scope is not None
+        self.cache = open_query_cache(cache_path, max_bytes=cache_max_bytes, ttl=cache_ttl, verbose=verbose) if use_cache else None
+        # apply the dtype schemas of db_manager/dtype_schema.py to fetched frames, the savings are logged in dtype_reports
+        self.compact = compact
+        self.dtype_reports = []
+        # one record per query (timings, rows, bytes, template) appended to metrics_path and passed to
+        # any callable in metrics_sinks (see db_manager/query_metrics.py); metrics_path=None keeps them in memory only
+        sinks = ([JsonlSink(metrics_path)] if metrics_path else []) + list(metrics_sinks or [])
+        self.metrics = QueryMetrics(sinks=sinks)
+        self._render_seconds = 0.0
+
+    def _render(self, template_name, **kwargs):
+        """
+        Render a template of sql_inventory. Returns the SQL and its query parameters (None if nothing is bound).
+        """
+        start = time.perf_counter()
+        kwargs, params = bind_params(kwargs, self.bind_threshold)
+        sql = env.get_template(template_name).render(**kwargs)
+        self._render_seconds = time.perf_counter() - start # picked up by the record of the next query
+        return sql, params
+
+    def _run(self, sql, params=None, stream_to=None, transform=None, family=None, use_cache=True):
+        """
+        Execute `sql` and return the result as a DataFrame, or, if `stream_to` is given, stream it
+        batch by batch through a server-side cursor into that parquet file and return the write
+        statistics (rows, bytes, batches) instead. `transform` post-processes the result (or every batch).
+
+        Results of queries with a `family` (the template name, which selects the TTL) are served
+        from and stored in the query cache unless `use_cache` is False or the family has a TTL of 0
+        (the TAQ families, kept in the part files of TAQBuilder); the raw result is cached,
+        `transform` runs on every call. The dtype schema of the family is applied before `transform`.
+        Every query is recorded in `self.metrics`.
+        """
+        render_s, self._render_seconds = self._render_seconds, 0.0
+        if stream_to is not None:
+            first_batch = {}
+            start = time.perf_counter()
+            try:
+                totals = stream_sql_to_parquet(
+                    self.db, sql, stream_to,
+                    batch_size=self.stream_batch_size,
+                    params=params,
+                    transform=transform,
+                    on_batch=lambda stats: first_batch.setdefault('seconds', time.perf_counter() - start),
+                    verbose=self.verbose,
+                )
+            except Exception as e:
+                self.metrics.record(family, sql, params, source='stream', render_s=render_s, execute_s=time.perf_counter() - start, error=repr(e))
+                raise
+            # the time to the first batch stands for the execution, the rest for the transfer
+            elapsed = time.perf_counter() - start
+            execute_s = first_batch.get('seconds', elapsed)
+            self.metrics.record(family, sql, params, source='stream', render_s=render_s, execute_s=execute_s, fetch_s=elapsed - execute_s, rows=totals['rows'], nbytes=totals['bytes_in_memory'])
+            return totals
+
+        use_cache = use_cache and self.cache is not None and family is not None and self.cache.caches(family)
+        start = time.perf_counter()
+        df = self.cache.get(sql, params, family=family, scope=self.cache_scope) if use_cache else None
+        if df is not None:
+            self.metrics.record(family, sql, params, source='cache', render_s=render_s, fetch_s=time.perf_counter() - start, rows=len(df), nbytes=int(df.memory_usage(deep=True).sum()))
+        else:
+            try:
+                df, timings = timed_raw_sql(self.db, sql, params)
+            except Exception as e:
+                self.metrics.record(family, sql, params, render_s=render_s, execute_s=time.perf_counter() - start, error=repr(e))
+                raise
+            self.metrics.record(family, sql, params, render_s=render_s, rows=len(df), nbytes=int(df.memory_usage(deep=True).sum()), **timings)
+            if use_cache:
+                self.cache.put(sql, params, df, family=family, scope=self.cache_scope)
+        df = self._compact(df, family)
+        return df if transform is None else transform(df)
+
+    def _compact(self, df, family):
+        """
+        Convert `df` to the compact dtypes of its query family, recording the memory saved.
+        """
+        if not self.compact or family not in SCHEMAS:
+            return df
+        df, report = compact_dtypes(df, SCHEMAS[family])
+        self.dtype_reports.append({'family': family, **report})
+        if self.verbose:
+            print(f"compact dtypes ({family}): {report['bytes_before'] / 1e6:.1f} MB -> {report['bytes_after'] / 1e6:.1f} MB ({report['ratio']}x)")
+        return df
+
+    def memory_report(self):
+        """
+        Bytes before and after the dtype conversion of every fetched frame, as a DataFrame.
+        """
+        columns = ['family', 'rows', 'bytes_before', 'bytes_after', 'ratio']
+        report = pd.DataFrame(self.dtype_reports, columns=columns + ['columns'])[columns]
+        report['bytes_saved'] = report['bytes_before'] - report['bytes_after']
+        return report
 
-    def get_fundq(self, fund_list, gvkey_list=None, start_year=2000):
+    def query_report(self):
+        """
+        Queries of this manager per template, ranked by total time (see query_metrics.summarize).
+        """
+        return self.metrics.summary()
+
+    def get_fundq(self, fund_list, gvkey_list=None, start_year=2000, stream_to=None):
         """
         Get quarterly fundamental data from Compustat FUNDQ.
 
@@ -32,6 +145,8 @@ class WRDSManager():
         start_year : int, optional
             Earliest fiscal year (default 2000).
         gvkey_list : list of str, optional
+        stream_to : str, optional
+            Stream the result to this parquet file instead of returning it.
         Returns
         -------
         pandas.DataFrame
@@ -41,25 +156,30 @@ class WRDSManager():
             print("fund_list: ", fund_list)
             print("gvkey_list: ", gvkey_list)
 
-        sql = env.get_template("fundamentals/fundq.sql.j2").render(
+        template_name = "fundamentals/fundq.sql.j2"
+        sql, params = self._render(template_name, 
             fund_list=fund_list, 
             start_year=start_year, 
             gvkey_list=gvkey_list)
 
-        df = self.db.raw_sql(sql)
-        df['datadate'] = pd.to_datetime(df['datadate'])
-        df['rdq'] = pd.to_datetime(df['rdq'])
+        def postprocess(df):
+            df['datadate'] = pd.to_datetime(df['datadate'])
+            df['rdq'] = pd.to_datetime(df['rdq'])
 
-        # the fund list value should have precision of 3
-        for col in fund_list:
-            df[col] = df[col].astype(float).round(3)
+            # the fund list value should have precision of 3
+            df[fund_list] = df[fund_list].astype(float).round(3)
+            return df
+
+        df = self._run(sql, params=params, stream_to=stream_to, transform=postprocess, family=template_name)
+        if stream_to is not None:
+            return df
 
         if self.verbose:
             print("peeks at the data right after getting from wrds")
             sneak_peek(df)
         return df
 
-    def get_funda(self, fund_list, start_year=2000, gvkey_list=None):
+    def get_funda(self, fund_list, start_year=2000, gvkey_list=None, stream_to=None):
         """
         Get annual fundamental data from Compustat FUNDA.
 
@@ -72,6 +192,8 @@ class WRDSManager():
         gvkey_list : list of str, optional
         verbose : bool, optional
             Whether to print the SQL query.
+        stream_to : str, optional
+            Stream the result to this parquet file instead of returning it.
         Returns
         -------
         pandas.DataFrame
@@ -81,25 +203,30 @@ class WRDSManager():
             print("fund_list: ", fund_list)
             print("gvkey_list: ", gvkey_list)
 
-        sql = env.get_template("fundamentals/funda.sql.j2").render(
+        template_name = "fundamentals/funda.sql.j2"
+        sql, params = self._render(template_name, 
             fund_list=fund_list, 
             start_year=start_year, 
             gvkey_list=gvkey_list)
 
-        df = self.db.raw_sql(sql)
-        df['datadate'] = pd.to_datetime(df['datadate'])
-        
-        for col in fund_list:
-            df[col] = df[col].astype(float).round(3) # the fund list value should have precision of 3
-        return df
+        def postprocess(df):
+            df['datadate'] = pd.to_datetime(df['datadate'])
+
+            df[fund_list] = df[fund_list].astype(float).round(3) # the fund list value should have precision of 3
+            return df
+
+        return self._run(sql, params=params, stream_to=stream_to, transform=postprocess, family=template_name)
     
-    def get_secd_daily(self, start_date=None, end_date=None):
+    def get_secd_daily(self, start_date=None, end_date=None, stream_to=None):
         """
         Get daily SEC data from Compustat SECD.
+
+        Not served from the query cache: secd is read for the newest days (live_pricevol,
+        live_screener), and a cached empty or partial result would hide the days added since.
         """
-        sql = env.get_template("pricevol/comp_secd.sql.j2").render(start_date=start_date, end_date=end_date)
-        df = self.db.raw_sql(sql)
-        return df
+        template_name = "pricevol/comp_secd.sql.j2"
+        sql, params = self._render(template_name, start_date=start_date, end_date=end_date)
+        return self._run(sql, params=params, stream_to=stream_to, family=template_name, use_cache=False)
 
     def get_crsp_daily(
             self, 
@@ -107,15 +234,25 @@ class WRDSManager():
             start_date='2000-01-01', 
             crop_by_year = False,
             permno_list=None,
+            n_workers=1,
+            stream_to=None,
+            incremental=False,
+            lookback_days=30,
+            chunk_rows=5_000_000,
         ):
         """
         Retrieve daily CRSP stock data (price, return, volume, shares, adjustment factors).
 
         This method supports efficient data retrieval and caching:
-        - If a local Parquet cache exists at `cache_path`, the data is loaded from disk.
+        - If a local Parquet cache exists at `cache_path`, the data is loaded from disk. With
+          `incremental=True` the cache is first brought up to date by `refresh_crsp_daily`.
         - If no cache is found and `permno_list` is None, the method retrieves all available PERMNOs,
-          queries the database in manageable chunks, saves each chunk, merges them, and caches the result.
+          queries the database in manageable chunks, saves each chunk, merges them, and caches the result
+          as a dataset with one parquet file per year (see utils/partitioned_parquet.py).
         - If a specific `permno_list` is provided, the method queries the database for just those PERMNOs.
+        - If `stream_to` is given, the query (over all PERMNOs when `permno_list` is None) is streamed
+          through a server-side cursor into that parquet file without chunking or materializing it,
+          and the write statistics are returned.
 
         Parameters
         ----------
@@ -127,6 +264,18 @@ class WRDSManager():
             Whether to crop the data by year. Default is False. Otherwise give a year as an integer, like 2020. This option does not work if you pass permno_list as None.
         permno_list : list or None, optional
             List of PERMNOs to retrieve. If None, retrieves all available PERMNOs.
+        n_workers : int, optional
+            Number of parallel WRDS connections used for the chunked full download. Default is 1 (serial).
+        stream_to : str, optional
+            Parquet file to stream the result to instead of returning it.
+        incremental : bool, optional
+            Fetch the rows newer than the cache (minus `lookback_days`) before loading it. Default is False.
+        lookback_days : int, optional
+            Calendar days before the last cached date that are fetched again to pick up CRSP revisions.
+        chunk_rows : int or None, optional
+            Target rows per chunk of the full download. The PERMNOs are packed by their row counts
+            (from the previous download's manifest, else a COUNT query). None splits them into 10
+            chunks of equal PERMNO counts instead.
 
         Returns
         -------
@@ -137,46 +286,122 @@ class WRDSManager():
         # Ensure required directories exist
         os.makedirs(os.path.dirname(cache_path), exist_ok=True)
 
-        template = env.get_template("pricevol/crsp_dsf.sql.j2") # template for the sql query
+        template_name = "pricevol/crsp_dsf.sql.j2" # template for the sql query
+
+        if stream_to is not None:
+            print("Streaming CRSP daily data to parquet...")
+            sql, params = self._render(template_name, permno_list=permno_list, start_date=start_date, crop_by_year=crop_by_year if permno_list is not None else False)
+            return self._run(sql, params=params, stream_to=stream_to, family=template_name)
 
         # If permno_list is None, retrieve all permnos in chunks and cache the result
         if permno_list is None:
             link_df = self.permco_gvkey_link()
             permno_list = link_df['permno'].dropna().unique()            
 
-            if os.path.exists(cache_path):
+            if max_date(cache_path) is not None: # an empty or partly written cache is downloaded again
+                if incremental:
+                    self.refresh_crsp_daily(cache_path=cache_path, lookback_days=lookback_days, permno_list=permno_list)
                 print("Cache file for CRSP daily data found. Loading from disk...")
-                return pd.read_parquet(cache_path)
+                return self._compact(read_partitions(cache_path), template_name)
             else:
                 print("Cache file for CRSP daily data not found. Starting SQL queries. This may take a while...")
-                sql_renderer = lambda x: template.render(permno_list=x, start_date=start_date, crop_by_year=False) # there is no crop_by_year when we do not specify permno, because we want to save all results into a parquet file
-                pricevol_df = sql_execution_in_chunks(self.db, sql_renderer, permno_list, cache_path, chunk_size=10)
+                sql_renderer = lambda x: self._render(template_name, permno_list=x, start_date=start_date, crop_by_year=False) # there is no crop_by_year when we do not specify permno, because we want to save all results into a parquet file
+                count_renderer = lambda x: self._render("pricevol/crsp_dsf_count.sql.j2", permno_list=x, start_date=start_date)
+                pricevol_df = sql_execution_in_chunks(
+                    self.db, sql_renderer, permno_list, cache_path, chunk_size=10, n_workers=n_workers,
+                    metrics=self.metrics, template=template_name,
+                    target_rows=chunk_rows, count_renderer=count_renderer, key_column='permno',
+                )
+                self._render_seconds = 0.0 # the chunks recorded their own render times
+                pricevol_df = self._compact(pricevol_df, template_name)
+                write_partitions(pricevol_df, cache_path, sort_by=['permno', 'date'])
                 
         # If a permno_list is provided, retrieve data for those permnos only
         else:
             print("Retrieving CRSP daily data for a specific permno list...")
-            sql = template.render(permno_list=permno_list, start_date=start_date, crop_by_year=crop_by_year)
-            pricevol_df = self.db.raw_sql(sql)
+            sql, params = self._render(template_name, permno_list=permno_list, start_date=start_date, crop_by_year=crop_by_year)
+            pricevol_df = self._run(sql, params=params, family=template_name)
 
         return pricevol_df
 
-    def get_price_target_summary(self, permno_list=None):
+    def refresh_crsp_daily(self, cache_path='data/pricevol/pricevol_raw.parquet', lookback_days=30, permno_list=None):
+        """
+        Bring the CRSP daily cache up to date without downloading it again.
+
+        Reads the last cached date, queries `crsp.dsf` for the PERMNOs of the cache from
+        `lookback_days` calendar days before it (CRSP revises recent records), replaces the cached
+        rows of that window with the fetched ones and rewrites only the yearly files the window
+        touches. `permno_list` defaults to the CCM-linked PERMNOs the full download holds.
+        Without any cached date (no cache, or an empty or partly written one) the cache is
+        downloaded in full with get_crsp_daily instead; window_start is then None.
+
+        Returns
+        -------
+        dict
+            window_start, last_date_before, last_date_after, rows_fetched and the rewritten years.
+        """
+        template_name = "pricevol/crsp_dsf.sql.j2"
+        last_date = max_date(cache_path)
+        if last_date is None:
+            print(f"No CRSP daily data cached at {cache_path}, downloading it in full...")
+            remove_dataset(cache_path)
+            df = self.get_crsp_daily(cache_path=cache_path)
+            return {
+                'window_start': None,
+                'last_date_before': None,
+                'last_date_after': max_date(cache_path),
+                'rows_fetched': len(df),
+                'years_rewritten': list(partition_files(cache_path)),
+            }
+        window_start = (last_date - pd.Timedelta(days=lookback_days)).normalize()
+        print(f"Refreshing CRSP daily data from {window_start.date()} (last cached date {last_date.date()})...")
+
+        if permno_list is None:
+            permno_list = self.permco_gvkey_link()['permno'].dropna().unique()
+
+        # not served from the query cache: the point is to see the latest revisions
+        sql, params = self._render(template_name, permno_list=list(permno_list), start_date=window_start.strftime('%Y-%m-%d'), crop_by_year=False)
+        new_df = self._run(sql, params=params, family=template_name, use_cache=False)
+        new_df['date'] = pd.to_datetime(new_df['date'])
+
+        if os.path.isfile(cache_path):
+            write_partitions(read_partitions(cache_path), cache_path, sort_by=['permno', 'date']) # convert a single-file cache to the yearly layout
+        files = partition_files(cache_path)
+        dtypes = dict(fastparquet.ParquetFile(files[min(files)]).dtypes) # keep the schema of the cached years
+
+        years = list(range(window_start.year, max(last_date.year, new_df['date'].max().year if len(new_df) else last_date.year) + 1))
+        old_tail = read_partitions(cache_path, start_date=f'{years[0]}-01-01')
+        old_tail = old_tail[pd.to_datetime(old_tail['date']) < window_start]
+        tail = pd.concat([old_tail, new_df], ignore_index=True)
+        write_partitions(tail, cache_path, years=years, dtypes=dtypes, sort_by=['permno', 'date'])
+
+        stats = {
+            'window_start': window_start,
+            'last_date_before': last_date,
+            'last_date_after': max_date(cache_path),
+            'rows_fetched': len(new_df),
+            'years_rewritten': years,
+        }
+        print(f"Fetched {stats['rows_fetched']} rows, CRSP daily data now ends on {stats['last_date_after'].date()} (rewrote {years}).")
+        return stats
+
+    def get_price_target_summary(self, permno_list=None, stream_to=None):
         """
         Get target price from CRSP daily data.
         """
-        template = env.get_template("analyst_estimation/price_target_summary.sql.j2")
-        sql = template.render(permno_list=permno_list)
-        return self.db.raw_sql(sql)
+        template_name = "analyst_estimation/price_target_summary.sql.j2"
+        sql, params = self._render(template_name, permno_list=permno_list)
+        return self._run(sql, params=params, stream_to=stream_to, family=template_name)
 
-    def get_price_target_detail(self, permno_list=None):
+    def get_price_target_detail(self, permno_list=None, stream_to=None):
         """
         Get target price from CRSP daily data.
         """
-        template = env.get_template("analyst_estimation/price_target.sql.j2")
-        sql = template.render(permno_list=permno_list)
-        return self.db.raw_sql(sql)
+        template_name = "analyst_estimation/price_target.sql.j2"
+        sql, params = self._render(template_name, permno_list=permno_list)
+        return self._run(sql, params=params, stream_to=stream_to, family=template_name)
 
-    def permco_gvkey_link(self):
+    def permco_gvkey_link(self, stream_to=None):
         """
         Get table mapping Compustat GVKEYs to CRSP PERMCOs and PERMNOs.
 
@@ -185,56 +410,117 @@ class WRDSManager():
         pandas.DataFrame
             Link table with GVKEY, iid, PERMNO, PERMCO, etc.
         """
-        sql = env.get_template("link_table/ccmxpf_linktable.sql.j2").render()
-        link_df = self.db.raw_sql(sql)
+        template_name = "link_table/ccmxpf_linktable.sql.j2"
+        sql, params = self._render(template_name)
+        link_df = self._run(sql, params=params, stream_to=stream_to, family=template_name)
         return link_df
 
-    def get_sp500_constituents_snapshot(self, year):
+    def get_sp500_constituents_snapshot(self, year, stream_to=None):
         """
         Get SP500 list from CRSP. with link table and gic sector. at a given year.
         """
-        template = env.get_template("sp500/sp500_constituents.sql.j2")
-        sql = template.render(year=year)
-        return self.db.raw_sql(sql)
+        template_name = "sp500/sp500_constituents.sql.j2"
+        sql, params = self._render(template_name, year=year)
+        return self._run(sql, params=params, stream_to=stream_to, family=template_name)
 
-    def get_raven_full_equities(self, year=2024, relevance_threshold=75, event_similarity_days_threshold=90, permno_list=None):
-        sql = env.get_template("ravenpack/rp_equities.sql.j2").render(
+    def get_raven_years(self, kind='equities'):
+        """
+        Years with a RavenPack table `rpna.rpa_full_{kind}_{year}` (kind: 'equities' or 'global_macro').
+        """
+        template_name = "ravenpack/rp_tables.sql.j2"
+        sql, params = self._render(template_name, kind=kind)
+        tables = self._run(sql, params=params, family=template_name)
+        return sorted(int(t.rsplit('_', 1)[1]) for t in tables['table_name'])
+
+    def _raven_previous_year(self, year, kind):
+        # the previous year's table holds the late events of Dec 31 that fall on Jan 1 of `year`
+        return year - 1 if (year - 1) in self.get_raven_years(kind) else None
+
+    def get_raven_full_equities(self, year=2024, relevance_threshold=75, event_similarity_days_threshold=90, permno_list=None, stream_to=None, exact_year=False):
+        """
+        Daily RavenPack sentiment per entity of the table of `year`. By default its trading days run from
+        Jan 1 to Jan 1 of the next year (events after 4:00 pm ET on Dec 31 roll over). With `exact_year`
+        only the trading days of `year` are returned, including the events of Dec 31 of the previous year's
+        table that roll over to Jan 1, so the results of consecutive years neither overlap nor need merging.
+        """
+        template_name = "ravenpack/rp_equities.sql.j2"
+        sql, params = self._render(template_name, 
             year=year, 
             relevance_threshold=relevance_threshold, 
             event_similarity_days_threshold=event_similarity_days_threshold,
-            permno_list=permno_list)
-        return self.db.raw_sql(sql).dropna(subset=['permco', 'permno'], how='any').drop_duplicates(subset=['trading_day_et', 'permco', 'permno'])
+            permno_list=permno_list,
+            exact_year=exact_year,
+            previous_year=self._raven_previous_year(year, 'equities') if exact_year else None)
+        # when streaming, the duplicates are dropped within each batch
+        postprocess = lambda df: df.dropna(subset=['permco', 'permno'], how='any').drop_duplicates(subset=['trading_day_et', 'permco', 'permno'])
+        return self._run(sql, params=params, stream_to=stream_to, transform=postprocess, family=template_name)
 
 
-    def get_raven_global_macro(self, year=2024, relevance_threshold=75, event_similarity_days_threshold=90):
-        sql = env.get_template("ravenpack/rp_macro.sql.j2").render(
+    def get_raven_global_macro(self, year=2024, relevance_threshold=75, event_similarity_days_threshold=90, stream_to=None, exact_year=False):
+        """
+        Daily RavenPack global macro sentiment, US vs rest of the world. `exact_year` as in get_raven_full_equities.
+        """
+        template_name = "ravenpack/rp_macro.sql.j2"
+        sql, params = self._render(template_name, 
             year=year, 
             relevance_threshold=relevance_threshold, 
-            event_similarity_days_threshold=event_similarity_days_threshold)
-        return self.db.raw_sql(sql)
-
-    def get_taq_peek(self, sym_root_list=None, year=None, date=None):
-        sql = env.get_template("taq/taq_lib_peek.sql.j2").render(sym_root_list=sym_root_list, year=year, date=date)
-        return self.db.raw_sql(sql)
-
-    def get_taq_tables(self):
-        sql = env.get_template("taq/taq_table_peek.sql.j2").render()
-        return self.db.raw_sql(sql)
+            event_similarity_days_threshold=event_similarity_days_threshold,
+            exact_year=exact_year,
+            previous_year=self._raven_previous_year(year, 'global_macro') if exact_year else None)
+        return self._run(sql, params=params, stream_to=stream_to, family=template_name)
+
+    def get_taq_peek(self, sym_root_list=None, year=None, date=None, stream_to=None):
+        template_name = "taq/taq_lib_peek.sql.j2"
+        sql, params = self._render(template_name, sym_root_list=sym_root_list, year=year, date=date)
+        return self._run(sql, params=params, stream_to=stream_to, family=template_name)
+
+    def get_taq_tables(self, stream_to=None):
+        template_name = "taq/taq_table_peek.sql.j2"
+        sql, params = self._render(template_name)
+        return self._run(sql, params=params, stream_to=stream_to, family=template_name)
     
-    def get_taq_retail_markethour(self, date='2021-12-31', sym_root_list=None, retail_cutoff_upper=100000, retail_cutoff_lower=0):
-        sql = env.get_template("taq/taq_retail_markethour.sql.j2").render(
+    def get_taq_retail_markethour(self, date='2021-12-31', sym_root_list=None, retail_cutoff_upper=100000, retail_cutoff_lower=0, stream_to=None):
+        template_name = "taq/taq_retail_markethour.sql.j2"
+        sql, params = self._render(template_name, 
             year=date.split('-')[0], 
             date=date.replace('-', ''), 
             sym_root_list=sym_root_list, 
             retail_cutoff_upper=retail_cutoff_upper, 
             retail_cutoff_lower=retail_cutoff_lower
         )
-        return self.db.raw_sql(sql)
+        return self._run(sql, params=params, stream_to=stream_to, family=template_name)
     
-    def get_taq_link_table(self, date='2021-12-31', permno_list=None, symbol_root=None, start_date='2013-01-01'):
-        sql = env.get_template("taq/taq_link_table.sql.j2").render(date=date, permno_list=permno_list, symbol_root=symbol_root, start_date=start_date)
-        return self.db.raw_sql(sql)
+    def get_taq_retail_markethour_buckets(self, date='2021-12-31', sym_root_list=None, buckets=((100000, 0),), bin_minutes=None, stream_to=None):
+        """
+        get_taq_retail_markethour for several (retail_cutoff_upper, retail_cutoff_lower) dollar-size
+        buckets in one scan of the day's trades, optionally with intraday bins of `bin_minutes`
+        (e.g. [5, 30, 60]) minutes from the same scan.
+
+        Returns
+        -------
+        pandas.DataFrame
+            One row per date, symbol and bucket: the columns of get_taq_retail_markethour plus
+            retail_cutoff_upper and retail_cutoff_lower. A bucket without trades of a symbol has no row.
+            With bin_minutes, also one row per non-empty bin, in long format: bin_minutes is the bin
+            size (0 for the daily totals) and bin_start the minute of the day at which the bin starts
+            (bins are counted from 09:30, 570 for the daily totals).
+        """
+        template_name = "taq/taq_retail_markethour_buckets.sql.j2"
+        sql, params = self._render(template_name,
+            year=date.split('-')[0],
+            date=date.replace('-', ''),
+            sym_root_list=sym_root_list,
+            buckets=[(upper or 0, lower or 0) for upper, lower in buckets],
+            bin_minutes=sorted(set(bin_minutes or [])),
+        )
+        return self._run(sql, params=params, stream_to=stream_to, family=template_name)
+
+    def get_taq_link_table(self, date='2021-12-31', permno_list=None, symbol_root=None, start_date='2013-01-01', end_date=None, stream_to=None):
+        template_name = "taq/taq_link_table.sql.j2"
+        sql, params = self._render(template_name, date=date, permno_list=permno_list, symbol_root=symbol_root, start_date=start_date, end_date=end_date)
+        return self._run(sql, params=params, stream_to=stream_to, family=template_name)
 
-    def get_eps_detail(self, permno_list=None, qtr=True, ann=True):
-        sql = env.get_template("analyst_estimation/eps_detail.sql.j2").render(permno_list=permno_list, qtr=qtr, ann=ann)
-        return self.db.raw_sql(sql)
\ No newline at end of file
+    def get_eps_detail(self, permno_list=None, qtr=True, ann=True, stream_to=None):
+        template_name = "analyst_estimation/eps_detail.sql.j2"
+        sql, params = self._render(template_name, permno_list=permno_list, qtr=qtr, ann=ann)
+        return self._run(sql, params=params, stream_to=stream_to, family=template_name)
\ No newline at end of file
@@ -8,6 +8,7 @@ import inspect
 from academic_data_download.utils.save_file import save_file
 from academic_data_download.utils.necessary_cond_calculation import check_if_calculation_needed
 from academic_data_download.utils.sneak_peek import sneak_peek
+from academic_data_download.utils.col_transform import panel_lead_lag
 from academic_data_download.db_manager.wrds_sql import WRDSManager
 
 def analyst_estimator(fn: Callable) -> Callable:
@@ -77,8 +78,9 @@ class AnalystEstimationBuilder():
         df['revision'] = (
             df.groupby('analyst_coverage_id').cumcount()
         )
-        df['last_pt'] = df.groupby('analyst_coverage_id')['pt'].transform(lambda x: x.shift(1))
-        df['last_ann_deemed_date'] = df.groupby('analyst_coverage_id')['ann_deemed_date'].transform(lambda x: x.shift(1))
+        previous = panel_lead_lag(df, by='analyst_coverage_id', cols=['pt', 'ann_deemed_date'], offsets=[-1], name='last_{col}')
+        df['last_pt'] = previous['last_pt']
+        df['last_ann_deemed_date'] = previous['last_ann_deemed_date']
         return df
 
     @analyst_estimator
@@ -5,6 +5,7 @@ import inspect
 from functools import wraps
 
 from academic_data_download.db_manager.wrds_sql import WRDSManager
+from academic_data_download.db_manager.fundamentals_store import FundamentalsStore, FUNDQ_COLUMNS, FUNDA_COLUMNS
 from academic_data_download.utils.save_file import save_file
 from academic_data_download.utils.necessary_cond_calculation import check_if_calculation_needed
 from academic_data_download.utils.sneak_peek import sneak_peek
@@ -41,11 +42,17 @@ def factor(fn: Callable) -> Callable:
     return wrapper
 
 class FactorBuilder():
-    def __init__(self, verbose, db, gvkey_list, save_path='data/factors/single_factor'):
+    def __init__(self, verbose, db, gvkey_list, save_path='data/factors/single_factor', fund_store_path='data/fundamentals', prefetch=True):
         self.verbose = verbose
         self.gvkey_list = gvkey_list
         self.wrds_manager = WRDSManager(db, verbose=verbose)
         self.save_path = save_path
+
+        # every factor reads its fundamentals from the local store, which fetches each column from WRDS only once
+        self.fund_store = FundamentalsStore(self.wrds_manager, gvkey_list=gvkey_list, path=fund_store_path, verbose=verbose)
+        if prefetch:
+            self.fund_store.prefetch('fundq', FUNDQ_COLUMNS)
+            self.fund_store.prefetch('funda', FUNDA_COLUMNS)
         pvc = PriceVolComputer(permno_list=None, verbose=False, db=db)
         self.spy_pricevol = PriceVolComputer(permno_list=[84398], verbose=False, db=db).pricevol_raw()
 
@@ -69,7 +76,7 @@ class FactorBuilder():
         """
         if qtr:
             # revtq: revenue, cogsq: cost of goods sold, atq: total assets
-            fund_df = self.wrds_manager.get_fundq(fund_list=["revtq", "cogsq", "atq"], gvkey_list=self.gvkey_list) 
+            fund_df = self.fund_store.get_fundq(fund_list=["revtq", "cogsq", "atq"]) 
             
             # group by gvkey and rolling sum of saleq for the last 4 quarters
             fund_df['revtq_ltm'] = rolling_sum(fund_df, 'revtq')
@@ -88,7 +95,7 @@ class FactorBuilder():
         Sales / Market Cap
         """
         if qtr:
-            fund_df = self.wrds_manager.get_fundq(fund_list=["saleq"], gvkey_list=self.gvkey_list) # saleq: sales
+            fund_df = self.fund_store.get_fundq(fund_list=["saleq"]) # saleq: sales
 
             fund_df['saleq_ltm'] = rolling_sum(fund_df, 'saleq')
 
@@ -106,7 +113,7 @@ class FactorBuilder():
         """
         if qtr:
             # seqq: Stockholders' Equity - Total, txditcc: deferred income tax, pstk: preferred stock
-            fund_df = self.wrds_manager.get_fundq(fund_list=["seqq", "txditcq", "pstkq"], gvkey_list=self.gvkey_list)
+            fund_df = self.fund_store.get_fundq(fund_list=["seqq", "txditcq", "pstkq"])
 
             # forward fill
             for col in ['txditcq', 'pstkq', 'seqq']:
@@ -126,7 +133,7 @@ class FactorBuilder():
         Total Debt = Long Term Debt + Total Current Debt
         """
         if qtr:
-            fund_df = self.wrds_manager.get_fundq(fund_list=["dlttq", "dlcq"], gvkey_list=self.gvkey_list) # dlttq: long term debt, dlcq: total current debt
+            fund_df = self.fund_store.get_fundq(fund_list=["dlttq", "dlcq"]) # dlttq: long term debt, dlcq: total current debt
             
             # fillna with 0
             fund_df['dlcq'] = fill_forward(fund_df, 'dlcq')
@@ -145,7 +152,7 @@ class FactorBuilder():
         Earnings / Market Cap
         """
         if qtr:
-            fund_df = self.wrds_manager.get_fundq(fund_list=["ibq"], gvkey_list=self.gvkey_list) # ibq: Income Before Extraordinary Items
+            fund_df = self.fund_store.get_fundq(fund_list=["ibq"]) # ibq: Income Before Extraordinary Items
             fund_df['ibq_ltm'] = rolling_sum(fund_df, 'ibq')
 
             res_df = merge_mktcap_fundq(self.mktcap_df, fund_df)
@@ -162,7 +169,7 @@ class FactorBuilder():
         """
         if qtr:
             # ibq: income before extraordinary items, dpq: depreciation and amortization
-            fund_df = self.wrds_manager.get_fundq(fund_list=["ibq", "dpq"], gvkey_list=self.gvkey_list) 
+            fund_df = self.fund_store.get_fundq(fund_list=["ibq", "dpq"]) 
 
             fund_df['dpq'] = fillna_with_0(fund_df, 'dpq')
             fund_df['cashflow'] = fund_df['ibq'] + fund_df['dpq']
@@ -183,7 +190,7 @@ class FactorBuilder():
         """
         if qtr:
             # dvpsxq: cash dividends paid per share, cshoq: common shares outstanding, cshopq: common shares outstanding repurchased, prcraq: price to book ratio
-            fund_df = self.wrds_manager.get_fundq(fund_list=["dvpsxq", "cshoq", "cshopq", "prcraq"], gvkey_list=self.gvkey_list)
+            fund_df = self.fund_store.get_fundq(fund_list=["dvpsxq", "cshoq", "cshopq", "prcraq"])
 
             fund_df['dvpsxq'] = fillna_with_0(fund_df, 'dvpsxq')
             fund_df['cshopq'] = fillna_with_0(fund_df, 'cshopq')
@@ -210,7 +217,7 @@ class FactorBuilder():
         """
         if qtr:
             # dlttq: long term debt, dlcq: total current debt, mibtq: noncontrolling intrest, cheq: cash and equivalents, pstkq: preferred stock
-            fund_df = self.wrds_manager.get_fundq(fund_list=["dlttq", "dlcq", "mibtq", "cheq", "pstkq", "oibdpq"], gvkey_list=self.gvkey_list) 
+            fund_df = self.fund_store.get_fundq(fund_list=["dlttq", "dlcq", "mibtq", "cheq", "pstkq", "oibdpq"]) 
 
             fund_df['dlttq'] = fill_forward(fund_df, 'dlttq')
             fund_df['dlcq'] = fill_forward(fund_df, 'dlcq')
@@ -240,8 +247,8 @@ class FactorBuilder():
         18  001690 2018-09-30   2018     0.0 2018-11-01
         """
         if not qtr:
-            fund_df = self.wrds_manager.get_funda(fund_list=["xad"], gvkey_list=self.gvkey_list) # adpq: advertising expenses
-            _merge_on_rdq_date = self.wrds_manager.get_fundq(fund_list=["ibq"], gvkey_list=self.gvkey_list)[['gvkey', 'rdq', 'datadate']] # adpq: advertising expenses
+            fund_df = self.fund_store.get_funda(fund_list=["xad"]) # adpq: advertising expenses
+            _merge_on_rdq_date = self.fund_store.get_fundq(fund_list=["ibq"])[['gvkey', 'rdq', 'datadate']] # adpq: advertising expenses
             fund_df = merge_funda_rdq(fund_df, _merge_on_rdq_date)
             # TODO wrap up this part nicer 
 
@@ -258,7 +265,7 @@ class FactorBuilder():
         Research and Development expenses / Market Cap
         """
         if qtr:
-            fund_df = self.wrds_manager.get_fundq(fund_list=["xrdq"], gvkey_list=self.gvkey_list) # xrdq: research and development expenses
+            fund_df = self.fund_store.get_fundq(fund_list=["xrdq"]) # xrdq: research and development expenses
             fund_df['xrdq'] = fillna_with_0(fund_df, 'xrdq')
             fund_df['xrdq_ltm'] = rolling_sum(fund_df, 'xrdq')
 
@@ -276,7 +283,7 @@ class FactorBuilder():
         """
         if qtr:
             # xsgaq: selling, general and administrative expenses, cogsq: cost of goods sold
-            fund_df = self.wrds_manager.get_fundq(fund_list=["xsgaq", "cogsq", "atq"], gvkey_list=self.gvkey_list) 
+            fund_df = self.fund_store.get_fundq(fund_list=["xsgaq", "cogsq", "atq"]) 
 
             fund_df['xsgaq'] = fillna_with_0(fund_df, 'xsgaq')
             fund_df['cogsq'] = fillna_with_0(fund_df, 'cogsq')
@@ -295,7 +302,7 @@ class FactorBuilder():
         Income Before Extraordinary Items / Total Assets
         """
         if qtr:
-            fund_df = self.wrds_manager.get_fundq(fund_list=["ibq", "atq"], gvkey_list=self.gvkey_list) # ibq: income before extraordinary items, atq: total assets
+            fund_df = self.fund_store.get_fundq(fund_list=["ibq", "atq"]) # ibq: income before extraordinary items, atq: total assets
             fund_df['atq'] = fill_forward(fund_df, 'atq')
 
             fund_df['ibq_ltm'] = rolling_sum(fund_df, 'ibq')
@@ -310,7 +317,7 @@ class FactorBuilder():
         Ranked from 1 to 10 by the sales growth rate, cross-sectional
         """
         if qtr:
-            fund_df = self.wrds_manager.get_fundq(fund_list=["saleq"], gvkey_list=self.gvkey_list)  # saleq: sales
+            fund_df = self.fund_store.get_fundq(fund_list=["saleq"])  # saleq: sales
             
             # Get lagged sale variable
             fund_df['saleq_ltm'] = rolling_sum(fund_df, 'saleq')
@@ -338,8 +345,8 @@ class FactorBuilder():
         """
         if qtr:
             # capx: capital expenditure, saleq: sales
-            fund_df_quarter = self.wrds_manager.get_fundq(fund_list=["saleq"], gvkey_list=self.gvkey_list)
-            fund_df_annual = self.wrds_manager.get_funda(fund_list=["capx"], gvkey_list=self.gvkey_list) 
+            fund_df_quarter = self.fund_store.get_fundq(fund_list=["saleq"])
+            fund_df_annual = self.fund_store.get_funda(fund_list=["capx"]) 
 
             # Merge both data frames
             fund_df = merge_funda_fundq(fund_df_quarter, fund_df_annual)
@@ -371,7 +378,7 @@ class FactorBuilder():
         See Cooper et al. (2008)
         """
         if qtr:
-            fund_df = self.wrds_manager.get_fundq(fund_list=["atq"], gvkey_list=self.gvkey_list) # atq: total assets
+            fund_df = self.fund_store.get_fundq(fund_list=["atq"]) # atq: total assets
             fund_df['atq'] = fill_forward(fund_df, 'atq')
 
             # Calculate investment to assets using current and lagged assets
@@ -387,7 +394,7 @@ class FactorBuilder():
         Change in property, plant, and equipment, and inventory, scaled by assets
         """
         if qtr:
-            fund_df = self.wrds_manager.get_fundq(fund_list=["invtq", "atq", "ppegtq"], gvkey_list=self.gvkey_list) # invtq: inventories, atq: total assets, ppegtq: property, plant, and equipment
+            fund_df = self.fund_store.get_fundq(fund_list=["invtq", "atq", "ppegtq"]) # invtq: inventories, atq: total assets, ppegtq: property, plant, and equipment
 
             fund_df['invtq'] = fill_forward(fund_df, 'invtq')
             fund_df['ppegtq'] = fill_forward(fund_df, 'ppegtq')
@@ -410,8 +417,8 @@ class FactorBuilder():
         """
         if qtr:
             # capx: capital expenditure
-            fund_df_quarter = self.wrds_manager.get_fundq(fund_list=["saleq"], gvkey_list=self.gvkey_list) # note: we just want to get the rdq column
-            fund_df_annual = self.wrds_manager.get_funda(fund_list=["capx"], gvkey_list=self.gvkey_list) 
+            fund_df_quarter = self.fund_store.get_fundq(fund_list=["saleq"]) # note: we just want to get the rdq column
+            fund_df_annual = self.fund_store.get_funda(fund_list=["capx"]) 
 
             # Merge both data frames
             fund_df = merge_funda_rdq(fund_df_annual, fund_df_quarter)
@@ -432,7 +439,7 @@ class FactorBuilder():
         See Thomas & Zhang (2002)
         """
         if qtr:
-            fund_df = self.wrds_manager.get_fundq(fund_list=["invtq", "atq"], gvkey_list=self.gvkey_list) # invtq: inventory, atq: total assets
+            fund_df = self.fund_store.get_fundq(fund_list=["invtq", "atq"]) # invtq: inventory, atq: total assets
             fund_df['invtq'] = fill_forward(fund_df, 'invtq')
             fund_df['atq'] = fill_forward(fund_df, 'atq')
 
@@ -457,7 +464,7 @@ class FactorBuilder():
             _to_retrieve = ["actq", "atq", "cheq", "lctq", "dlcq", "txpq", "dpq"]
             # actq: current assets, atq: total assets, cheq: cash and cash equivalents, lctq: current liabilities, 
             # dlcq: short-term debt, txpq: income taxes payable, dpq: depreciation and amortization
-            fund_df = self.wrds_manager.get_fundq(fund_list=_to_retrieve, gvkey_list=self.gvkey_list) 
+            fund_df = self.fund_store.get_fundq(fund_list=_to_retrieve) 
 
             # Get lagged values (4 quarters ago)
             for col in _to_retrieve:
@@ -488,8 +495,8 @@ class FactorBuilder():
             # actq: current assets, atq: total assets, cheq: cash and cash equivalents, lctq: current liabilities, dlcq: short-term debt, ivao: investments and advances, ltq: total liabilities, dlttq: long-term debt, ivstq: short-term investments, pstkq: preferred stock
             _to_retrieve = ["actq", "atq", "cheq", "lctq", "dlcq", "ltq", "dlttq", "ivstq", "pstkq"]
 
-            fund_df_quarter = self.wrds_manager.get_fundq(fund_list=_to_retrieve, gvkey_list=self.gvkey_list)
-            fund_df_annual = self.wrds_manager.get_funda(fund_list=["ivao"], gvkey_list=self.gvkey_list) 
+            fund_df_quarter = self.fund_store.get_fundq(fund_list=_to_retrieve)
+            fund_df_annual = self.fund_store.get_funda(fund_list=["ivao"]) 
 
             # Merge both data frames
             fund_df = merge_funda_fundq(fund_df_quarter, fund_df_annual)
@@ -523,8 +530,8 @@ class FactorBuilder():
             # sstk: sale of common and preferred stocks, atq: total assets, prstkc: purchase of common and preferred stocks, 
             # dvpsxq: cash dividends paid per share, cshoq: number of common shares outstanding, dltis: cash inflow issuance long-term debt, 
             # dltr: cash outflow reduction long-term debt, dlcch: change in current debt
-            fund_df_quarter = self.wrds_manager.get_fundq(fund_list=["atq", "dvpsxq", "cshoq"], gvkey_list=self.gvkey_list)
-            fund_df_annual = self.wrds_manager.get_funda(fund_list=["prstkc", "sstk", "dltis", "dltr", "dlcch"], gvkey_list=self.gvkey_list) 
+            fund_df_quarter = self.fund_store.get_fundq(fund_list=["atq", "dvpsxq", "cshoq"])
+            fund_df_annual = self.fund_store.get_funda(fund_list=["prstkc", "sstk", "dltis", "dltr", "dlcch"]) 
 
             # Merge both data frames
             fund_df = merge_funda_fundq(fund_df_quarter, fund_df_annual)
@@ -572,7 +579,7 @@ class FactorBuilder():
         if qtr:            
             # oiadpq: operating income before interest, atq: total assets, cheq: cash and short-term investments, 
             # dlttq: long-term debt, dlcq: short-term debt, ceqq: common equity, pstkq: preferred equity, mibq: minority interest
-            fund_df = self.wrds_manager.get_fundq(fund_list=["oiadpq", "atq", "cheq", "dlttq", "dlcq", "ceqq", "pstkq", "mibq"], gvkey_list=self.gvkey_list)
+            fund_df = self.fund_store.get_fundq(fund_list=["oiadpq", "atq", "cheq", "dlttq", "dlcq", "ceqq", "pstkq", "mibq"])
             
             # Get current and lagged values
             fund_df['oiadpq_ltm'] = rolling_sum(fund_df, 'oiadpq') # an income term
@@ -599,7 +606,7 @@ class FactorBuilder():
         See Soliman (2008)
         """
         if qtr:
-            fund_df = self.wrds_manager.get_fundq(fund_list=["oiadpq", "saleq"], gvkey_list=self.gvkey_list) # oiadpq: operating income before interest, saleq: sales
+            fund_df = self.fund_store.get_fundq(fund_list=["oiadpq", "saleq"]) # oiadpq: operating income before interest, saleq: sales
 
             # Get current values
             fund_df['oiadpq_ltm'] = rolling_sum(fund_df, 'oiadpq')
@@ -618,7 +625,7 @@ class FactorBuilder():
         """
         if qtr:
             # saleq: sales, atq: total assets, cheq: cash, ivao: short-term investments, dlttq: long-term debt, dlcq: short-term debt, ceqq: common equity, pstkq: preferred equity, mibq: minority interest
-            fund_df = self.wrds_manager.get_fundq(fund_list=["saleq", "atq", "cheq", "dlttq", "dlcq", "ceqq", "pstkq", "mibq"], gvkey_list=self.gvkey_list) 
+            fund_df = self.fund_store.get_fundq(fund_list=["saleq", "atq", "cheq", "dlttq", "dlcq", "ceqq", "pstkq", "mibq"]) 
             
             # Get current and lagged values
             fund_df['saleq_ltm'] = rolling_sum(fund_df, 'saleq')
@@ -646,7 +653,7 @@ class FactorBuilder():
         if qtr:
             # saleq: sales, cogsq: cost of goods sold, xsgaq: general and administrative expenses, 
             # xintq: interest expense, seqq: total equity, txditcq: deferred taxes and investment tax credit, pstkq: preferred stock
-            fund_df = self.wrds_manager.get_fundq(fund_list=["saleq", "cogsq", "xsgaq", "xintq", "seqq", "txditcq", "pstkq"], gvkey_list=self.gvkey_list)
+            fund_df = self.fund_store.get_fundq(fund_list=["saleq", "cogsq", "xsgaq", "xintq", "seqq", "txditcq", "pstkq"])
             
             # Get current and lagged values
             # Calculate last twelve months (LTM) sums for relevant columns
@@ -670,7 +677,7 @@ class FactorBuilder():
         """
         if qtr:
             # atq: total assets, seqq: total equity, txditcq: deferred taxes and investment tax credit, pstkq: preferred stock
-            fund_df = self.wrds_manager.get_fundq(fund_list=["atq", "seqq", "txditcq", "pstkq"], gvkey_list=self.gvkey_list) 
+            fund_df = self.fund_store.get_fundq(fund_list=["atq", "seqq", "txditcq", "pstkq"]) 
             
             for col in ['txditcq', 'pstkq']:
                 fund_df[col] = fill_forward(fund_df, col)
@@ -689,7 +696,7 @@ class FactorBuilder():
         if qtr:
             # ibq: income before extraordinary items, prstkcq: purchase of common and preferred stocks, dvpsxq: cash dividends paid per share, dpq: depreciation and amorization, 
             # ppentq: property, plant, and equipment, atq: total assets, ceq: common equity, txdbq: deferred taxes, dlttq: long-term debt, dlcq: debt in current liabilities, seqq: stockholder equity, dvpq: preferred dividends, cheq: cash and short-term investments
-            fund_df = self.wrds_manager.get_fundq(fund_list=["ibq", "dpq", "ppentq", "atq", "seqq", "txdbq", "dlttq", "dlcq", "ceqq", "dvpsxq", "cshoq", "dvpq", "cheq"], gvkey_list=self.gvkey_list) 
+            fund_df = self.fund_store.get_fundq(fund_list=["ibq", "dpq", "ppentq", "atq", "seqq", "txdbq", "dlttq", "dlcq", "ceqq", "dvpsxq", "cshoq", "dvpq", "cheq"]) 
             
             # total cash dividends
             fund_df['dvpsxq'] = fillna_with_0(fund_df, 'dvpsxq')
@@ -731,7 +738,7 @@ class FactorBuilder():
         """
         if qtr:
             # cheq: cash and short-term investments, atq: total assets, actq: current assets, ppentq: property, plant, and equipment
-            fund_df = self.wrds_manager.get_fundq(fund_list=["cheq", "atq", "actq", "ppentq"], gvkey_list=self.gvkey_list) 
+            fund_df = self.fund_store.get_fundq(fund_list=["cheq", "atq", "actq", "ppentq"]) 
             
             # Get current values
             for col in ['actq', 'ppentq', 'atq', 'cheq']:
@@ -751,7 +758,7 @@ class FactorBuilder():
         """
         if qtr:
             # cheq: cash and short-term investments, atq: total assets, actq: non-cash current assets, ppentq: property, plant, and equipment, ceqq: common equity, txditcq: deferred taxes and investment tax credit, pstkq: preferred stock
-            fund_df = self.wrds_manager.get_fundq(fund_list=["cheq", "atq", "actq", "ppentq", "seqq", "txditcq", "pstkq"], gvkey_list=self.gvkey_list) 
+            fund_df = self.fund_store.get_fundq(fund_list=["cheq", "atq", "actq", "ppentq", "seqq", "txditcq", "pstkq"]) 
             
             # Get current values
             for col in ["actq", "ppentq", "atq", "cheq", "seqq", "txditcq", "pstkq"]:
@@ -1,23 +1,60 @@
 from locale import D_FMT
+import os
+import time
 import pandas as pd
 import numpy as np
 from typing import Callable
 from functools import wraps
 import inspect
+import tqdm
 
 from academic_data_download.utils.save_file import save_file
 from academic_data_download.utils.necessary_cond_calculation import check_if_calculation_needed
 from academic_data_download.utils.sneak_peek import sneak_peek
 from academic_data_download.db_manager.wrds_sql import WRDSManager
 from academic_data_download.utils.merger import merge_permco_gvkey_link, merge_link_table_crsp
+from academic_data_download.utils.partitioned_parquet import write_partitions, read_partitions, max_date, remove_dataset, PartitionAppender
+from academic_data_download.utils.shard_runner import key_row_counts, plan_shards, run_shards, concat_shards
+from academic_data_download.utils.panel_store import build_panel_store, PanelStore
+from academic_data_download.utils.rolling_screener import RollingState, run_screens
+
+RETURN_WINDOWS = [252, 5, 126, 22, 1]
+
+# outputs saved as year-partitioned datasets (see utils/partitioned_parquet.py), with their sort order within a year
+PARTITIONED = {
+    'pricevol_raw': ['permno', 'date'],
+    'pricevol_processed': ['permno', 'date'],
+    'marketcap': ['permco', 'date'],
+}
+
+# live screener: daily secd fields kept per security, windows (trading days) and screens (DataFrame.query on the features)
+LIVE_FIELDS = ['turnover', 'dvol', 'prccd', 'mktcap', 'cshtrd']
+LIVE_WINDOWS = [5, 20, 60]
+LIVE_SCREENS = {
+    'high_turnover': 'mktcap > 5 and turnover > 10 and prccd > 10 and prccd < 200',
+    'volume_spike': 'mktcap > 1 and cshtrd_z20 > 3',
+    'turnover_breakout': 'mktcap > 1 and turnover > 3 * turnover_ma20 and dvol_ma5 > 0.05',
+}
+
+# columns of pricevol_raw in the dense permno x trading day store (see pricevol_panel)
+PANEL_COLUMNS = ['permco', 'prc', 'ret', 'retx', 'vol', 'shrout', 'cfacpr', 'cfacshr', 'openprc']
+
+# peak memory per row of pricevol_raw while a shard is processed (measured, with margin), to size the shards to a memory budget
+SHARD_BYTES_PER_ROW = {
+    'pricevol_processed': 1200,
+    'marketcap': 400,
+}
+
 
 def pricevol(fn: Callable) -> Callable:
+    default_name = inspect.signature(fn).parameters['name'].default
+
     @wraps(fn)
     def wrapper(self, *args, **kwargs):
-        name = kwargs.get('name', 'crsp_daily')
+        name = kwargs.get('name', default_name)
         if not check_if_calculation_needed(name, self.permno_list, save_path=self.save_path):
             print(f'Done with {name} loading from cache!')
-            df = pd.read_parquet(f'{self.save_path}/{name}.parquet')
+            df = read_partitions(f'{self.save_path}/{name}.parquet')
             return df
 
         df = fn(self, *args, **kwargs)
@@ -25,11 +62,140 @@ def pricevol(fn: Callable) -> Callable:
             print("peeks at the data after calculation!")
             sneak_peek(df)
         if self.permno_list is None:
-            save_file(df, name, path=self.save_path)
+            self._save(df, name)
         print(f'Done with {name}!')
         return df
     return wrapper
 
+
+def window_returns(df, col, windows, by='permno'):
+    """
+    Compounded returns of `col` over every window of `windows`, per `by` group in row order, in one
+    pass: {window: (cum, fwd)}, with cum = prod(1 + r) - 1 over the window rows ending at the row
+    (missing before the group has `window` rows or if one of them is missing, -1 if one of them is
+    -100%) and fwd = the cum of the row `window` rows later, both rounded to 4 decimals.
+
+    The products are differences of a cumulative sum of log(1 + r), so the cost does not grow
+    with the window; equal to the rolling np.prod to the 4 decimals kept.
+    """
+    values = df[col].to_numpy(dtype=np.float64, na_value=np.nan)
+    codes = df.groupby(by, sort=False).ngroup().to_numpy()
+    order = np.argsort(codes, kind='stable') # the rows of a group together, in row order
+    values, codes = values[order], codes[order]
+    n = len(values)
+    starts = np.r_[0, np.flatnonzero(np.diff(codes)) + 1] if n else np.array([], dtype=np.int64)
+    sizes = np.diff(np.r_[starts, n])
+    pos = np.arange(n) - np.repeat(starts, sizes)
+    size = np.repeat(sizes, sizes)
+
+    missing = np.isnan(values)
+    wiped = values <= -1 # log1p(-1) = -inf: counted apart, the product is then 0
+    log_sum = np.r_[0, np.cumsum(np.log1p(np.where(missing | wiped, 0, values)))]
+    missing_sum = np.r_[0, np.cumsum(missing)]
+    wiped_sum = np.r_[0, np.cumsum(wiped)]
+
+    rows = np.arange(n)
+    out = {}
+    for window in windows:
+        first = np.maximum(rows - window + 1, 0)
+        cum = np.expm1(log_sum[rows + 1] - log_sum[first])
+        cum[wiped_sum[rows + 1] - wiped_sum[first] > 0] = -1
+        cum[(missing_sum[rows + 1] - missing_sum[first] > 0) | (pos < window - 1) | (codes < 0)] = np.nan
+        cum = np.round(cum, 4)
+        later = pos + window < size
+        fwd = np.full(n, np.nan)
+        fwd[later] = cum[rows[later] + window]
+        # back to the row order of df
+        cum_out, fwd_out = np.empty(n), np.empty(n)
+        cum_out[order], fwd_out[order] = cum, fwd
+        out[window] = (cum_out, fwd_out)
+    return out
+
+
+def add_returns(df):
+    """
+    Adjusted close plus cumulative and forward returns over RETURN_WINDOWS, per permno in row order.
+    """
+    print("Converting date column to datetime...")
+    df['date'] = pd.to_datetime(df['date'])
+    print("Calculating adjusted close price...")
+    df['adjclose'] = round(df['prc'] / df['cfacpr'], 3)
+    df['ret'] = round(df['ret'], 4)
+    df['retx'] = round(df['retx'], 4)
+
+    print(f"Calculating {RETURN_WINDOWS}-day cumulative and forward returns (including and excluding dividends)...")
+    returns = {col: window_returns(df, col, RETURN_WINDOWS) for col in ['ret', 'retx']}
+    for _day in RETURN_WINDOWS:
+        df[f'cum_ret_{_day}d'], df[f'fwd_ret_{_day}d'] = returns['ret'][_day]
+        df[f'cum_ret_{_day}d_excl_div'], df[f'fwd_ret_{_day}d_excl_div'] = returns['retx'][_day]
+    return df
+
+
+def compute_marketcap(pricevol_df, permco_gvkey_link_df):
+    # calculate marketcap
+    pricevol_df['marketcap_permno'] = pricevol_df['prc'] * pricevol_df['shrout']
+
+    # sum across different permno for each permco (account for different share class)
+    mktcap_df = pricevol_df.groupby(['date','permco']).agg({'marketcap_permno': 'sum'}).reset_index()
+    mktcap_df.rename(columns={'marketcap_permno': 'marketcap'}, inplace=True)
+    
+    # round to integer
+    mktcap_df['marketcap'] = mktcap_df['marketcap'].astype(int) / 1000 # in millions (default record in thousands)
+
+    # merge with link table
+    mktcap_df = merge_permco_gvkey_link(mktcap_df, permco_gvkey_link_df)
+    return mktcap_df
+
+
+def secd_metrics(df):
+    """
+    Turnover (in percent), dollar volume and market cap (in billions) of comp.secd rows.
+    """
+    df['turnover'] = (df['cshtrd'] / df['cshoc'] * 100).round(2) # in percentage
+    df['dvol'] = (df['prccd'] * df['cshtrd'] / 1e9).round(2) # in billions
+    df['mktcap'] = (df['prccd'] * df['cshoc'] / 1e9).round(2) # in billions
+    return df
+
+
+def security_groups(counts, max_rows):
+    """
+    Groups of permnos of at most about `max_rows` rows that never split a permno nor a permco:
+    `counts` has permco, permno and rows (see shard_runner.key_row_counts); permnos that shared
+    a permco at some point, directly or through other permnos, are always in the same group.
+    """
+    counts = counts.copy()
+    counts['permco'] = counts['permco'].astype('Float64').fillna(-counts['permno'] - 1) # no permco: a company of its own
+    # smallest permno connected to every permno, by alternating minimums over permcos and permnos
+    label = counts['permno'].astype('int64')
+    while True:
+        new = label.groupby(counts['permco']).transform('min').groupby(counts['permno']).transform('min')
+        if new.equals(label):
+            break
+        label = new
+    component_rows = counts['rows'].groupby(label).sum()
+    permnos = counts.groupby(label)['permno'].unique()
+    groups = plan_shards(component_rows, max_rows)
+    return [np.concatenate([permnos[c] for c in group]).tolist() for group in groups]
+
+
+def _pricevol_processed_shard(permnos, out_root, raw_path, permco_gvkey_link_df):
+    # one shard of pricevol_processed, run in a worker process (see PriceVolComputer.pricevol_processed_sharded)
+    df = add_returns(read_partitions(raw_path, permnos=permnos))
+    df = merge_link_table_crsp(crsp_df=df, link_df=permco_gvkey_link_df)
+    write_partitions(df, out_root, sort_by=PARTITIONED['pricevol_processed'])
+    return len(df)
+
+
+def _marketcap_shard(permcos, out_root, raw_path, permco_gvkey_link_df, permnos_of_permco):
+    # one shard of marketcap: all rows of the permnos that belong to the permcos
+    permnos = permnos_of_permco.loc[permnos_of_permco['permco'].isin(permcos), 'permno'].unique()
+    pricevol_df = read_partitions(raw_path, permnos=permnos)
+    pricevol_df = pricevol_df[pricevol_df['permco'].isin(permcos)].copy()
+    df = compute_marketcap(pricevol_df, permco_gvkey_link_df)
+    write_partitions(df, out_root, sort_by=PARTITIONED['marketcap'])
+    return len(df)
+
+
 class PriceVolComputer():
     def __init__(self, verbose, db, permno_list):
         self.verbose = verbose
@@ -37,12 +203,30 @@ class PriceVolComputer():
         self.permno_list = permno_list
         self.save_path = 'data/pricevol'
 
-    @pricevol
-    def pricevol_raw(self, name='pricevol_raw'):
+    def _save(self, df, name, years=None):
+        if name in PARTITIONED:
+            write_partitions(df, f'{self.save_path}/{name}.parquet', years=years, sort_by=PARTITIONED[name])
+            print(f"Saved {name} to {self.save_path}/{name}.parquet")
+        else:
+            save_file(df, name, path=self.save_path)
+
+    def load(self, name='pricevol_processed', start_date=None, end_date=None, permnos=None, columns=None):
+        """
+        Load a saved output, reading only the years in [start_date, end_date], the row groups that
+        can hold `permnos` (permcos for marketcap) and the given `columns`.
+        """
+        id_col = PARTITIONED.get(name, ['permno'])[0]
+        return read_partitions(f'{self.save_path}/{name}.parquet', start_date=start_date, end_date=end_date, permnos=permnos, columns=columns, id_col=id_col)
+
+    def pricevol_raw(self, name='pricevol_raw', incremental=False, lookback_days=30):
         """
         Retrieve raw price and volume data.
+        The full download is cached by get_crsp_daily itself (one file per year in {save_path}/pricevol_raw.parquet).
         """
-        df = self.wrds_manager.get_crsp_daily(cache_path=f'{self.save_path}/pricevol_raw.parquet', permno_list=self.permno_list)
+        df = self.wrds_manager.get_crsp_daily(cache_path=f'{self.save_path}/{name}.parquet', permno_list=self.permno_list, incremental=incremental, lookback_days=lookback_days)
+        if self.verbose:
+            print("peeks at the data after calculation!")
+            sneak_peek(df)
         return df
 
     @pricevol
@@ -54,32 +238,7 @@ class PriceVolComputer():
         permco_gvkey_link_df = self.wrds_manager.permco_gvkey_link()
 
         # get pricevol data
-        df = self.pricevol_raw()
-        print("Converting date column to datetime...")
-        df['date'] = pd.to_datetime(df['date'])
-        print("Calculating adjusted close price...")
-        df['adjclose'] = round(df['prc'] / df['cfacpr'], 3)
-        df['ret'] = round(df['ret'], 4)
-        df['retx'] = round(df['retx'], 4)
-
-        for _day in [252, 5, 126, 22, 1]:
-            print(f"Calculating {_day}-day cumulative return (including dividends)...")
-            df[f'cum_ret_{_day}d'] = round(df.groupby(['permno'])['ret'].transform(
-                lambda x: x.rolling(window=_day).apply(lambda y: np.prod(1 + y) - 1)
-            ), 4)
-            print(f"Calculating {_day}-day forward return (including dividends)...")
-            df[f'fwd_ret_{_day}d'] = round(df.groupby(['permno'])[f'cum_ret_{_day}d'].transform(
-                lambda x: x.shift(-_day)
-            ), 4)
-
-            print(f"Calculating {_day}-day cumulative return (excluding dividends)...")
-            df[f'cum_ret_{_day}d_excl_div'] = round(df.groupby(['permno'])['retx'].transform(
-                lambda x: x.rolling(window=_day).apply(lambda y: np.prod(1 + y) - 1)
-            ), 4)
-            print(f"Calculating {_day}-day forward return (excluding dividends)...")
-            df[f'fwd_ret_{_day}d_excl_div'] = round(df.groupby(['permno'])[f'cum_ret_{_day}d_excl_div'].transform(
-                lambda x: x.shift(-_day)
-            ), 4)
+        df = add_returns(self.pricevol_raw())
 
         # merge with link table
         df = merge_link_table_crsp(crsp_df=df, link_df=permco_gvkey_link_df)
@@ -92,33 +251,213 @@ class PriceVolComputer():
 
         # get pricevol data
         pricevol_df = self.pricevol_raw()
+        return compute_marketcap(pricevol_df, permco_gvkey_link_df)
 
-        # calculate marketcap
-        pricevol_df['marketcap_permno'] = pricevol_df['prc'] * pricevol_df['shrout']
+    def pricevol_panel(self, name='pricevol_panel', columns=PANEL_COLUMNS, dtypes=None, rebuild=False):
+        """
+        The cached pricevol_raw as a memory-mapped permno x trading day store in {save_path}/{name}/
+        (see utils/panel_store.py), built one year at a time if it does not exist (or `rebuild`).
+        float32 / int32 by default; `dtypes` overrides, e.g. {'prc': 'float64'}.
+        """
+        root = f'{self.save_path}/{name}'
+        if rebuild or not os.path.exists(root):
+            raw_path = f'{self.save_path}/pricevol_raw.parquet'
+            if not os.path.exists(raw_path):
+                self.pricevol_raw()
+            return build_panel_store(raw_path, root, columns=list(columns), dtypes=dtypes)
+        return PanelStore(root)
 
-        # sum across different permno for each permco (account for different share class)
-        mktcap_df = pricevol_df.groupby(['date','permco']).agg({'marketcap_permno': 'sum'}).reset_index()
-        mktcap_df.rename(columns={'marketcap_permno': 'marketcap'}, inplace=True)
-        
-        # round to integer
-        mktcap_df['marketcap'] = mktcap_df['marketcap'].astype(int) / 1000 # in millions (default record in thousands)
+    def _run_sharded(self, name, fn, row_counts, args, n_workers, memory_budget):
+        if self.permno_list is not None:
+            raise ValueError("sharded runs only apply to the full universe (permno_list=None)")
+        if not check_if_calculation_needed(name, self.permno_list, save_path=self.save_path):
+            print(f'{self.save_path}/{name}.parquet already exists')
+            return None
+        shards = plan_shards(row_counts, max_rows=memory_budget / SHARD_BYTES_PER_ROW[name])
+        print(f"Computing {name} in {len(shards)} shards of at most {int(memory_budget / SHARD_BYTES_PER_ROW[name])} rows with {n_workers} processes...")
+        shard_root = f'{self.save_path}/{name}_shards'
+        stats = run_shards(fn, shards, shard_root, n_workers=n_workers, args=args, desc=name)
+        concat_shards(shard_root, f'{self.save_path}/{name}.parquet', len(shards), sort_by=PARTITIONED[name])
+        print(f"Saved {name} to {self.save_path}/{name}.parquet ({stats['seconds']:.0f}s)")
+        return stats
 
-        # merge with link table
-        mktcap_df = merge_permco_gvkey_link(mktcap_df, permco_gvkey_link_df)
-        return mktcap_df
-    
-    @pricevol
-    def live_pricevol(self, name='live_pricevol', start_date=None, end_date=None):
-        # get link table
-        df = self.wrds_manager.get_secd_daily(start_date=start_date, end_date=end_date)
-        df['turnover'] = (df['cshtrd'] / df['cshoc'] * 100).round(2) # in percentage
-        df['dvol'] = (df['prccd'] * df['cshtrd'] / 1e9).round(2) # in billions
-        df['mktcap'] = (df['prccd'] * df['cshoc'] / 1e9).round(2) # in billions
-
-        # moving averages 
-        # TODO
-
-        print(df.query('mktcap > 5 and turnover > 10 and tpci != "%" and prccd > 10 and prccd < 200').sort_values('turnover', ascending=False).head(50))
-        print(df.columns.to_list())
-        # print(df.sort_values("mktcap", ascending=False).head(50))
-        assert False
\ No newline at end of file
+    def pricevol_processed_sharded(self, name='pricevol_processed', n_workers=None, memory_budget=4e9):
+        """
+        pricevol_processed over the full universe without holding it in one process: the cached
+        pricevol_raw is split into shards of contiguous permnos, sized so that processing one
+        needs about `memory_budget` bytes, and the shards run in a pool of `n_workers` processes
+        (default: all cores). Each shard writes its own year files, which are then combined into
+        {save_path}/pricevol_processed.parquet one year at a time. Same rows as pricevol_processed.
+
+        Returns
+        -------
+        dict
+            shards, skipped (done by an interrupted earlier run), rows and seconds; None if the output exists.
+        """
+        raw_path = f'{self.save_path}/pricevol_raw.parquet'
+        if not os.path.exists(raw_path):
+            self.pricevol_raw()
+        row_counts = key_row_counts(raw_path, 'permno').set_index('permno')['rows']
+        args = (raw_path, self.wrds_manager.permco_gvkey_link())
+        return self._run_sharded(name, _pricevol_processed_shard, row_counts, args, n_workers or os.cpu_count(), memory_budget)
+
+    def marketcap_sharded(self, name='marketcap', n_workers=None, memory_budget=4e9):
+        """
+        marketcap in shards of contiguous permcos (so the share classes of a company are summed in
+        the same shard), run like pricevol_processed_sharded.
+        """
+        raw_path = f'{self.save_path}/pricevol_raw.parquet'
+        if not os.path.exists(raw_path):
+            self.pricevol_raw()
+        counts = key_row_counts(raw_path, 'permco', extra_cols=['permno'])
+        row_counts = counts.groupby('permco')['rows'].sum()
+        args = (raw_path, self.wrds_manager.permco_gvkey_link(), counts[['permco', 'permno']])
+        return self._run_sharded(name, _marketcap_shard, row_counts, args, n_workers or os.cpu_count(), memory_budget)
+
+    def pricevol_out_of_core(self, memory_budget=2e9):
+        """
+        pricevol_processed and marketcap of the full universe with bounded memory: the cached
+        pricevol_raw is read in groups of contiguous securities (whole permnos and permcos, see
+        security_groups) of about `memory_budget` bytes of processing each. Every group goes
+        through the returns, the link table and the market cap, and is appended to the year files
+        of both outputs before the next one is read, so the peak memory does not depend on the
+        size of the universe nor the length of the history. Same rows as pricevol_processed and
+        marketcap; within a year file, the rows are sorted per group of securities.
+
+        Returns
+        -------
+        dict
+            groups, the rows of both outputs and seconds.
+        """
+        if self.permno_list is not None:
+            raise ValueError("the out-of-core run only applies to the full universe (permno_list=None)")
+        raw_path = f'{self.save_path}/pricevol_raw.parquet'
+        if not os.path.exists(raw_path):
+            self.pricevol_raw()
+        permco_gvkey_link_df = self.wrds_manager.permco_gvkey_link()
+        counts = key_row_counts(raw_path, 'permco', extra_cols=['permno'])
+        max_rows = memory_budget / max(SHARD_BYTES_PER_ROW.values())
+        groups = security_groups(counts, max_rows)
+        print(f"Computing pricevol_processed and marketcap out of core in {len(groups)} groups of at most {int(max_rows)} rows...")
+
+        start = time.perf_counter()
+        appenders = {name: PartitionAppender(f'{self.save_path}/{name}.parquet', sort_by=PARTITIONED[name]) for name in ['pricevol_processed', 'marketcap']}
+        for permnos in tqdm.tqdm(groups, desc="pricevol out of core", unit='group'):
+            df = add_returns(read_partitions(raw_path, permnos=permnos))
+            appenders['pricevol_processed'].append(merge_link_table_crsp(crsp_df=df, link_df=permco_gvkey_link_df))
+            appenders['marketcap'].append(compute_marketcap(df, permco_gvkey_link_df))
+            del df
+        stats = {'groups': len(groups), **{name: appender.close() for name, appender in appenders.items()}, 'seconds': time.perf_counter() - start}
+        print(f"Saved pricevol_processed ({stats['pricevol_processed']} rows) and marketcap ({stats['marketcap']} rows) to {self.save_path} ({stats['seconds']:.0f}s)")
+        return stats
+
+    def refresh(self, lookback_days=30):
+        """
+        Incremental update: fetch the new CRSP rows (plus a look-back window for revisions) into the
+        raw cache, then recompute only the affected tail of pricevol_processed and marketcap.
+
+        A permno's rows from `window_start` on are new or revised. Their cumulative returns need the
+        max(RETURN_WINDOWS) rows before them, and the forward returns of those earlier rows change
+        too, so each affected permno is recomputed from 2 * max(RETURN_WINDOWS) rows before its first
+        revised row and its output replaced from max(RETURN_WINDOWS) rows before. Market cap is a
+        per-date aggregate, only the dates of the window are recomputed.
+
+        An output that is not stored yet (or empty, or partly written), or all of them after a full
+        download of the raw cache, is computed in full instead.
+        """
+        if self.permno_list is not None:
+            raise ValueError("refresh only applies to the full universe (permno_list=None)")
+        stats = self.wrds_manager.refresh_crsp_daily(cache_path=f'{self.save_path}/pricevol_raw.parquet', lookback_days=lookback_days)
+        window_start = stats['window_start'] # None after a full download
+        permco_gvkey_link_df = self.wrds_manager.permco_gvkey_link()
+        raw = self.pricevol_raw()
+        raw['date'] = pd.to_datetime(raw['date'])
+
+        processed_path = f'{self.save_path}/pricevol_processed.parquet'
+        if window_start is not None and max_date(processed_path) is not None:
+            max_window = max(RETURN_WINDOWS)
+            pos = raw.groupby('permno').cumcount()
+            first_revised = pos.where(raw['date'] >= window_start).groupby(raw['permno']).transform('min')
+            affected = first_revised.notna()
+            recompute = raw[affected & (pos >= first_revised - 2 * max_window)].copy()
+            replace_from = raw[affected & (pos == (first_revised - max_window).clip(lower=0))].set_index('permno')['date']
+            print(f"Recomputing returns of {raw.loc[affected, 'permno'].nunique()} permnos from {len(recompute)} rows...")
+
+            tail = merge_link_table_crsp(crsp_df=add_returns(recompute), link_df=permco_gvkey_link_df)
+            tail = tail[tail['date'] >= tail['permno'].map(replace_from)]
+            first_year = replace_from.min().year
+            old = read_partitions(processed_path, start_date=f'{first_year}-01-01')
+            old['date'] = pd.to_datetime(old['date'])
+            keep = old['date'] < old['permno'].map(replace_from).fillna(pd.Timestamp.max)
+            processed = pd.concat([old[keep], tail], ignore_index=True)
+            self._save(processed, 'pricevol_processed', years=range(first_year, raw['date'].max().year + 1))
+        else:
+            remove_dataset(processed_path) # pricevol_processed is skipped while its output exists
+            self.pricevol_processed(name='pricevol_processed')
+
+        marketcap_path = f'{self.save_path}/marketcap.parquet'
+        if window_start is not None and max_date(marketcap_path) is not None:
+            old = read_partitions(marketcap_path, start_date=f'{window_start.year}-01-01')
+            old['date'] = pd.to_datetime(old['date'])
+            tail = compute_marketcap(raw[raw['date'] >= window_start].copy(), permco_gvkey_link_df)
+            marketcap_df = pd.concat([old[old['date'] < window_start], tail], ignore_index=True)
+            self._save(marketcap_df, 'marketcap', years=range(window_start.year, raw['date'].max().year + 1))
+        else:
+            remove_dataset(marketcap_path)
+            self.marketcap(name='marketcap')
+        return stats
+
+    def live_pricevol(self, name='live_pricevol', start_date=None, end_date=None, screens=None, top=50):
+        """
+        Compustat daily securities (comp.secd) of [start_date, end_date] with turnover, dollar volume
+        and market cap, screened with `screens` (default LIVE_SCREENS, without the rolling features).
+        For a daily screen with moving averages use live_screener.
+        """
+        df = secd_metrics(self.wrds_manager.get_secd_daily(start_date=start_date, end_date=end_date))
+        results = run_screens(df, screens or {'high_turnover': LIVE_SCREENS['high_turnover']}, sort_by='turnover', top=top)
+        for screen, passed in results.items():
+            print(f"{screen}: {len(passed)} securities")
+            print(passed)
+        return df
+
+    def live_screener(self, date=None, screens=LIVE_SCREENS, windows=LIVE_WINDOWS, name='live_screener_state', top=50):
+        """
+        Daily screener on comp.secd with rolling features kept in {save_path}/{name}.npz (see
+        utils/rolling_screener.py): moving averages of turnover, dollar volume and price over
+        `windows` trading days and z-scores of the shares traded against the days before.
+
+        Each run queries only the secd days after the last one in the state (up to `date`, default
+        the newest) and adds them to it; without a state, the history that fills the longest window
+        is queried once. The screens (DataFrame.query expressions over the features) are then
+        evaluated on all securities of the newest day at once.
+
+        Returns
+        -------
+        dict
+            {screen: passing securities, by turnover}, plus 'features': the features of every security.
+        """
+        state = RollingState.load(f'{self.save_path}/{name}.npz', fields=LIVE_FIELDS, capacity=max(windows) + 1, id_col='security')
+        end = None if date is None else pd.Timestamp(date)
+        if state.last_date is None:
+            # about 7 calendar days per 5 trading days, plus holidays
+            start = (end or pd.Timestamp.today().normalize()) - pd.Timedelta(days=int(state.capacity * 1.5) + 10)
+        else:
+            if end is not None and end < state.last_date:
+                raise ValueError(f"the state is already at {state.last_date.date()}, after {end.date()}")
+            start = state.last_date + pd.Timedelta(days=1)
+        if end is None or start <= end:
+            new_days = secd_metrics(self.wrds_manager.get_secd_daily(start_date=str(start.date()), end_date=None if end is None else str(end.date())))
+            new_days['security'] = new_days['gvkey'].astype(str) + '_' + new_days['iid'].astype(str)
+            for day, day_df in new_days.groupby(pd.to_datetime(new_days['datadate']), sort=True):
+                state.update(day_df, day, label_col='tic')
+            print(f"added {new_days['datadate'].nunique()} secd days to {state.path}, now at {None if state.last_date is None else state.last_date.date()}")
+            state.save()
+
+        features = state.features(windows, zscore_fields=['cshtrd'])
+        features['date'] = state.last_date
+        results = run_screens(features.dropna(subset=['prccd']), screens, sort_by='turnover', top=top)
+        for screen, passed in results.items():
+            print(f"{screen}: {len(passed)} securities")
+            print(passed)
+        results['features'] = features
+        return results
@@ -1,68 +1,115 @@
+import time
 import pandas as pd
 import numpy as np
 from typing import Callable
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from academic_data_download.db_manager.wrds_sql import WRDSManager
+from academic_data_download.utils.connection_pool import ConnectionPool, wrds_connection_factory
+from academic_data_download.utils.partitioned_parquet import write_partitions
 from academic_data_download.utils.save_file import save_file
 from academic_data_download.utils.sneak_peek import sneak_peek
 from academic_data_download.utils.col_transform import rolling_sum, fill_forward, merge_mktcap_fundq, fillna_with_0, merge_funda_rdq, shift_n_rows, merge_funda_fundq
 
 
+def aggregate_equities_year(raven_df):
+    """
+    Sentiment per permco and trading day of one year (the entities and share classes of a permco are averaged).
+    """
+    raven_df = raven_df.rename(columns={
+        'mean_ess': 'f_rp_ess',
+        'mean_bmq': 'f_rp_bmq',
+        'mean_bee': 'f_rp_bee',
+        'mean_bam': 'f_rp_bam',
+        'mean_bca': 'f_rp_bca',
+        'mean_css': 'f_rp_css',
+        'mean_ber': 'f_rp_ber',
+        'event_count': 'f_rp_event_count',
+    })
+    raven_df['trading_day_et'] = pd.to_datetime(raven_df['trading_day_et'])
+    return raven_df.groupby(['permco', 'trading_day_et']).agg({
+        'f_rp_ess': 'mean',
+        'f_rp_bmq': 'mean',
+        'f_rp_bee': 'mean',
+        'f_rp_bam': 'mean',
+        'f_rp_bca': 'mean',
+        'f_rp_css': 'mean',
+        'f_rp_ber': 'mean',
+        'f_rp_event_count': 'sum'
+    }).reset_index()
+
+
+def aggregate_global_macro_year(raven_df):
+    raven_df = raven_df.rename(columns={'mean_ess': 'f_rp_ess', 'event_count': 'f_rp_event_count'})
+    raven_df['trading_day_et'] = pd.to_datetime(raven_df['trading_day_et'])
+    return raven_df.groupby(['us_bucket', 'trading_day_et']).agg({
+        'f_rp_ess': 'mean',
+        'f_rp_event_count': 'sum'
+    }).reset_index()
+
+
 class RavenpackBuilder():
     def __init__(self, verbose, db, permno_list, save_path='data/ravenpack'):
         self.verbose = verbose
         self.permno_list = permno_list
+        self.db = db
         self.wrds_manager = WRDSManager(db, verbose=verbose)
         self.save_path = save_path
 
+    def _fetch_years(self, fetch: Callable, aggregate: Callable, years, n_workers=1, part_path=None):
+        """
+        Run `fetch(wrds_manager, year)` for every year and `aggregate` each result on its own; the yearly
+        queries only return the trading days of their year (exact_year), so the years are disjoint.
+
+        With n_workers > 1 the years are queried concurrently on a pool of n_workers connections. Each
+        aggregated year is written to `{part_path}/{year}.parquet` as soon as it completes (if given).
+        Returns the years concatenated in order.
+        """
+        def run(wrds_manager, year):
+            start = time.time()
+            df = aggregate(fetch(wrds_manager, year))
+            if part_path is not None:
+                write_partitions(df, part_path, date_col='trading_day_et', years=[year])
+            print(f"year {year}: {len(df)} rows in {time.time() - start:.1f}s")
+            if self.verbose:
+                print(f"peeks at the data after calculation of the year {year}!")
+                sneak_peek(df)
+            return df
+
+        results = {}
+        if n_workers <= 1:
+            for year in years:
+                results[year] = run(self.wrds_manager, year)
+        else:
+            def task(year):
+                with pool.acquire() as conn:
+                    # a manager per connection, sharing the metrics of this builder's manager
+                    wrds_manager = WRDSManager(conn, verbose=False, metrics_path=None)
+                    wrds_manager.metrics = self.wrds_manager.metrics
+                    return run(wrds_manager, year)
+
+            with ConnectionPool(wrds_connection_factory(self.db), size=n_workers) as pool, ThreadPoolExecutor(max_workers=n_workers) as executor:
+                futures = {executor.submit(task, year): year for year in years}
+                for future in as_completed(futures):
+                    results[futures[future]] = future.result()
+        return pd.concat([results[year] for year in years], ignore_index=True)
+
     # -------------------------- ravenpack --------------------------
-    def ravenpack_equities(self, name='f_ravenpack_equities', path='data/ravenpack', start_year=2009, end_year=2025):
+    def ravenpack_equities(self, name='f_ravenpack_equities', path='data/ravenpack', start_year=2009, end_year=2025, n_workers=1):
         """
         Ravenpack ESS:
         Ravenpack Event Sentiment Score
+        n_workers > 1 queries that many years concurrently (see _fetch_years).
         """
-        total_df = []
-
-        for year in range(start_year, end_year+1):
-            raven_df = self.wrds_manager.get_raven_full_equities(year=year, relevance_threshold=75, event_similarity_days_threshold=90, permno_list=self.permno_list)
-
-            if self.verbose:
-                print(f"peeks at the data after calculation of the year {year}!")
-                sneak_peek(raven_df)
-            total_df.append(raven_df)
-        
-        total_df = pd.concat(total_df)
+        total_df = self._fetch_years(
+            lambda wrds_manager, year: wrds_manager.get_raven_full_equities(year=year, relevance_threshold=75, event_similarity_days_threshold=90, permno_list=self.permno_list, exact_year=True),
+            aggregate_equities_year,
+            range(start_year, end_year+1),
+            n_workers=n_workers,
+            part_path=f'{path}/{name}_by_year' if self.permno_list is None else None,
+        )
         print("finished with data retrieval!")
 
-        # rename 
-        total_df.rename(columns={
-            'mean_ess': 'f_rp_ess',
-            'mean_bmq': 'f_rp_bmq',
-            'mean_bee': 'f_rp_bee',
-            'mean_bam': 'f_rp_bam',
-            'mean_bca': 'f_rp_bca',
-            'mean_css': 'f_rp_css',
-            'mean_ber': 'f_rp_ber'
-        }, inplace=True)
-        total_df.rename(columns={'event_count': 'f_rp_event_count'}, inplace=True)
-
-        # to datetime
-        total_df['trading_day_et'] = pd.to_datetime(total_df['trading_day_et'])
-
-        # special case handle: in the for loop by the year, each df will contain also the jan.1 of the next year, therefore, for 
-        #   2 dfs next to each other, there is a one-day overlap, i.e. Jan.1. 
-        #   the next line of code is to handle this case
-        total_df = total_df.groupby(['permco', 'trading_day_et']).agg({
-            'f_rp_ess': 'mean',
-            'f_rp_bmq': 'mean',
-            'f_rp_bee': 'mean',
-            'f_rp_bam': 'mean',
-            'f_rp_bca': 'mean',
-            'f_rp_css': 'mean',
-            'f_rp_ber': 'mean',
-            'f_rp_event_count': 'sum'
-        }).reset_index()
-
         # create a empty df where the date are all the dates in the year and the permco are all the permco in the total_df
         # Create cartesian product of all trading days and all unique permco
         # we create a df, that looks like:
@@ -91,40 +138,24 @@ class RavenpackBuilder():
         if self.verbose:
             print("peeks at the data after calculation!")
             sneak_peek(daily_df)
-        if self.permco_list is None:
+        if self.permno_list is None:
             save_file(daily_df, name, path=path)
         return daily_df
 
-    def ravenpack_global_macro(self, name='f_ravenpack_global_macro', path='data/ravenpack', start_year=2009, end_year=2025):
+    def ravenpack_global_macro(self, name='f_ravenpack_global_macro', path='data/ravenpack', start_year=2009, end_year=2025, n_workers=1):
         """
         Ravenpack ESS:
         Ravenpack Event Sentiment Score
+        n_workers > 1 queries that many years concurrently (see _fetch_years).
         """
-        total_df = []
-
-        for year in range(start_year, end_year+1):
-            raven_df = self.wrds_manager.get_raven_global_macro(year=year, relevance_threshold=75, event_similarity_days_threshold=90)
-
-            if self.verbose:
-                print(f"peeks at the data after calculation of the year {year}!")
-                sneak_peek(raven_df)
-            total_df.append(raven_df)
-        
-        total_df = pd.concat(total_df)
+        total_df = self._fetch_years(
+            lambda wrds_manager, year: wrds_manager.get_raven_global_macro(year=year, relevance_threshold=75, event_similarity_days_threshold=90, exact_year=True),
+            aggregate_global_macro_year,
+            range(start_year, end_year+1),
+            n_workers=n_workers,
+            part_path=f'{path}/{name}_by_year',
+        )
         print("finished with data retrieval!")
-        
-        # rename 
-        total_df = total_df.rename(columns={
-            'mean_ess': 'f_rp_ess', 'event_count': 'f_rp_event_count'})
-
-        # to datetime
-        total_df['trading_day_et'] = pd.to_datetime(total_df['trading_day_et'])
-
-        # groupby us_bucket and trading_day_et and do some weighted average weighted by col: event_count
-        total_df = total_df.groupby(['us_bucket', 'trading_day_et']).agg({
-            'f_rp_ess': 'mean',
-            'f_rp_event_count': 'sum'
-        }).reset_index()
 
         # create a empty df where the date are all the dates in the year and the us_bucket are all the us_bucket in the total_df
         all_days = pd.date_range(start=f'{start_year}-01-01', end=f'{end_year}-12-31', freq='D')
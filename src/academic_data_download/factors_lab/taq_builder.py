@@ -2,23 +2,33 @@ import pandas as pd
 import numpy as np
 from typing import Callable
 import os
-import glob
 
 from academic_data_download.db_manager.wrds_sql import WRDSManager
 from academic_data_download.utils.save_file import save_file
 from academic_data_download.utils.sneak_peek import sneak_peek
+from academic_data_download.utils.task_scheduler import FailureLedger, run_tasks
+from academic_data_download.utils.taq_link import TAQLinkIndex
+from academic_data_download.utils.part_compaction import compact_parts, CompactedDataset
+from academic_data_download.utils.partitioned_parquet import remove_dataset
+from academic_data_download.utils.lead_lag_store import write_lead_lag_panel, LeadLagPanel
 from academic_data_download.utils.col_transform import rolling_sum, fill_forward, merge_mktcap_fundq, fillna_with_0, merge_funda_rdq, shift_n_rows, merge_funda_fundq
 
 from academic_data_download.factors_lab.analyst_estimation_builder import AnalystEstimationBuilder
 from academic_data_download.factors_lab.pricevol_builder import PriceVolComputer
 
 
+# columns of taq/taq_retail_markethour_buckets.sql.j2 (bin_minutes and bin_start follow the keys with intraday bins)
+TAQ_RETAIL_KEYS = ['date', 'sym_root', 'sym_suffix', 'retail_cutoff_upper', 'retail_cutoff_lower']
+TAQ_RETAIL_COLUMNS = ['no', 'nob', 'nos', 's', 'sb', 'ss', 'v', 'vb', 'vs']
+
+
 class TAQBuilder():
     def __init__(self, verbose, db, save_path='data/taq'):
         self.verbose = verbose
         self.wrds_manager = WRDSManager(db, verbose=verbose)
         self.save_path = save_path
         self.db = db
+        self._link_indexes = {}
         self.analyst_estimation_builder = AnalystEstimationBuilder(verbose=verbose, db=db, permno_list=None)
         self.pricevol_builder = PriceVolComputer(verbose=verbose, db=db, permno_list=[14593])
 
@@ -42,68 +52,187 @@ class TAQBuilder():
         print(df)
         return df
 
-    def taq_retail_markethour(self, retail_cutoff_upper = 100000, retail_cutoff_lower = 0, name='taq_retail_markethour', start_date='2013-01-01', end_date='2024-12-31', combine=False):
+    def taq_retail_markethour(self, retail_cutoff_upper = 100000, retail_cutoff_lower = 0, name='taq_retail_markethour', start_date='2013-01-01', end_date='2024-12-31', combine=False, n_workers=1, retries=3, retry_failed_only=False):
         """
-        TAQ:
+        TAQ: retail market-hour trades per symbol and day for one dollar-size bucket, one part file
+        per day in {save_path}/parts/{upper}_{lower}/ (see taq_retail_markethour_buckets), optionally
+        combined into one file with the permnos of the symbols.
+
+        The combined file holds the days in [start_date, end_date], read from the monthly files the
+        parts are compacted into (see taq_retail_dataset).
         """
         agg_save_path = f'{self.save_path}/{name}_{retail_cutoff_upper}_{retail_cutoff_lower}_{start_date}_{end_date}.parquet'
         # if the file exists, return the df and don't compute again
         if os.path.exists(f'{agg_save_path}'):
             print(f'{agg_save_path} already exists')
             return pd.read_parquet(f'{agg_save_path}')
-        
-        permno_list = self.analyst_estimation_builder.price_target_detail()['permno'].unique()
-        trading_dates = self.pricevol_builder.pricevol_processed().query(f"date>'{start_date}' and date<'{end_date}'")['date'].unique()
 
-        # the data is quite big, so the database organizes it by date
-        for date in trading_dates:
-            # covert date to a string 
-            date = date.strftime('%Y-%m-%d')
-            ind_save_path = f'{self.save_path}/parts/{retail_cutoff_upper}_{retail_cutoff_lower}/{name}_{date}.parquet'
-            # check if the file exists
-            if os.path.exists(ind_save_path):
-                print(f'{ind_save_path} already exists')
-                continue
-            else:
-                os.makedirs(f'{self.save_path}/parts/{retail_cutoff_upper}_{retail_cutoff_lower}', exist_ok=True)
-            link_df = self.taq_link_table(date=date, permno_list=permno_list)
-            sym_root_list = link_df['sym_root'].unique()
-
-            df = self.wrds_manager.get_taq_retail_markethour(date=date, sym_root_list=sym_root_list, retail_cutoff_upper=retail_cutoff_upper, retail_cutoff_lower=retail_cutoff_lower)
-            print(df.head())
-            df.to_parquet(ind_save_path)
-        
+        self.taq_retail_markethour_buckets(buckets=[(retail_cutoff_upper, retail_cutoff_lower)], name=name, start_date=start_date, end_date=end_date, n_workers=n_workers, retries=retries, retry_failed_only=retry_failed_only)
+
         if combine:
             print(f"Combining all the parts into one file: {agg_save_path}")
-            link_df = self.taq_link_table(date=None, permno_list=None)
-            link_df['sym_suffix'] = link_df['sym_suffix'].fillna('')
-
+            link = self.taq_link_index(start_date=start_date, end_date=end_date)
             # combine all the parts into one file
-            part_files = glob.glob(f'{self.save_path}/parts/{retail_cutoff_upper}_{retail_cutoff_lower}/{name}*.parquet')
-            df = pd.concat([pd.read_parquet(file) for file in part_files]).sort_values(by=['date'])
-            df['sym_suffix'] = df['sym_suffix'].fillna('')
-            df = pd.merge(df, link_df, on=['sym_root', 'sym_suffix', 'date'], how='inner')
+            df = self.taq_retail_dataset(retail_cutoff_upper=retail_cutoff_upper, retail_cutoff_lower=retail_cutoff_lower, name=name).read(start_date=start_date, end_date=end_date)
+            df = link.attach_permno(df)
             df.to_parquet(f'{agg_save_path}')
             return df
-    
+
+    def taq_retail_markethour_buckets(self, buckets=((100000, 0), (10000, 2000), (30000, 10000), (2000, 500)), name='taq_retail_markethour', start_date='2013-01-01', end_date='2024-12-31', bin_minutes=None, n_workers=1, retries=3, retry_failed_only=False):
+        """
+        TAQ: retail market-hour trades per symbol and day for several (retail_cutoff_upper,
+        retail_cutoff_lower) dollar-size buckets, all from one scan of each day's trades. Every bucket
+        gets its own part file per day in {save_path}/parts/{upper}_{lower}/, so a bucket added later
+        only costs the days it misses, and those in one query.
+
+        With bin_minutes (e.g. [5, 30, 60]) the same scan also gives intraday bins, saved per bucket and
+        day in {save_path}/parts/{upper}_{lower}/bins_{5-30-60}/ in long format: one row per symbol,
+        bin size (bin_minutes) and bin (bin_start, the minute of the day it starts, bins counted from
+        09:30). See taq_retail_intraday.
+
+        Days whose parts already exist are skipped, so an interrupted run resumes where it stopped.
+        With n_workers > 1 the days are queried concurrently on a pool of n_workers connections.
+        Transient errors (lost connection, timeout) are retried with exponential backoff; days that
+        still fail are kept in {save_path}/parts/_failed_days.json and retried on the next run, or
+        alone with retry_failed_only=True.
+
+        The TAQ - CRSP link table of [start_date, end_date] is loaded once, the symbols of each day
+        are looked up in memory (see utils/taq_link.py).
+
+        Returns
+        -------
+        dict
+            The summary of utils/task_scheduler.run_tasks.
+        """
+        buckets = [(upper, lower) for upper, lower in buckets]
+        parts_paths = {bucket: f'{self.save_path}/parts/{bucket[0]}_{bucket[1]}' for bucket in buckets}
+        for parts_path in parts_paths.values():
+            os.makedirs(parts_path, exist_ok=True)
+        bin_minutes = sorted(set(bin_minutes or []))
+        bins_dir = 'bins_' + '-'.join(str(m) for m in bin_minutes)
+        ledger = FailureLedger(f'{self.save_path}/parts/_failed_days.json')
+
+        def part_files(bucket, date):
+            files = {'daily': f'{parts_paths[bucket]}/{name}_{date}.parquet'}
+            if bin_minutes:
+                files['intraday'] = f'{parts_paths[bucket]}/{bins_dir}/{name}_{date}.parquet'
+            return files
+
+        def missing_buckets(date):
+            return [bucket for bucket in buckets if not all(os.path.exists(file) for file in part_files(bucket, date).values())]
+
+        permno_list = self.analyst_estimation_builder.price_target_detail()['permno'].unique().tolist()
+        if retry_failed_only:
+            trading_dates = ledger.keys()
+        else:
+            trading_dates = self.pricevol_builder.pricevol_processed().query(f"date>'{start_date}' and date<'{end_date}'")['date'].unique()
+            # covert dates to strings
+            trading_dates = [pd.Timestamp(date).strftime('%Y-%m-%d') for date in trading_dates]
+
+        # the data is quite big, so the database organizes it by date
+        todo = [date for date in trading_dates if missing_buckets(date)]
+        print(f'{len(trading_dates) - len(todo)} of {len(trading_dates)} days already done for {len(buckets)} buckets')
+        if not todo:
+            return {'done': [], 'failed': {}, 'seconds': 0.0}
+        link = self.taq_link_index(start_date=start_date, end_date=end_date)
+
+        managers = {}
+        def download_day(date, conn):
+            if conn is self.db:
+                wrds_manager = self.wrds_manager
+            else:
+                # a manager per connection, sharing the metrics of this builder's manager
+                if id(conn) not in managers:
+                    managers[id(conn)] = WRDSManager(conn, verbose=False, metrics_path=None)
+                    managers[id(conn)].metrics = self.wrds_manager.metrics
+                wrds_manager = managers[id(conn)]
+            sym_root_list = link.symbols(date, permnos=permno_list)
+            missing = missing_buckets(date)
+            if sym_root_list:
+                df = wrds_manager.get_taq_retail_markethour_buckets(date=date, sym_root_list=sym_root_list, buckets=missing, bin_minutes=bin_minutes)
+            else:
+                # none of the permnos is linked on that day (e.g. before their IPO): the day is done, with
+                # empty parts (an empty list would drop the symbol filter and scan the whole day)
+                print(f"no linked symbols on {date}, saving empty parts")
+                df = pd.DataFrame(columns=TAQ_RETAIL_KEYS + (['bin_minutes', 'bin_start'] if bin_minutes else []) + TAQ_RETAIL_COLUMNS)
+            if bin_minutes:
+                df['bin_minutes'] = df['bin_minutes'].astype('int16')
+                df['bin_start'] = df['bin_start'].astype('int16')
+            for upper, lower in missing:
+                bucket_df = df[(df['retail_cutoff_upper'] == (upper or 0)) & (df['retail_cutoff_lower'] == (lower or 0))]
+                bucket_df = bucket_df.drop(columns=['retail_cutoff_upper', 'retail_cutoff_lower'])
+                for kind, ind_save_path in part_files((upper, lower), date).items():
+                    if os.path.exists(ind_save_path):
+                        continue
+                    if kind == 'daily':
+                        part = bucket_df.drop(columns=['bin_minutes', 'bin_start'], errors='ignore')
+                        part = part[bucket_df['bin_minutes'] == 0] if bin_minutes else part
+                    else:
+                        part = bucket_df[bucket_df['bin_minutes'] > 0].sort_values(['sym_root', 'sym_suffix', 'bin_minutes', 'bin_start'])
+                    os.makedirs(os.path.dirname(ind_save_path), exist_ok=True)
+                    # write then rename, so an interrupted write never leaves a part that looks done
+                    part.reset_index(drop=True).to_parquet(f'{ind_save_path}.tmp')
+                    os.replace(f'{ind_save_path}.tmp', ind_save_path)
+
+        summary = run_tasks(todo, download_day, db=self.db, n_workers=n_workers, retries=retries, ledger=ledger, desc=f'{name} days')
+        if summary['failed']:
+            print(f"{len(summary['failed'])} days failed, see {ledger.path}; rerun to retry them")
+        return summary
+
+    def taq_retail_intraday(self, retail_cutoff_upper=100000, retail_cutoff_lower=0, bin_minutes=(5, 30, 60), name='taq_retail_markethour', start_date='2013-01-01', end_date='2024-12-31'):
+        """
+        TAQ: the intraday bins saved by taq_retail_markethour_buckets(bin_minutes=...) for one bucket and the
+        days in [start_date, end_date], with the permnos of the symbols. Long format: one row per date,
+        symbol, bin size (bin_minutes) and bin (bin_start, minute of the day), e.g. the 30-minute flow
+        after 14:00 is df.query('bin_minutes == 30 and bin_start == 840').
+        """
+        df = self.taq_retail_dataset(retail_cutoff_upper=retail_cutoff_upper, retail_cutoff_lower=retail_cutoff_lower, name=name, bin_minutes=bin_minutes).read(start_date=start_date, end_date=end_date)
+        if df.empty:
+            raise FileNotFoundError(f"no intraday bins of {list(bin_minutes)} minutes in [{start_date}, {end_date}], run taq_retail_markethour_buckets(bin_minutes={list(bin_minutes)}) first")
+        return self.taq_link_index(start_date=start_date, end_date=end_date).attach_permno(df)
+
+    def taq_retail_dataset(self, retail_cutoff_upper=100000, retail_cutoff_lower=0, name='taq_retail_markethour', bin_minutes=None):
+        """
+        TAQ: lazy view of all the days of a bucket (or of its intraday bins with bin_minutes), after merging
+        the parts not compacted yet into {save_path}/compacted/{upper}_{lower}/[bins_.../]{name}: one file
+        per month sorted by date and symbol (see utils/part_compaction.py). Nothing else is read until
+        .read(start_date, end_date, columns, ids) or .iter_partitions(...).
+        """
+        bucket_dir = f'{retail_cutoff_upper}_{retail_cutoff_lower}'
+        sort_by = ['date', 'sym_root', 'sym_suffix']
+        if bin_minutes:
+            bucket_dir += '/bins_' + '-'.join(str(m) for m in sorted(set(bin_minutes)))
+            sort_by += ['bin_minutes', 'bin_start']
+        root = f'{self.save_path}/compacted/{bucket_dir}/{name}'
+        compact_parts(f'{self.save_path}/parts/{bucket_dir}', root, name=name, sort_by=sort_by, fill_values={'sym_suffix': ''})
+        return CompactedDataset(root)
+
     def taq_retail_markethour_processed(self, retail_cutoff_upper = 100000, retail_cutoff_lower = 0, name='taq_retail_markethour_processed'):
+        """
+        TAQ: the combined retail market-hour data of a bucket, stored sorted by share class
+        (full_name) and date with its group index in {save_path}/processed/{name}_{upper}_{lower}/.
+        The shifted features (e.g. no_in_5d, sb_in_-22d) are not written; LeadLagPanel derives them
+        from the base columns when the panel is read or joined to events.
+        """
         taq_retail_df = self.taq_retail_markethour(retail_cutoff_upper=retail_cutoff_upper, retail_cutoff_lower=retail_cutoff_lower, combine=True).sort_values(by=['date'])
+        taq_retail_df['date'] = pd.to_datetime(taq_retail_df['date'])
         taq_retail_df['full_name'] = taq_retail_df['sym_root'] + taq_retail_df['sym_suffix']
 
-        print("Computing shifted TAQ and volume features for various time windows...")
-        for _day in list(range(-5, 10)) + [-66, -22, 66, 132, 252]:
-            taq_retail_df[f'no_in_{_day}d'] = taq_retail_df.groupby('full_name')['no'].transform(lambda x: x.shift(-_day))
-            taq_retail_df[f'nob_in_{_day}d'] = taq_retail_df.groupby('full_name')['nob'].transform(lambda x: x.shift(-_day))
-            taq_retail_df[f'nos_in_{_day}d'] = taq_retail_df.groupby('full_name')['nos'].transform(lambda x: x.shift(-_day))
-
-            taq_retail_df[f's_in_{_day}d'] = taq_retail_df.groupby('full_name')['s'].transform(lambda x: x.shift(-_day))
-            taq_retail_df[f'sb_in_{_day}d'] = taq_retail_df.groupby('full_name')['sb'].transform(lambda x: x.shift(-_day))
-            taq_retail_df[f'ss_in_{_day}d'] = taq_retail_df.groupby('full_name')['ss'].transform(lambda x: x.shift(-_day))
-            
         print("Saving the processed TAQ data...")
-        os.makedirs(f'{self.save_path}/processed', exist_ok=True)
-        taq_retail_df.to_parquet(f'{self.save_path}/processed/{name}_{retail_cutoff_upper}_{retail_cutoff_lower}.parquet')
-        return taq_retail_df
+        processed_path = f'{self.save_path}/processed/{name}_{retail_cutoff_upper}_{retail_cutoff_lower}'
+        remove_dataset(f'{processed_path}.parquet') # the former file with materialized shifts
+        write_lead_lag_panel(taq_retail_df, processed_path, by='full_name', order_by='date')
+        return LeadLagPanel(processed_path)
+
+    def taq_link_index(self, start_date='2013-01-01', end_date='2024-12-31'):
+        """
+        TAQ: the link table of [start_date, end_date] in memory, indexed by date (one query per range and builder).
+        """
+        if (start_date, end_date) not in self._link_indexes:
+            link_df = self.wrds_manager.get_taq_link_table(date=None, start_date=start_date, end_date=end_date)
+            self._link_indexes[(start_date, end_date)] = TAQLinkIndex(link_df)
+            print(f"loaded {len(link_df)} link table rows for {start_date} - {end_date}")
+        return self._link_indexes[(start_date, end_date)]
 
     def taq_link_table(self, date='2021-12-31', permno_list=None, symbol_root=None, name='_taq_link_table', start_date='2013-01-01'):
         """
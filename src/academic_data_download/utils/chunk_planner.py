@@ -0,0 +1,149 @@
+import glob
+import json
+import threading
+from typing import Callable, Optional
+
+import numpy as np
+import pandas as pd
+
+from academic_data_download.db_manager.query_metrics import timed_raw_sql
+
+
+def estimate_rows_from_manifests(parts_dir: str, keys: list) -> dict:
+    """
+    Rows per key recorded by earlier chunked downloads in `parts_dir` (their manifest.json files).
+
+    Chunks that recorded per-key counts give exact numbers, the others spread their row count
+    evenly over their keys. The most recent manifest wins for a key.
+    """
+    wanted = {str(k): k for k in keys}
+    estimates = {}
+    manifests = []
+    for path in glob.glob(f'{parts_dir}/*/manifest.json'):
+        with open(path) as f:
+            manifests.append(json.load(f))
+    for manifest in sorted(manifests, key=lambda m: m.get('created', '')):
+        for chunk in manifest['chunks'].values():
+            if chunk.get('status') != 'done':
+                continue
+            key_rows = chunk.get('key_rows')
+            for k in chunk['keys']:
+                if str(k) not in wanted:
+                    continue
+                if key_rows is not None:
+                    estimates[wanted[str(k)]] = key_rows.get(str(k), 0)
+                else:
+                    estimates[wanted[str(k)]] = chunk['rows'] / len(chunk['keys'])
+    return estimates
+
+
+def estimate_rows_by_count(db, count_renderer: Callable, keys: list, keys_per_query: int = 50_000, metrics=None, template: Optional[str] = None) -> dict:
+    """
+    Rows per key from a COUNT(*) ... GROUP BY pre-query. `count_renderer` maps a list of keys to
+    the SQL (or a (sql, params) tuple) of a query returning two columns: the key and its row count.
+    Keys the query does not return have no rows. The queries are recorded in `metrics` if given.
+    """
+    estimates = {k: 0 for k in keys}
+    for start in range(0, len(keys), keys_per_query):
+        rendered = count_renderer(keys[start:start + keys_per_query])
+        sql, params = rendered if isinstance(rendered, tuple) else (rendered, None)
+        counts, timings = timed_raw_sql(db, sql, params)
+        if metrics is not None:
+            metrics.record(template, sql, params, rows=len(counts), nbytes=int(counts.memory_usage(deep=True).sum()), **timings)
+        key_col, count_col = counts.columns[:2]
+        for k, n in zip(counts[key_col].tolist(), counts[count_col].tolist()):
+            if k in estimates:
+                estimates[k] = int(n)
+    return estimates
+
+
+class AdaptiveChunker():
+    """
+    Packs keys, in their order, into chunks of about `target_rows` estimated rows.
+
+    The budget of the next chunk is the smallest of `target_rows`, `target_bytes` divided by the
+    observed bytes per row and `target_seconds` times the observed rows per second. Observed rows
+    also rescale the estimates, so a biased estimate (e.g. a count over a different date range) is
+    corrected after the first chunks. Chunks are formed on demand, each one with the budget at the
+    time it is requested:
+
+        chunker = AdaptiveChunker(keys, estimates, target_rows=5_000_000, target_bytes=2e9)
+        while (chunk := chunker.next_chunk()) is not None:
+            df = run(chunk)
+            chunker.observe(chunk, rows=len(df), nbytes=df.memory_usage(deep=True).sum(), seconds=...)
+    """
+    def __init__(
+            self,
+            keys: list,
+            estimates: Optional[dict] = None,
+            target_rows: float = 5_000_000,
+            target_bytes: Optional[float] = None,
+            target_seconds: Optional[float] = None,
+            max_keys: Optional[int] = None,
+            smoothing: float = 0.5,
+        ):
+        self.keys = list(keys)
+        self._index = {k: i for i, k in enumerate(self.keys)}
+        estimates = estimates or {}
+        known = [estimates[k] for k in self.keys if k in estimates]
+        default = float(np.mean(known)) if known else 1.0 # keys without an estimate count as an average one
+        self.estimates = np.array([float(estimates.get(k, default)) for k in self.keys])
+        self.target_rows = target_rows
+        self.target_bytes = target_bytes
+        self.target_seconds = target_seconds
+        self.max_keys = max_keys
+        self.smoothing = smoothing
+        self.position = 0
+        self.scale = 1.0 # observed rows / estimated rows
+        self.bytes_per_row = None
+        self.rows_per_second = None
+        self.history = []
+        self._lock = threading.Lock()
+
+    def budget(self) -> float:
+        budget = self.target_rows
+        if self.target_bytes is not None and self.bytes_per_row:
+            budget = min(budget, self.target_bytes / self.bytes_per_row)
+        if self.target_seconds is not None and self.rows_per_second:
+            budget = min(budget, self.target_seconds * self.rows_per_second)
+        return max(budget, 1.0)
+
+    def remaining(self) -> int:
+        return len(self.keys) - self.position
+
+    def next_chunk(self) -> Optional[list]:
+        with self._lock:
+            if self.position >= len(self.keys):
+                return None
+            budget = self.budget() / self.scale
+            # always at least one key, even if it alone exceeds the budget
+            cumulative = np.cumsum(self.estimates[self.position:])
+            n = max(int(np.searchsorted(cumulative, budget, side='right')), 1)
+            if self.max_keys is not None:
+                n = min(n, self.max_keys)
+            chunk = self.keys[self.position:self.position + n]
+            self.position += n
+            return chunk
+
+    def _smooth(self, old: Optional[float], new: float) -> float:
+        return new if old is None else self.smoothing * new + (1 - self.smoothing) * old
+
+    def observe(self, chunk: list, rows: int, nbytes: Optional[float] = None, seconds: Optional[float] = None):
+        """
+        Feed back the outcome of a chunk.
+        """
+        with self._lock:
+            estimated = float(sum(self.estimates[self._index[k]] for k in chunk if k in self._index))
+            if estimated > 0 and rows > 0:
+                self.scale = self._smooth(self.scale, rows / estimated)
+            if rows > 0 and nbytes:
+                self.bytes_per_row = self._smooth(self.bytes_per_row, nbytes / rows)
+            if rows > 0 and seconds:
+                self.rows_per_second = self._smooth(self.rows_per_second, rows / seconds)
+            self.history.append({'keys': len(chunk), 'estimated_rows': estimated, 'rows': rows, 'bytes': nbytes, 'seconds': seconds, 'budget': self.budget()})
+
+    def report(self) -> pd.DataFrame:
+        """
+        Estimated and observed rows, bytes and seconds per chunk, in completion order.
+        """
+        return pd.DataFrame(self.history)
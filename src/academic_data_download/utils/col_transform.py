@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 
 def rolling_sum(df, col):
@@ -41,4 +42,76 @@ def merge_funda_fundq(fundq_df, funda_df):
     funda_df.sort_values(by=['datadate', 'gvkey'], inplace=True)
     merged = pd.merge_asof(fundq_df, funda_df, on=['datadate'], by=['gvkey'], direction='backward')
     merged.sort_values(by=['datadate', 'gvkey'], inplace=True)
-    return merged
\ No newline at end of file
+    return merged
+
+def panel_lead_lag(df, by, cols, offsets, order_by=None, calendar=None, date_col='date', name='{col}_in_{offset}d'):
+    """
+    Lead/lag columns of a panel in one pass: for every column of `cols` and offset d of `offsets`,
+    the value of the same `by` group d rows later (d < 0: -d rows earlier), i.e.
+    df.groupby(by)[col].shift(-d), for all of them at once.
+
+    The groups and the order within them (row order, or `order_by`) are computed once; every
+    offset is then index arithmetic on the sorted positions. With `calendar` (sorted trading days)
+    the offsets count trading days instead of rows: the value on the d-th trading day after the
+    row's `date_col`, missing if the group has no row on that day.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One column per offset and column, named by `name` (with {col} and {offset}), in offset
+        order, on the index of `df`. Dtypes as with shift (missing values upcast int to float).
+    """
+    cols = [cols] if isinstance(cols, str) else list(cols)
+    indexers = lead_lag_indexers(df, by, offsets, order_by=order_by, calendar=calendar, date_col=date_col)
+    out = {}
+    for offset in offsets:
+        for col in cols:
+            values = df[col].array if isinstance(df[col].dtype, pd.api.extensions.ExtensionDtype) else df[col].to_numpy()
+            out[name.format(col=col, offset=offset)] = pd.api.extensions.take(values, indexers[offset], allow_fill=True)
+    return pd.DataFrame(out, index=df.index)
+
+
+def lead_lag_indexers(df, by, offsets, order_by=None, calendar=None, date_col='date'):
+    """
+    {offset: positions of the rows that panel_lead_lag takes the values from}, -1 where there is none.
+    """
+    n = len(df)
+    codes = df.groupby(by, sort=False).ngroup().to_numpy() # -1 for missing keys, which have no neighbours
+    indexers = {}
+    if calendar is None:
+        keys = (codes,) if order_by is None else (df[order_by].to_numpy(), codes)
+        order = np.lexsort(keys) # stable: ties keep their row order
+        sorted_codes = codes[order]
+        starts = np.r_[0, np.flatnonzero(np.diff(sorted_codes)) + 1]
+        sizes = np.diff(np.r_[starts, n])
+        group_of = np.repeat(np.arange(len(starts)), sizes)
+        pos = np.arange(n) - starts[group_of]
+        for offset in offsets:
+            target = pos + offset
+            valid = (target >= 0) & (target < sizes[group_of]) & (sorted_codes >= 0)
+            indexer = np.full(n, -1, dtype=np.int64)
+            indexer[order[valid]] = order[np.arange(n)[valid] + offset]
+            indexers[offset] = indexer
+        return indexers
+
+    calendar = np.asarray(pd.to_datetime(pd.Series(calendar)).unique(), dtype='datetime64[ns]')
+    calendar.sort()
+    days = pd.to_datetime(df[date_col]).to_numpy(dtype='datetime64[ns]')
+    day_pos = np.searchsorted(calendar, days)
+    on_calendar = (day_pos < len(calendar)) & (calendar[np.minimum(day_pos, len(calendar) - 1)] == days) & (codes >= 0)
+    # (group, trading day) as one sorted integer key
+    width = len(calendar) + 1
+    keys = np.where(on_calendar, codes.astype(np.int64) * width + day_pos, -1)
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    for offset in offsets:
+        target_pos = day_pos + offset
+        target = codes.astype(np.int64) * width + target_pos
+        valid = on_calendar & (target_pos >= 0) & (target_pos < len(calendar))
+        found = np.searchsorted(sorted_keys, target)
+        found = np.minimum(found, n - 1)
+        valid &= sorted_keys[found] == target
+        indexer = np.full(n, -1, dtype=np.int64)
+        indexer[valid] = order[found[valid]]
+        indexers[offset] = indexer
+    return indexers
@@ -0,0 +1,123 @@
+import queue
+import threading
+from contextlib import contextmanager
+from typing import Callable
+
+import pandas as pd
+
+
+class SqlConnection():
+    """
+    Minimal stand-in for wrds.Connection: exposes `raw_sql` on top of any DB-API
+    (sqlite3, psycopg2, duckdb, ...) or SQLAlchemy connection.
+    """
+    def __init__(self, connection):
+        self.connection = connection
+
+    def raw_sql(self, sql, params=None, coerce_float=True, date_cols=None, dtype_backend="numpy_nullable", chunksize=None, return_iter=False, **kwargs):
+        # same read path and defaults as wrds.Connection.raw_sql, so results are interchangeable
+        df = pd.read_sql_query(
+            sql,
+            self.connection,
+            params=params,
+            coerce_float=coerce_float,
+            parse_dates=date_cols,
+            chunksize=chunksize,
+            dtype_backend=dtype_backend,
+        )
+        if return_iter or chunksize is None:
+            return df
+        return pd.concat(list(df))
+
+    def close(self):
+        self.connection.close()
+
+
+def wrds_connection_factory(db) -> Callable:
+    """
+    Factory of extra connections sharing the SQLAlchemy engine of an open wrds.Connection
+    (or the database of an offline `ReplayConnection`).
+    """
+    if hasattr(db, 'new_connection'):
+        return db.new_connection
+    if getattr(db, 'engine', None) is None:
+        raise ValueError("db has no SQLAlchemy engine; pass a connection_factory explicitly")
+    return lambda: SqlConnection(db.engine.connect())
+
+
+class ConnectionPool():
+    """
+    Fixed-size pool of connections created lazily by `connection_factory`.
+
+    Each connection is used by one thread at a time:
+
+        with pool.acquire() as conn:
+            df = conn.raw_sql(sql)
+    """
+    def __init__(self, connection_factory: Callable, size: int = 4):
+        self.connection_factory = connection_factory
+        self.size = size
+        self._idle = queue.Queue()
+        self._created = []
+        self._discarded = set()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def acquire(self):
+        conn = self._checkout()
+        try:
+            yield conn
+        finally:
+            self._release(conn)
+
+    def discard(self, conn):
+        """
+        Mark a checked-out connection as broken: it is closed on release and replaced by a new one when needed.
+        """
+        with self._lock:
+            self._discarded.add(id(conn))
+
+    def _release(self, conn):
+        with self._lock:
+            if id(conn) not in self._discarded:
+                self._idle.put(conn)
+                return
+            self._discarded.discard(id(conn))
+            self._created.remove(conn)
+        try:
+            close = getattr(conn, 'close', None)
+            if close is not None:
+                close()
+        except Exception:
+            pass # already broken
+
+    def _checkout(self):
+        while True:
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                pass
+            with self._lock:
+                if len(self._created) < self.size:
+                    conn = self.connection_factory()
+                    self._created.append(conn)
+                    return conn
+            # all connections are created and busy: wait for one to come back (or be discarded)
+            try:
+                return self._idle.get(timeout=1)
+            except queue.Empty:
+                pass
+
+    def close(self):
+        for conn in self._created:
+            close = getattr(conn, 'close', None)
+            if close is not None:
+                close()
+        self._created = []
+        self._idle = queue.Queue()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,122 @@
+import os
+import re
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+SERIES = 'series.parquet'
+GROUPS = 'groups.parquet'
+LEAD_LAG_NAME = re.compile(r'^(?P<col>.+)_in_(?P<offset>-?\d+)d$')
+
+
+def write_lead_lag_panel(df: pd.DataFrame, root: str, by: str, order_by: str = 'date'):
+    """
+    Store a panel so that its lead/lag columns can be derived when read instead of being written:
+    `{root}/series.parquet` holds the rows sorted by `by` and, within a group, by `order_by`
+    (stable, so ties keep their order), and `{root}/groups.parquet` the group index, one row per
+    `by` value with the position of its first row and its number of rows. Both files are replaced
+    atomically.
+    """
+    os.makedirs(root, exist_ok=True)
+    df = df[df[by].notna()].sort_values([by, order_by], kind='stable').reset_index(drop=True)
+    codes, uniques = pd.factorize(df[by], sort=False) # sorted rows: codes increase with the row
+    starts = np.r_[0, np.flatnonzero(np.diff(codes)) + 1] if len(df) else np.array([], dtype=np.int64)
+    groups = pd.DataFrame({by: uniques, 'start': starts, 'rows': np.diff(np.r_[starts, len(df)])})
+    for data, fn in [(df, SERIES), (groups, GROUPS)]:
+        data.to_parquet(f'{root}/{fn}.tmp', index=False)
+        os.replace(f'{root}/{fn}.tmp', f'{root}/{fn}')
+
+
+class LeadLagPanel():
+    """
+    A panel written by `write_lead_lag_panel`. Columns named `{col}_in_{d}d` are produced on
+    request from the base column `col`: the value of the same group d rows later (d < 0: -d rows
+    earlier), as df.groupby(by)[col].shift(-d) / col_transform.panel_lead_lag would give:
+
+        panel = LeadLagPanel('data/taq/processed/taq_retail_markethour_processed_100000_0')
+        df = panel.read(columns=['permno', 'date', 'no', 'no_in_5d', 'sb_in_-22d'], start_date='2020-01-01')
+        events = panel.join(events, left_on=['permno', 'ann_deemed_date'], right_on=['permno', 'date'], columns=['no_in_1d', 'no_in_5d'])
+
+    The shifts look across the whole stored history, so rows at the edge of a date range still get
+    the values outside of it.
+    """
+    def __init__(self, root: str):
+        self.root = root
+        groups = pd.read_parquet(f'{root}/{GROUPS}')
+        self.by = groups.columns[0]
+        self.groups = groups
+        self._series = None
+
+    @property
+    def series(self) -> pd.DataFrame:
+        # the base columns are read once, when first needed
+        if self._series is None:
+            self._series = pd.read_parquet(f'{self.root}/{SERIES}')
+        return self._series
+
+    def _positions(self):
+        start = self.groups['start'].to_numpy(dtype=np.int64)
+        rows = self.groups['rows'].to_numpy(dtype=np.int64)
+        group_of = np.repeat(np.arange(len(rows)), rows)
+        return np.arange(len(group_of)) - start[group_of], rows[group_of]
+
+    def lead_lag(self, rows, columns: list) -> pd.DataFrame:
+        """
+        The `{col}_in_{d}d` columns of `columns` at the panel rows `rows` (positions in `series`).
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        pos, size = self._positions()
+        pos, size = pos[rows], size[rows]
+        out = {}
+        for name in columns:
+            m = LEAD_LAG_NAME.match(name)
+            if m is None or m.group('col') not in self.series.columns:
+                raise KeyError(f"{name} is neither a column of {self.root} nor a lead/lag of one ({{col}}_in_{{d}}d)")
+            col, offset = m.group('col'), int(m.group('offset'))
+            target = pos + offset
+            indexer = np.where((target >= 0) & (target < size), rows + offset, -1)
+            values = self.series[col].array if isinstance(self.series[col].dtype, pd.api.extensions.ExtensionDtype) else self.series[col].to_numpy()
+            out[name] = pd.api.extensions.take(values, indexer, allow_fill=True)
+        return pd.DataFrame(out)
+
+    def read(self, columns: Optional[list] = None, start_date=None, end_date=None, date_col: str = 'date') -> pd.DataFrame:
+        """
+        The rows in [start_date, end_date] with `columns`: stored columns as they are, the others
+        derived as lead/lag columns. Without `columns`, all stored columns.
+        """
+        series = self.series
+        keep = np.ones(len(series), dtype=bool)
+        if start_date is not None or end_date is not None:
+            date = pd.to_datetime(series[date_col])
+            if start_date is not None:
+                keep &= (date >= pd.Timestamp(start_date)).to_numpy()
+            if end_date is not None:
+                keep &= (date <= pd.Timestamp(end_date)).to_numpy()
+        rows = np.flatnonzero(keep)
+        columns = list(series.columns) if columns is None else list(columns)
+        stored = [c for c in columns if c in series.columns]
+        derived = self.lead_lag(rows, [c for c in columns if c not in series.columns])
+        df = pd.concat([series[stored].iloc[rows].reset_index(drop=True), derived], axis=1)
+        return df[columns]
+
+    def join(self, events: pd.DataFrame, left_on: list, right_on: list, columns: list, how: str = 'inner') -> pd.DataFrame:
+        """
+        pd.merge(events, panel, left_on, right_on, how) with only `columns` of the panel, where the
+        lead/lag columns are derived for the matched rows alone.
+        """
+        keys = self.series[right_on].copy()
+        keys['_panel_row'] = np.arange(len(keys))
+        merged = pd.merge(events, keys, left_on=left_on, right_on=right_on, how=how)
+        matched = merged['_panel_row'].notna().to_numpy()
+        rows = merged['_panel_row'].to_numpy(dtype=np.float64)[matched].astype(np.int64)
+        stored = [c for c in columns if c in self.series.columns and c not in merged.columns]
+        derived = [c for c in columns if c not in self.series.columns]
+        values = pd.concat([self.series[stored].iloc[rows].reset_index(drop=True), self.lead_lag(rows, derived)], axis=1)
+        if not matched.all():
+            # events without a panel row (how='left'/'outer') get missing values
+            indexer = np.full(len(merged), -1)
+            indexer[matched] = np.arange(len(rows))
+            values = values.reindex(indexer).reset_index(drop=True)
+        merged = merged.drop(columns='_panel_row')
+        return pd.concat([merged, values], axis=1)
@@ -0,0 +1,200 @@
+import json
+import os
+import shutil
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from academic_data_download.utils.partitioned_parquet import partition_files, read_partitions
+
+META = 'meta.json'
+INT_FILL = np.iinfo(np.int32).min # int32 cells without a row
+
+
+def _chunks(source, columns: list):
+    # a partitioned dataset (or parquet file) one year at a time, or a DataFrame as one chunk
+    if isinstance(source, pd.DataFrame):
+        yield source[columns]
+    elif os.path.isfile(source):
+        yield pd.read_parquet(source, columns=columns)
+    else:
+        for path in partition_files(source).values():
+            yield read_partitions(path, columns=columns)
+
+
+def _default_dtype(dtype) -> str:
+    return 'int32' if pd.api.types.is_integer_dtype(dtype) else 'float32'
+
+
+def build_panel_store(source, root: str, columns: list, id_col: str = 'permno', date_col: str = 'date', dtypes: Optional[dict] = None) -> 'PanelStore':
+    """
+    Write the long panel `source` (a DataFrame or a dataset written by write_partitions, e.g.
+    data/pricevol/pricevol_raw.parquet, read one year at a time) as a dense security x trading day
+    store at `root`: one .npy file per column of shape (ids, dates), `ids.npy` (sorted `id_col`
+    values), `dates.npy` (the trading calendar: every date with a row) and `present.npy` (cells with
+    a row). Columns are float32 (missing: NaN) or int32 (missing: INT_FILL) unless `dtypes` says
+    otherwise, e.g. {'prc': 'float64'} to keep prices above ~100k exact to the cent.
+
+    The store is built next to `root` and moved in place when complete.
+    """
+    ids, dates, col_dtypes = [], [], {}
+    for chunk in _chunks(source, [id_col, date_col] + list(columns)):
+        ids.append(pd.unique(chunk[id_col].dropna()))
+        dates.append(pd.unique(pd.to_datetime(chunk[date_col]).to_numpy(dtype='datetime64[D]')))
+        col_dtypes.update({c: chunk[c].dtype for c in columns if c not in col_dtypes})
+    ids = np.unique(np.concatenate(ids)).astype(np.int64) if ids else np.array([], dtype=np.int64)
+    dates = np.unique(np.concatenate(dates)) if dates else np.array([], dtype='datetime64[D]')
+    dtypes = {c: (dtypes or {}).get(c, _default_dtype(col_dtypes.get(c))) for c in columns}
+
+    tmp = f'{root}.tmp'
+    if os.path.exists(tmp):
+        shutil.rmtree(tmp)
+    os.makedirs(tmp)
+    np.save(f'{tmp}/ids.npy', ids)
+    np.save(f'{tmp}/dates.npy', dates)
+    shape = (len(ids), len(dates))
+    arrays = {}
+    for c, dtype in dtypes.items():
+        arrays[c] = np.lib.format.open_memmap(f'{tmp}/{c}.npy', mode='w+', dtype=dtype, shape=shape)
+        arrays[c][:] = np.nan if np.issubdtype(arrays[c].dtype, np.floating) else INT_FILL
+    present = np.lib.format.open_memmap(f'{tmp}/present.npy', mode='w+', dtype=bool, shape=shape)
+
+    for chunk in _chunks(source, [id_col, date_col] + list(columns)):
+        chunk = chunk[chunk[id_col].notna()]
+        i = np.searchsorted(ids, chunk[id_col].to_numpy(dtype=np.int64))
+        j = np.searchsorted(dates, pd.to_datetime(chunk[date_col]).to_numpy(dtype='datetime64[D]'))
+        present[i, j] = True
+        for c, array in arrays.items():
+            values = chunk[c].to_numpy(dtype=np.float64, na_value=np.nan)
+            if not np.issubdtype(array.dtype, np.floating):
+                values = np.where(np.isnan(values), INT_FILL, values)
+            array[i, j] = values.astype(array.dtype)
+    for array in [*arrays.values(), present]:
+        array.flush()
+    del arrays, present
+
+    with open(f'{tmp}/{META}', 'w') as f:
+        json.dump({'id_col': id_col, 'date_col': date_col, 'columns': {c: str(np.dtype(t)) for c, t in dtypes.items()}}, f, indent=1)
+    if os.path.exists(root):
+        shutil.rmtree(root)
+    os.replace(tmp, root)
+    print(f"Built panel store {root}: {shape[0]} ids x {shape[1]} trading days, columns {list(dtypes)}")
+    return PanelStore(root)
+
+
+class PanelStore():
+    """
+    A store written by `build_panel_store`. Columns are memory-mapped read-only, so nothing is read
+    until used, slices along the trading days are views of the file (no copy), and processes
+    opening the same store share its pages in the OS cache:
+
+        panel = PanelStore('data/pricevol/pricevol_panel')
+        ret = panel.window('ret', start_date='2020-01-01')  # (ids, days) view
+        cum_22d = panel.compound('ret', 22)                   # (ids, days), like add_returns on trading days
+        panel.cross_section('prc', '2024-12-31')              # one day, by permno
+
+    Offsets are in trading days of the calendar: column j + d is d trading days after column j,
+    whether or not the security has a row on either day.
+    """
+    def __init__(self, root: str):
+        self.root = root
+        with open(f'{root}/{META}') as f:
+            self.meta = json.load(f)
+        self.columns = list(self.meta['columns'])
+        self.ids = np.load(f'{root}/ids.npy')
+        self.dates = pd.DatetimeIndex(np.load(f'{root}/dates.npy'))
+        self._arrays = {}
+
+    @property
+    def shape(self) -> tuple:
+        return (len(self.ids), len(self.dates))
+
+    def __getitem__(self, col: str) -> np.ndarray:
+        if col not in self._arrays:
+            if col != 'present' and col not in self.columns:
+                raise KeyError(f"{col} is not a column of {self.root} ({self.columns})")
+            self._arrays[col] = np.load(f'{self.root}/{col}.npy', mmap_mode='r')
+        return self._arrays[col]
+
+    def id_index(self, ids) -> np.ndarray:
+        """
+        Rows of `ids`, -1 for ids not in the store.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        rows = np.minimum(np.searchsorted(self.ids, ids), max(len(self.ids) - 1, 0))
+        return np.where((len(self.ids) > 0) & (self.ids[rows] == ids), rows, -1)
+
+    def date_slice(self, start_date=None, end_date=None) -> slice:
+        start = 0 if start_date is None else self.dates.searchsorted(pd.Timestamp(start_date), side='left')
+        end = len(self.dates) if end_date is None else self.dates.searchsorted(pd.Timestamp(end_date), side='right')
+        return slice(start, end)
+
+    def window(self, col: str, start_date=None, end_date=None, ids=None) -> np.ndarray:
+        """
+        `col` over the trading days in [start_date, end_date]: a view of the file; with `ids` (only
+        those rows, in that order) a copy.
+        """
+        values = self[col][:, self.date_slice(start_date, end_date)]
+        if ids is not None:
+            rows = self.id_index(ids)
+            if (rows < 0).any():
+                raise KeyError(f"ids not in {self.root}: {np.asarray(ids)[rows < 0][:10].tolist()}")
+            values = values[rows]
+        return values
+
+    def rolling(self, col: str, window: int, start_date=None, end_date=None, ids=None) -> np.ndarray:
+        """
+        Trailing windows of `window` trading days as a view of shape (ids, days - window + 1, window);
+        [:, k] is the window ending on day k + window - 1 of the range.
+        """
+        return np.lib.stride_tricks.sliding_window_view(self.window(col, start_date, end_date, ids), window, axis=1)
+
+    def compound(self, col: str, window: int, start_date=None, end_date=None, ids=None) -> np.ndarray:
+        """
+        prod(1 + r) - 1 of `col` over the trailing `window` trading days ending on every day (missing
+        if a day of the window is missing or the range has fewer days, -1 if one of them is -100%),
+        from a cumulative sum of log(1 + r) along the days. Lead it by d days with [:, d:].
+        """
+        values = np.asarray(self.window(col, start_date, end_date, ids), dtype=np.float64)
+        missing = np.isnan(values)
+        wiped = values <= -1
+        zeros = np.zeros((len(values), 1))
+        def trailing(x):
+            total = np.concatenate([zeros, np.cumsum(x, axis=1)], axis=1)
+            out = np.full(values.shape, np.nan)
+            out[:, window - 1:] = total[:, window:] - total[:, :-window]
+            return out
+        cum = np.expm1(trailing(np.log1p(np.where(missing | wiped, 0, values))))
+        cum[trailing(wiped) > 0] = -1
+        cum[~(trailing(missing) == 0)] = np.nan # also the first window - 1 days
+        return cum
+
+    def cross_section(self, col: str, date) -> pd.Series:
+        """
+        `col` of every id on `date` (a copy of one column of the file), missing where there is no row.
+        """
+        j = self.dates.get_loc(pd.Timestamp(date))
+        values = np.array(self[col][:, j])
+        if not np.issubdtype(values.dtype, np.floating):
+            values = pd.array(values, dtype='Int32')
+            values[values == INT_FILL] = pd.NA
+        return pd.Series(values, index=pd.Index(self.ids, name=self.meta['id_col']), name=col)
+
+    def to_frame(self, columns: Optional[list] = None, start_date=None, end_date=None, ids=None) -> pd.DataFrame:
+        """
+        The cells with a row in [start_date, end_date] back in long format (id, date, columns), sorted
+        by id and date.
+        """
+        columns = self.columns if columns is None else list(columns)
+        present = self.window('present', start_date, end_date, ids)
+        rows, days = np.nonzero(present)
+        id_values = self.ids[rows] if ids is None else np.asarray(ids, dtype=np.int64)[rows]
+        df = pd.DataFrame({self.meta['id_col']: id_values, self.meta['date_col']: self.dates[self.date_slice(start_date, end_date)][days]})
+        for c in columns:
+            values = self.window(c, start_date, end_date, ids)[rows, days]
+            if not np.issubdtype(values.dtype, np.floating):
+                values = pd.array(values, dtype='Int32')
+                values[values == INT_FILL] = pd.NA
+            df[c] = values
+        return df
@@ -0,0 +1,113 @@
+import glob
+import json
+import os
+from typing import Optional
+
+import pandas as pd
+
+from academic_data_download.utils.partitioned_parquet import partition_bounds, partition_files, partition_key, read_partitions, write_partitions
+
+MANIFEST = '_manifest.json'
+
+
+def _part_date(path: str) -> str:
+    # parts are named {name}_{YYYY-MM-DD}.parquet
+    return path[-len('YYYY-MM-DD.parquet'):-len('.parquet')]
+
+
+def _signature(path: str) -> list:
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def read_manifest(root: str) -> dict:
+    path = f'{root}/{MANIFEST}'
+    if not os.path.exists(path):
+        return {'days': {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_manifest(root: str, manifest: dict):
+    path = f'{root}/{MANIFEST}'
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(f'{path}.tmp', path)
+
+
+def compact_parts(parts_dir: str, root: str, name: str, period: str = 'month', sort_by=('date', 'sym_root', 'sym_suffix'), fill_values: Optional[dict] = None) -> dict:
+    """
+    Merge the daily part files `{parts_dir}/{name}_{YYYY-MM-DD}.parquet` into a dataset of one file
+    per month (or year) at `root`, sorted by `sort_by` (see partitioned_parquet.write_partitions).
+
+    `{root}/_manifest.json` records every compacted day with the modification time and size of its
+    part. Only new or rewritten parts are merged: each month they fall in is read, the rows of those
+    days are replaced and the file rewritten. Months without new parts are not touched, and parts
+    already compacted may be deleted. `fill_values` fills missing values of the new rows, e.g.
+    {'sym_suffix': ''}.
+
+    Returns
+    -------
+    dict
+        new_days, partitions (rewritten) and rows (of the new days).
+    """
+    os.makedirs(root, exist_ok=True)
+    manifest = read_manifest(root)
+    parts = {_part_date(path): path for path in glob.glob(f'{parts_dir}/{name}_*.parquet')}
+    new = {date: path for date, path in sorted(parts.items()) if manifest['days'].get(date) != _signature(path)}
+    stats = {'new_days': len(new), 'partitions': [], 'rows': 0}
+    if not new:
+        return stats
+
+    new_dates = pd.Series(sorted(new))
+    for key, dates in new_dates.groupby(partition_key(new_dates, period)):
+        frames = [pd.read_parquet(new[date]) for date in dates]
+        df = pd.concat([frame for frame in frames if not frame.empty] or frames[:1], ignore_index=True)
+        if fill_values:
+            df = df.fillna({c: v for c, v in fill_values.items() if c in df.columns})
+        stats['rows'] += len(df)
+        existing = partition_files(root).get(key)
+        if existing is not None:
+            old = pd.read_parquet(existing)
+            old = old[~old['date'].astype(str).str[:10].isin(set(dates))] # rewritten days are replaced
+            df = pd.concat([frame for frame in [old, df] if not frame.empty] or [df], ignore_index=True)
+        write_partitions(df, root, years=[key], sort_by=list(sort_by), period=period)
+        for date in dates:
+            manifest['days'][date] = _signature(new[date])
+        _write_manifest(root, manifest) # after every partition, so an interrupted run redoes at most one
+        stats['partitions'].append(key)
+    print(f"compacted {stats['new_days']} new days ({stats['rows']} rows) into {len(stats['partitions'])} partitions of {root}")
+    return stats
+
+
+class CompactedDataset():
+    """
+    Lazy view of a dataset written by `compact_parts`: nothing is read until asked, and then only the
+    partitions of the date range, the requested columns and the row groups that can hold the ids:
+
+        view = CompactedDataset('data/taq/compacted/100000_0/taq_retail_markethour')
+        view.read(start_date='2020-01-01', end_date='2020-06-30', columns=['date', 'sym_root', 'no'])
+        for df in view.iter_partitions(start_date='2015-01-01'):  # one month at a time
+            ...
+    """
+    def __init__(self, root: str, id_col: str = 'sym_root'):
+        self.root = root
+        self.id_col = id_col
+
+    @property
+    def partitions(self) -> list:
+        return list(partition_files(self.root)) if os.path.isdir(self.root) else []
+
+    @property
+    def days(self) -> list:
+        return sorted(read_manifest(self.root)['days'])
+
+    def read(self, start_date=None, end_date=None, columns: Optional[list] = None, ids=None) -> pd.DataFrame:
+        return read_partitions(self.root, start_date=start_date, end_date=end_date, columns=columns, permnos=ids, id_col=self.id_col)
+
+    def iter_partitions(self, start_date=None, end_date=None, columns: Optional[list] = None, ids=None):
+        for key in self.partitions:
+            start, end = partition_bounds(key)
+            if (start_date is not None and end < pd.Timestamp(start_date)) or (end_date is not None and start > pd.Timestamp(end_date)):
+                continue
+            yield read_partitions(self.root, start_date=max(start, pd.Timestamp(start_date or start)), end_date=min(end, pd.Timestamp(end_date or end)), columns=columns, permnos=ids, id_col=self.id_col)
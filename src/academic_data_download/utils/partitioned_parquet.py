@@ -0,0 +1,208 @@
+import os
+import re
+import shutil
+from typing import Optional
+
+import pandas as pd
+
+
+def partition_files(root: str) -> dict:
+    """
+    Files of a partitioned dataset, {year: path} (or {'YYYY-MM': path} for monthly partitions), sorted.
+    """
+    files = {}
+    for fn in sorted(os.listdir(root)):
+        m = re.match(r'^(\d{4})(-\d{2})?\.parquet$', fn)
+        if m:
+            files[fn[:-len('.parquet')] if m.group(2) else int(m.group(1))] = f'{root}/{fn}'
+    return files
+
+
+def partition_key(dates: pd.Series, period: str = 'year') -> pd.Series:
+    """
+    Partition of every date: its year, or 'YYYY-MM' with period='month'.
+    """
+    dates = pd.to_datetime(dates)
+    if period == 'month':
+        return dates.dt.strftime('%Y-%m')
+    if period == 'year':
+        return dates.dt.year
+    raise ValueError(f"period must be 'year' or 'month', not {period!r}")
+
+
+def partition_bounds(key) -> tuple:
+    """
+    First and last day of a partition (a year or 'YYYY-MM').
+    """
+    start = pd.Timestamp(f'{key}-01-01' if isinstance(key, int) else f'{key}-01')
+    end = start + (pd.offsets.YearEnd(0) if isinstance(key, int) else pd.offsets.MonthEnd(0))
+    return start, end
+
+
+def _plain_strings(df: pd.DataFrame) -> pd.DataFrame:
+    # every file has its own dictionary; readers of the whole directory assume a single one
+    cat_cols = df.columns[df.dtypes == 'category']
+    if len(cat_cols):
+        df = df.astype({c: object for c in cat_cols})
+    return df
+
+
+ROW_GROUP_SIZE = 100_000 # rows per row group; with rows sorted by security, a group spans a narrow range of ids
+
+
+def write_partitions(df: pd.DataFrame, root: str, date_col: str = 'date', years=None, dtypes=None, sort_by: Optional[list] = None, row_group_size: int = ROW_GROUP_SIZE, period: str = 'year'):
+    """
+    Write `df` as a dataset directory with one parquet file per calendar year of `date_col`
+    (`root/2019.parquet`, `root/2020.parquet`, ...), or per month with period='month'
+    (`root/2019-01.parquet`, ...; `years` then holds 'YYYY-MM' keys). `pd.read_parquet(root)`
+    reads it back whole.
+
+    Only the years in `years` are (re)written when given, the other files are left untouched;
+    otherwise the files of years without rows are removed. Each file is replaced atomically.
+    A plain parquet file at `root` is converted to the layout. `dtypes` casts the rows before
+    writing, so rewritten years keep the schema of the others. Rows are sorted by `sort_by`
+    (e.g. ['permno', 'date']) within each file and written in row groups of `row_group_size`
+    rows with min/max statistics, which `read_partitions` uses to skip groups.
+    """
+    if os.path.isfile(root):
+        legacy = pd.read_parquet(root)
+        os.remove(root)
+        write_partitions(legacy, root, date_col=date_col, sort_by=sort_by, row_group_size=row_group_size, period=period)
+    os.makedirs(root, exist_ok=True)
+
+    df = _plain_strings(df)
+    if dtypes is not None:
+        df = df.astype({c: t for c, t in dtypes.items() if c in df.columns and df[c].dtype != t})
+    year = partition_key(df[date_col], period)
+    if years is None:
+        years = sorted(year.unique())
+        for y, path in partition_files(root).items():
+            if y not in years:
+                os.remove(path)
+    for y in years:
+        path = f'{root}/{y if period == "month" else int(y)}.parquet'
+        part = df[year == y]
+        if part.empty:
+            if os.path.exists(path):
+                os.remove(path)
+            continue
+        if sort_by is not None:
+            part = part.sort_values(sort_by, kind='stable')
+        part.to_parquet(f'{path}.tmp', engine='fastparquet', index=False, row_group_offsets=row_group_size, stats=True)
+        os.replace(f'{path}.tmp', path)
+
+
+class PartitionAppender():
+    """
+    Writes a dataset with the layout of `write_partitions` from chunks that arrive one after the
+    other, without holding more than one chunk: the rows of every chunk are appended to the files
+    of their years as new row groups (sorted by `sort_by` within the chunk, so chunks of contiguous
+    securities keep the row group statistics narrow). Later chunks are cast to the dtypes and
+    column order of the first one. The files are written to `{root}.tmp` and replace `root` on close():
+
+        appender = PartitionAppender('data/pricevol/pricevol_processed.parquet', sort_by=['permno', 'date'])
+        for df in chunks:
+            appender.append(df)
+        appender.close()
+    """
+    def __init__(self, root: str, sort_by: Optional[list] = None, date_col: str = 'date', period: str = 'year', row_group_size: int = ROW_GROUP_SIZE):
+        self.root = root
+        self.tmp = f'{root}.tmp'
+        self.sort_by = sort_by
+        self.date_col = date_col
+        self.period = period
+        self.row_group_size = row_group_size
+        self.dtypes = None
+        self.rows = 0
+        remove_dataset(self.tmp)
+        os.makedirs(self.tmp)
+
+    def append(self, df: pd.DataFrame):
+        if df.empty:
+            return
+        df = _plain_strings(df)
+        if self.dtypes is None:
+            self.dtypes = df.dtypes.to_dict()
+        df = df[list(self.dtypes)].astype({c: t for c, t in self.dtypes.items() if df[c].dtype != t})
+        if self.sort_by is not None:
+            df = df.sort_values(self.sort_by, kind='stable')
+        year = partition_key(df[self.date_col], self.period)
+        for y, part in df.groupby(year, sort=True):
+            path = f'{self.tmp}/{y if self.period == "month" else int(y)}.parquet'
+            part.to_parquet(path, engine='fastparquet', index=False, row_group_offsets=self.row_group_size, stats=True, append=os.path.exists(path))
+        self.rows += len(df)
+
+    def close(self) -> int:
+        remove_dataset(self.root)
+        os.replace(self.tmp, self.root)
+        return self.rows
+
+
+def read_partitions(root: str, start_date=None, end_date=None, columns: Optional[list] = None, permnos=None, date_col: str = 'date', id_col: str = 'permno') -> pd.DataFrame:
+    """
+    Read a dataset written by `write_partitions` (or a plain parquet file).
+
+    Only the files of the years (months) in [start_date, end_date] are opened, only `columns` are
+    deserialized, and with `permnos` (ids in `id_col`) only the row groups whose statistics
+    can contain one of them are read. The rows are then filtered exactly.
+    """
+    filtered = start_date is not None or end_date is not None
+    read_columns = columns
+    if columns is not None:
+        extra = [c for c, needed in [(date_col, filtered), (id_col, permnos is not None)] if needed and c not in columns]
+        if extra:
+            read_columns = list(columns) + extra
+    filters = None
+    if permnos is not None:
+        permnos = pd.unique(pd.Series(permnos).dropna()).tolist()
+        filters = [(id_col, 'in', permnos)]
+    if os.path.isfile(root):
+        files = [root]
+    else:
+        files = [
+            path for key, path in partition_files(root).items()
+            if (end_date is None or partition_bounds(key)[0] <= pd.Timestamp(end_date))
+            and (start_date is None or partition_bounds(key)[1] >= pd.Timestamp(start_date))
+        ]
+    if not files or permnos == []:
+        return pd.DataFrame(columns=columns)
+    df = pd.concat([pd.read_parquet(path, columns=read_columns, filters=filters) for path in files], ignore_index=True)
+
+    keep = pd.Series(True, index=df.index)
+    if filtered:
+        date = pd.to_datetime(df[date_col])
+        if start_date is not None:
+            keep &= date >= pd.Timestamp(start_date)
+        if end_date is not None:
+            keep &= date <= pd.Timestamp(end_date)
+    if permnos is not None:
+        keep &= df[id_col].isin(permnos)
+    if not keep.all():
+        df = df[keep].reset_index(drop=True)
+    return df if read_columns is columns else df[columns]
+
+
+def max_date(root: str, date_col: str = 'date') -> Optional[pd.Timestamp]:
+    """
+    Latest `date_col` stored, reading only that column of the last year (month) with rows.
+    None if nothing is stored at `root` yet (no dataset, or a directory without any complete
+    year file, e.g. left by an interrupted first download); callers then download it in full.
+    """
+    if os.path.isfile(root):
+        files = [root]
+    elif os.path.isdir(root):
+        files = list(partition_files(root).values())
+    else:
+        return None
+    for path in reversed(files):
+        dates = pd.to_datetime(pd.read_parquet(path, columns=[date_col])[date_col])
+        if dates.notna().any():
+            return dates.max()
+    return None
+
+
+def remove_dataset(root: str):
+    if os.path.isdir(root):
+        shutil.rmtree(root)
+    elif os.path.exists(root):
+        os.remove(root)
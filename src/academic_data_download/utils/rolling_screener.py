@@ -0,0 +1,134 @@
+import json
+import os
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+
+class RollingState():
+    """
+    Per-security rolling windows of daily `fields`, kept as a ring buffer of the last `capacity`
+    trading days (float32, securities x days) in one .npz file, so a daily run only adds the newest
+    day instead of re-reading the history:
+
+        state = RollingState.load('data/pricevol/live_screener_state.npz', fields=['turnover', 'dvol', 'prccd', 'cshtrd'], capacity=61)
+        state.update(day_df)      # rows of one new day, one per security (id_col)
+        state.features([5, 20])   # moving averages and z-scores per security
+        state.save()
+
+    A day without a row for a security is a missing value in its window. Securities without a row
+    in the whole buffer are dropped on save.
+    """
+    def __init__(self, path: str, fields: list, capacity: int, id_col: str = 'id'):
+        self.path = path
+        self.fields = list(fields)
+        self.capacity = capacity
+        self.id_col = id_col
+        self.ids = np.array([], dtype=object)
+        self.labels = np.array([], dtype=object) # latest label (e.g. ticker) of every security
+        self.ring = np.full((len(self.fields), 0, capacity), np.nan, dtype=np.float32)
+        self.n_days = 0
+        self.last_date = None
+
+    @classmethod
+    def load(cls, path: str, fields: list, capacity: int, id_col: str = 'id') -> 'RollingState':
+        """
+        The state saved at `path`, or an empty one if there is none or it was kept for other
+        fields or another capacity.
+        """
+        state = cls(path, fields, capacity, id_col=id_col)
+        if not os.path.exists(path):
+            return state
+        with np.load(path, allow_pickle=False) as saved:
+            meta = json.loads(str(saved['meta']))
+            if meta['fields'] != state.fields or meta['capacity'] != capacity or meta['id_col'] != id_col:
+                print(f"{path} holds other fields or windows, starting a new state")
+                return state
+            state.ids = saved['ids'].astype(object)
+            state.labels = saved['labels'].astype(object)
+            state.ring = saved['ring']
+        state.n_days = meta['n_days']
+        state.last_date = pd.Timestamp(meta['last_date']) if meta['last_date'] else None
+        return state
+
+    def save(self):
+        keep = ~np.isnan(self.ring).all(axis=(0, 2)) # securities without any row in the buffer
+        meta = {'fields': self.fields, 'capacity': self.capacity, 'id_col': self.id_col, 'n_days': self.n_days,
+                'last_date': None if self.last_date is None else str(self.last_date.date())}
+        with open(f'{self.path}.tmp', 'wb') as f:
+            np.savez(f, ids=self.ids[keep].astype(str), labels=self.labels[keep].astype(str), ring=self.ring[:, keep], meta=json.dumps(meta))
+        os.replace(f'{self.path}.tmp', self.path)
+        self.ids, self.labels, self.ring = self.ids[keep], self.labels[keep], self.ring[:, keep]
+
+    def _slots(self, days: int, skip: int = 0) -> np.ndarray:
+        # buffer positions of the last `days` days before the latest `skip` ones
+        ages = np.arange(skip, min(skip + days, self.n_days))
+        return (self.n_days - 1 - ages) % self.capacity
+
+    def update(self, day_df: pd.DataFrame, date, label_col: Optional[str] = None):
+        """
+        Add the trading day `date` with the rows of `day_df` (`id_col` and the fields).
+        """
+        date = pd.Timestamp(date)
+        if self.last_date is not None and date <= self.last_date:
+            raise ValueError(f"{date.date()} is not after the last day of the state ({self.last_date.date()})")
+        day_df = day_df.drop_duplicates(self.id_col, keep='last')
+        ids = day_df[self.id_col].astype(str).to_numpy(dtype=object)
+        new = pd.Index(ids).difference(pd.Index(self.ids))
+        if len(new):
+            self.ids = np.concatenate([self.ids, new.to_numpy(dtype=object)])
+            self.labels = np.concatenate([self.labels, np.full(len(new), '', dtype=object)])
+            self.ring = np.concatenate([self.ring, np.full((len(self.fields), len(new), self.capacity), np.nan, dtype=np.float32)], axis=1)
+        rows = pd.Index(self.ids).get_indexer(ids)
+        slot = self.n_days % self.capacity
+        self.ring[:, :, slot] = np.nan
+        for k, field in enumerate(self.fields):
+            self.ring[k, rows, slot] = day_df[field].to_numpy(dtype=np.float64, na_value=np.nan)
+        if label_col is not None:
+            self.labels[rows] = day_df[label_col].astype(str).to_numpy(dtype=object)
+        self.n_days += 1
+        self.last_date = date
+
+    def _mean_std(self, k: int, days: int, skip: int = 0):
+        window = self.ring[k][:, self._slots(days, skip)].astype(np.float64)
+        count = (~np.isnan(window)).sum(axis=1)
+        total = np.nansum(window, axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(count > 0, total / count, np.nan)
+            std = np.sqrt(np.nansum((window - mean[:, None]) ** 2, axis=1) / count)
+        return mean, std, count
+
+    def features(self, windows: list, zscore_fields: Optional[list] = None) -> pd.DataFrame:
+        """
+        One row per security: the fields of the last day, their moving averages over the last w
+        days for every w of `windows` ({field}_ma{w}, over the days with a value; NaN without
+        any), and for `zscore_fields` the z-score of the last day against the w days before it
+        ({field}_z{w} = (x - mean) / std, population std; NaN with fewer than 2 days).
+        """
+        df = pd.DataFrame({self.id_col: self.ids.astype(str), 'label': self.labels.astype(str)})
+        last = self._slots(1)
+        for k, field in enumerate(self.fields):
+            df[field] = self.ring[k][:, last[0]] if len(last) else np.nan
+        for w in windows:
+            for k, field in enumerate(self.fields):
+                df[f'{field}_ma{w}'] = self._mean_std(k, w)[0]
+            for field in zscore_fields or []:
+                mean, std, count = self._mean_std(self.fields.index(field), w, skip=1)
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    df[f'{field}_z{w}'] = np.where((count >= 2) & (std > 0), (df[field] - mean) / std, np.nan)
+        return df
+
+
+def run_screens(df: pd.DataFrame, screens: dict, sort_by: Optional[str] = None, top: Optional[int] = None) -> dict:
+    """
+    {name: rows of `df` passing the screen}, where every screen is a DataFrame.query expression
+    evaluated on all securities at once, e.g. {'volume_spike': 'cshtrd_z20 > 3 and mktcap > 1'}.
+    """
+    out = {}
+    for name, expr in screens.items():
+        passed = df.query(expr)
+        if sort_by is not None:
+            passed = passed.sort_values(sort_by, ascending=False)
+        out[name] = passed if top is None else passed.head(top)
+    return out
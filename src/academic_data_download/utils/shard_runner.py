@@ -0,0 +1,137 @@
+import json
+import os
+import shutil
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Callable, Optional
+
+import pandas as pd
+import tqdm
+
+from academic_data_download.utils.chunk_planner import AdaptiveChunker
+from academic_data_download.utils.partitioned_parquet import partition_files, read_partitions, write_partitions
+
+MANIFEST = '_shards.json'
+
+
+def key_row_counts(root: str, key_col: str = 'permno', extra_cols=()) -> pd.DataFrame:
+    """
+    Rows per key of a partitioned dataset (see partitioned_parquet.write_partitions), reading only
+    `key_col` (and `extra_cols`, e.g. the permco of every permno) one year at a time.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per distinct (key_col, *extra_cols) with its number of rows, sorted.
+    """
+    cols = [key_col] + list(extra_cols)
+    counts = []
+    for path in partition_files(root).values():
+        counts.append(pd.read_parquet(path, columns=cols).value_counts(cols, dropna=False).rename('rows').reset_index())
+    counts = pd.concat(counts, ignore_index=True).groupby(cols, dropna=False)['rows'].sum().reset_index()
+    return counts.sort_values(cols, ignore_index=True)
+
+
+def plan_shards(row_counts: pd.Series, max_rows: float) -> list:
+    """
+    Contiguous runs of the keys of `row_counts` (key -> rows, in key order) of at most `max_rows`
+    rows each; a key with more rows gets a shard of its own.
+    """
+    chunker = AdaptiveChunker(row_counts.index.tolist(), row_counts.to_dict(), target_rows=max_rows)
+    shards = []
+    while (keys := chunker.next_chunk()) is not None:
+        shards.append(keys)
+    return shards
+
+
+def _read_manifest(shard_root: str) -> dict:
+    path = f'{shard_root}/{MANIFEST}'
+    if not os.path.exists(path):
+        return {'shards': {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_manifest(shard_root: str, manifest: dict):
+    path = f'{shard_root}/{MANIFEST}'
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(f'{path}.tmp', path)
+
+
+def run_shards(fn: Callable, shards: list, shard_root: str, n_workers: int = 1, args: tuple = (), desc: str = 'shards') -> dict:
+    """
+    Run fn(keys, out_root, *args) for every shard of `shards`, each in a fresh worker process of a
+    pool of `n_workers` (so the memory of a shard is returned to the system when it is done). `fn`
+    must be a module-level function that writes its output to the dataset `out_root`
+    (`{shard_root}/shard_{i:05d}`) and returns its number of rows.
+
+    `{shard_root}/_shards.json` lists the completed shards with their keys; a rerun with the same
+    plan skips them, so an interrupted run only redoes the shards in flight.
+
+    Returns
+    -------
+    dict
+        shards (run), skipped, rows and seconds.
+    """
+    os.makedirs(shard_root, exist_ok=True)
+    manifest = _read_manifest(shard_root)
+    todo = {}
+    for i, keys in enumerate(shards):
+        out_root = f'{shard_root}/shard_{i:05d}'
+        done = manifest['shards'].get(out_root.rsplit('/', 1)[-1])
+        if done is not None and done['keys'] == [str(k) for k in keys] and os.path.isdir(out_root):
+            continue
+        if os.path.isdir(out_root):
+            shutil.rmtree(out_root) # left over by an interrupted run
+        todo[out_root] = keys
+    stats = {'shards': len(todo), 'skipped': len(shards) - len(todo), 'rows': 0, 'seconds': 0.0}
+    if stats['skipped']:
+        print(f"Resuming {shard_root}: {stats['skipped']} of {len(shards)} shards already done.")
+
+    start = time.perf_counter()
+    errors = []
+    with ProcessPoolExecutor(max_workers=n_workers, max_tasks_per_child=1) as executor:
+        in_flight = {executor.submit(fn, keys, out_root, *args): out_root for out_root, keys in todo.items()}
+        with tqdm.tqdm(total=len(in_flight), desc=f"{desc} ({n_workers} processes)", unit='shard') as pbar:
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    out_root = in_flight.pop(future)
+                    if future.exception() is not None:
+                        errors.append(future.exception())
+                    else:
+                        stats['rows'] += future.result()
+                        manifest['shards'][out_root.rsplit('/', 1)[-1]] = {'keys': [str(k) for k in todo[out_root]], 'rows': future.result()}
+                        _write_manifest(shard_root, manifest)
+                    pbar.update(1)
+    stats['seconds'] = time.perf_counter() - start
+    if errors:
+        raise RuntimeError(
+            f"{len(errors)} shard(s) failed (first error: {errors[0]!r}). "
+            f"Completed shards are kept in {shard_root}; rerun to redo only the failed ones."
+        )
+    return stats
+
+
+def concat_shards(shard_root: str, root: str, n_shards: int, sort_by: Optional[list] = None) -> list:
+    """
+    Combine the year files of the shards `shard_00000` .. into the partitioned dataset `root`, one
+    year at a time (so at most a year of the whole output is in memory), then remove `shard_root`.
+    The shards hold contiguous key ranges in order, so the rows are concatenated in shard order.
+
+    Returns
+    -------
+    list
+        The years written.
+    """
+    shard_files = [partition_files(f'{shard_root}/shard_{i:05d}') for i in range(n_shards)]
+    years = sorted(set().union(*shard_files))
+    for year in years:
+        frames = [read_partitions(files[year]) for files in shard_files if year in files]
+        write_partitions(pd.concat(frames, ignore_index=True), root, years=[year], sort_by=sort_by)
+    for year, path in (partition_files(root).items() if os.path.isdir(root) else []):
+        if year not in years:
+            os.remove(path)
+    shutil.rmtree(shard_root)
+    return years
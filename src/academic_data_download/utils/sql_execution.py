@@ -1,31 +1,315 @@
-from typing import Callable
+from typing import Callable, Optional
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import glob
+import hashlib
+import json
+import threading
+import time
 import numpy as np
 import tqdm
 import pandas as pd
-import glob
 import os
-from typing import Callable
+
+from academic_data_download.utils.connection_pool import ConnectionPool, wrds_connection_factory
+from academic_data_download.db_manager.sql_params import params_fingerprint
+from academic_data_download.db_manager.query_metrics import timed_raw_sql
+from academic_data_download.utils.chunk_planner import AdaptiveChunker, estimate_rows_from_manifests, estimate_rows_by_count
+
+
+def _hash_text(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
 
 
-def sql_execution_in_chunks(db, sql_renderer: Callable, column_to_chunk: str, cache_path: str, chunk_size: int = 100) -> pd.DataFrame:
+def _split_rendered(rendered):
     """
-    Execute a SQL query in chunks.
+    A renderer returns either the SQL text or a (sql, params) tuple.
     """
-    # Split chunk_column into chunk_size roughly equal chunks for manageable queries. Build chunk lists (dedupe, drop NaN)
-    chunks_list = [
-        pd.Series(ch).dropna().tolist()
-        for ch in np.array_split(column_to_chunk, chunk_size)
-    ]
+    if isinstance(rendered, tuple):
+        return rendered
+    return rendered, None
+
+
+def file_checksum(path: str) -> str:
+    """
+    md5 of a file's bytes.
+    """
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+class ChunkManifest():
+    """
+    Bookkeeping of one chunked download, persisted as `manifest.json` next to its part files.
+
+    A job is identified by the hash of the SQL rendered for *all* keys, so changing the query
+    (columns, filters, key set) starts a new job directory, while changing only the chunking
+    keeps the completed chunks. Every chunk records its keys, part file, row count, checksum
+    and status ('running', 'done' or 'failed').
+    """
+    def __init__(self, job_dir: str, job_id: str, n_keys: int):
+        self.job_dir = job_dir
+        self.path = f'{job_dir}/manifest.json'
+        self._lock = threading.Lock()
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.data = json.load(f)
+            if self.data['job_id'] != job_id:
+                raise ValueError(f"{self.path} belongs to job {self.data['job_id']}, not {job_id}")
+        else:
+            self.data = {'job_id': job_id, 'n_keys': n_keys, 'created': time.strftime('%Y-%m-%d %H:%M:%S'), 'chunks': {}}
+
+    @staticmethod
+    def chunk_id(keys: list) -> str:
+        return _hash_text(json.dumps(keys))[:16]
+
+    def part_path(self, chunk_id: str) -> str:
+        return f'{self.job_dir}/{chunk_id}.parquet'
+
+    def _save(self):
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.data, f)
+        os.replace(tmp_path, self.path) # atomic, a crash never leaves a half-written manifest
+
+    def update(self, chunk_id: str, **fields):
+        with self._lock:
+            self.data['chunks'].setdefault(chunk_id, {}).update(fields)
+            self._save()
+
+    def is_valid(self, chunk_id: str) -> bool:
+        """
+        A chunk counts as done only if its part file still exists with the recorded checksum.
+        """
+        chunk = self.data['chunks'].get(chunk_id, {})
+        part_path = self.part_path(chunk_id)
+        return (
+            chunk.get('status') == 'done'
+            and os.path.exists(part_path)
+            and file_checksum(part_path) == chunk.get('checksum')
+        )
+
+    def done_keys(self) -> set:
+        done = set()
+        for chunk_id, chunk in self.data['chunks'].items():
+            if self.is_valid(chunk_id):
+                done.update(chunk['keys'])
+        return done
+
+    def failed_chunks(self) -> dict:
+        return {cid: c for cid, c in self.data['chunks'].items() if c.get('status') == 'failed'}
+
+
+def _run_chunk(conn, sql_renderer: Callable, chunks: list, manifest: ChunkManifest, metrics=None, template: Optional[str] = None, key_column: Optional[str] = None) -> dict:
+    """
+    Render, execute and save one chunk, recording the outcome in the manifest (and the query in `metrics`).
+    Returns the rows, bytes in memory and seconds of the chunk.
+    """
+    chunk_id = manifest.chunk_id(chunks)
+    part_path = manifest.part_path(chunk_id)
+    manifest.update(chunk_id, keys=chunks, status='running', started=time.time())
+    sql, params, render_s = '', None, 0.0
+    try:
+        start = time.perf_counter()
+        sql, params = _split_rendered(sql_renderer(chunks)) # Build SQL query for this chunk
+        render_s = time.perf_counter() - start
+        df, timings = timed_raw_sql(conn, sql, params)
+        df.to_parquet(f'{part_path}.tmp', index=False)
+        os.replace(f'{part_path}.tmp', part_path) # a crash mid-write leaves only a .tmp file
+    except Exception as e:
+        manifest.update(chunk_id, status='failed', error=repr(e))
+        if metrics is not None and sql:
+            metrics.record(template, sql, params, source='chunk', render_s=render_s, error=repr(e), chunk_id=chunk_id)
+        raise
+    nbytes = int(df.memory_usage(deep=True).sum())
+    if metrics is not None:
+        metrics.record(template, sql, params, source='chunk', render_s=render_s, rows=len(df), nbytes=nbytes, chunk_id=chunk_id, **timings)
+    fields = {}
+    if key_column is not None:
+        # exact rows per key, the row estimates of the next download (see utils/chunk_planner.py)
+        fields['key_rows'] = {str(k): int(n) for k, n in df[key_column].value_counts().items()}
+    manifest.update(chunk_id, status='done', rows=len(df), bytes=nbytes, checksum=file_checksum(part_path), finished=time.time(), error=None, **fields)
+    return {'rows': len(df), 'nbytes': nbytes, 'seconds': time.perf_counter() - start}
+
+
+def sql_execution_in_chunks(
+        db,
+        sql_renderer: Callable,
+        column_to_chunk,
+        cache_path: str,
+        chunk_size: int = 100,
+        n_workers: int = 1,
+        max_in_flight: Optional[int] = None,
+        connection_factory: Optional[Callable] = None,
+        metrics=None,
+        template: Optional[str] = None,
+        target_rows: Optional[float] = None,
+        target_bytes: Optional[float] = None,
+        target_seconds: Optional[float] = None,
+        row_estimates: Optional[dict] = None,
+        count_renderer: Optional[Callable] = None,
+        key_column: Optional[str] = None,
+    ) -> pd.DataFrame:
+    """
+    Execute a SQL query in chunks, resumably.
+
+    Every download gets a job directory `{dirname(cache_path)}/parts/{job_id}/` holding one part
+    file per chunk and a manifest (see `ChunkManifest`). Rerunning the same query skips the
+    chunks that completed with a valid checksum, only executes failed or missing keys and removes
+    the `.tmp` part files an interrupted run left behind. Only part files listed in the manifest
+    of the current job are merged.
+
+    By default the keys are split into `chunk_size` chunks of equal key counts. With `target_rows`
+    (or `target_bytes` / `target_seconds`) the chunks are instead packed to about that many rows
+    from estimated rows per key (see `utils/chunk_planner.py`), taken from `row_estimates`, else
+    from the manifests of earlier downloads next to this one, else from the COUNT query of
+    `count_renderer`; the budget follows the bytes per row and throughput observed during the run.
+
+    Parameters
+    ----------
+    db : wrds.Connection or any object with `raw_sql`
+        Connection used in serial mode (and whose engine is reused in pooled mode).
+    sql_renderer : callable
+        Maps a list of keys to the SQL text of one chunk, or to a (sql, params) tuple.
+    column_to_chunk : array-like
+        Keys (e.g. permnos) to split into chunks.
+    cache_path : str
+        Location of the final cache file; the job directory is created next to it.
+    chunk_size : int, optional
+        Number of chunks to split the keys into.
+    n_workers : int, optional
+        Number of parallel connections. 1 (default) runs the chunks one after another on `db`.
+    max_in_flight : int, optional
+        Maximum number of chunks submitted but not finished in pooled mode (default 2 * n_workers).
+    connection_factory : callable, optional
+        Returns a new connection with `raw_sql` (e.g. `lambda: SqlConnection(sqlite3.connect(path))`).
+        Defaults to new connections on the engine of `db`.
+    metrics : QueryMetrics, optional
+        Receives one record per executed chunk (see db_manager/query_metrics.py).
+    template : str, optional
+        Template name the records are filed under.
+    target_rows : float, optional
+        Rows per chunk; enables adaptive chunking (`chunk_size` is then ignored).
+    target_bytes : float, optional
+        Bytes in memory per chunk, converted to rows with the observed bytes per row.
+    target_seconds : float, optional
+        Seconds per chunk, converted to rows with the observed rows per second.
+    row_estimates : dict, optional
+        Estimated rows per key.
+    count_renderer : callable, optional
+        Maps a list of keys to a query returning (key, row count) per key, run for the keys without estimate.
+    key_column : str, optional
+        Column holding the key in the result; the rows per key are then recorded in the manifest
+        and the merged rows are sorted by key.
+
+    Returns
+    -------
+    pandas.DataFrame
+        All chunks concatenated in key order. With `key_column` the rows are sorted (stably) by
+        the position of their key in `column_to_chunk`, so serial, pooled, resumed and differently
+        chunked runs give identical results as long as the SQL orders the rows of a key (e.g.
+        ORDER BY date). Without it only the chunks are in key order and the row order within a
+        chunk is the one the SQL returns.
+    """
+    keys = pd.Series(column_to_chunk).dropna().tolist()
+    sql, params = _split_rendered(sql_renderer(keys))
+    job_id = _hash_text(sql + params_fingerprint(params))[:16] # the job is the query over all keys, whatever the chunking
+    job_dir = f'{os.path.dirname(cache_path)}/parts/{job_id}'
+    os.makedirs(job_dir, exist_ok=True)
+    manifest = ChunkManifest(job_dir, job_id, n_keys=len(keys))
+    for stale in glob.glob(f'{job_dir}/*.parquet.tmp'):
+        os.remove(stale) # part files an interrupted run did not finish writing
+
+    done_keys = manifest.done_keys()
+    todo = [k for k in keys if k not in done_keys]
+    adaptive = target_rows is not None or target_bytes is not None or target_seconds is not None
+    if adaptive:
+        # Pack the keys a previous run has not completed into chunks of about target_rows estimated rows
+        estimates = dict(row_estimates or {})
+        if len(estimates) < len(todo):
+            estimates = {**estimate_rows_from_manifests(os.path.dirname(job_dir), [k for k in todo if k not in estimates]), **estimates}
+        if len(estimates) < len(todo) and count_renderer is not None:
+            print("Estimating rows per key with a count query...")
+            estimates.update(estimate_rows_by_count(db, count_renderer, [k for k in todo if k not in estimates], metrics=metrics, template=f'{template} (row count)' if template else None))
+        chunker = AdaptiveChunker(todo, estimates, target_rows=target_rows or 5_000_000, target_bytes=target_bytes, target_seconds=target_seconds)
+        next_chunk, observe = chunker.next_chunk, chunker.observe
+    else:
+        # Split the keys into chunk_size roughly equal chunks and drop the keys a previous run already completed
+        chunks_list = [
+            [k for k in pd.Series(ch).tolist() if k not in done_keys]
+            for ch in np.array_split(np.array(keys, dtype=object), chunk_size)
+        ]
+        pending = [ch for ch in chunks_list if ch][::-1]
+        next_chunk = lambda: pending.pop() if pending else None
+        observe = lambda chunk, **stats: None
+    if done_keys:
+        print(f"Resuming job {job_id}: {len(done_keys)} of {len(keys)} keys already downloaded, {len(todo)} to go.")
+
+    errors = []
+    if n_workers <= 1:
+        with tqdm.tqdm(total=len(todo), desc="executing sql in chunks", unit='key') as pbar:
+            while (chunks := next_chunk()) is not None:
+                # Execute query and save result to a Parquet part file
+                try:
+                    observe(chunks, **_run_chunk(db, sql_renderer, chunks, manifest, metrics=metrics, template=template, key_column=key_column))
+                except Exception as e:
+                    errors.append(e)
+                pbar.update(len(chunks))
+    else:
+        factory = connection_factory or wrds_connection_factory(db)
+        max_in_flight = max_in_flight or 2 * n_workers
+
+        def task(chunks):
+            with pool.acquire() as conn:
+                stats = _run_chunk(conn, sql_renderer, chunks, manifest, metrics=metrics, template=template, key_column=key_column)
+            observe(chunks, **stats)
+            return stats
+
+        with ConnectionPool(factory, size=n_workers) as pool, ThreadPoolExecutor(max_workers=n_workers) as executor:
+            in_flight = {}
+            exhausted = False
+            with tqdm.tqdm(total=len(todo), desc=f"executing sql in chunks ({n_workers} connections)", unit='key') as pbar:
+                while not exhausted or in_flight:
+                    # keep at most max_in_flight chunks submitted at any time; adaptive chunks are formed only when submitted
+                    while not exhausted and len(in_flight) < max_in_flight:
+                        chunks = next_chunk()
+                        if chunks is None:
+                            exhausted = True
+                        else:
+                            in_flight[executor.submit(task, chunks)] = len(chunks)
+                    if not in_flight:
+                        break
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        if future.exception() is not None:
+                            errors.append(future.exception())
+                        pbar.update(in_flight.pop(future))
 
-    for idx, chunks in enumerate(tqdm.tqdm(chunks_list, desc="executing sql in chunks")):
-        sql = sql_renderer(chunks) # Build SQL query for this chunk
+    if adaptive and chunker.history:
+        history = chunker.report()
+        print(f"Adaptive chunks: {len(history)} chunks, rows per chunk min {history['rows'].min()}, median {int(history['rows'].median())}, max {history['rows'].max()}")
 
-        # Execute query and save result to a Parquet part file
-        df = db.raw_sql(sql)
-        os.makedirs(f'{os.path.dirname(cache_path)}/parts', exist_ok=True)
-        df.to_parquet(f'{os.path.dirname(cache_path)}/parts/{idx}.parquet', index=False)
+    if errors:
+        raise RuntimeError(
+            f"{len(errors)} chunk(s) failed (first error: {errors[0]!r}). "
+            f"Completed chunks are kept in {job_dir}; rerun to retry only the failed ones."
+        )
 
-    # Merge all part files into a single DataFrame
+    # Merge the part files of this job only, ordered by the position of their first key
     print("Merging all part files into a single DataFrame...")
-    df_agg = pd.concat([pd.read_parquet(f) for f in glob.glob(f'{os.path.dirname(cache_path)}/parts/*.parquet')], ignore_index=True)
+    position = {k: i for i, k in enumerate(keys)}
+    valid_chunks = [cid for cid in manifest.data['chunks'] if manifest.is_valid(cid)]
+    valid_chunks = [cid for cid in valid_chunks if any(k in position for k in manifest.data['chunks'][cid]['keys'])]
+    covered = set().union(*[manifest.data['chunks'][cid]['keys'] for cid in valid_chunks]) if valid_chunks else set()
+    missing = [k for k in keys if k not in covered]
+    if missing:
+        raise RuntimeError(f"{len(missing)} key(s) of job {job_id} have no valid part file, refusing to merge")
+    valid_chunks.sort(key=lambda cid: min(position[k] for k in manifest.data['chunks'][cid]['keys'] if k in position))
+    df_agg = pd.concat([pd.read_parquet(manifest.part_path(cid)) for cid in valid_chunks], ignore_index=True)
+    if key_column is not None:
+        # the chunking decides which keys share a chunk, so the rows of a chunk are put in key order too
+        order = np.argsort(df_agg[key_column].map(position).to_numpy(dtype=np.float64, na_value=np.nan), kind='stable')
+        df_agg = df_agg.iloc[order].reset_index(drop=True)
     return df_agg
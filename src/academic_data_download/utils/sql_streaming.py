@@ -0,0 +1,239 @@
+import os
+import shutil
+import time
+import uuid
+import datetime
+import decimal
+from typing import Callable, Iterator, Optional
+
+import fastparquet
+import pandas as pd
+
+
+def open_stream_cursor(db):
+    """
+    Open a cursor that streams rows instead of materializing the whole result set.
+
+    For a wrds.Connection (anything with a SQLAlchemy `engine` on psycopg2) this is a named,
+    server-side cursor; rows stay on the server until fetched. For plain DB-API stand-ins
+    (e.g. a `SqlConnection` over sqlite3/duckdb, or a `ReplayConnection`) a regular cursor is used.
+
+    Returns
+    -------
+    (cursor, close) : tuple
+        The cursor and a callable releasing it and its connection.
+    """
+    engine = getattr(db, 'engine', None)
+    if engine is not None:
+        raw = engine.raw_connection()
+        # psycopg2 only allows named cursors inside a transaction, wrds connections are in autocommit.
+        # The pool's wrapper does not forward attribute writes, so the psycopg2 connection itself is switched.
+        dbapi = getattr(raw, 'dbapi_connection', None) or raw.connection
+        autocommit = dbapi.autocommit
+        dbapi.autocommit = False
+        cursor = raw.cursor(name=f'stream_{uuid.uuid4().hex[:12]}')
+
+        def close():
+            cursor.close()
+            dbapi.rollback()
+            dbapi.autocommit = autocommit
+            raw.close() # back to the engine's pool
+
+        return cursor, close
+
+    conn = db if hasattr(db, 'cursor') else getattr(db, 'connection', db)
+    if not hasattr(conn, 'cursor'):
+        conn = conn.connection # SQLAlchemy connection -> DB-API connection
+    cursor = conn.cursor()
+    return cursor, cursor.close
+
+
+# dtypes of the result columns by the type a cursor reports in its description: postgres type
+# OIDs (psycopg2) or type names (duckdb). Integers are nullable, so a NULL in a later batch fits.
+_PG_TYPES = {
+    16: 'boolean', 20: 'Int64', 21: 'Int64', 23: 'Int64',
+    700: 'float64', 701: 'float64', 1700: 'float64',
+    1082: 'datetime64[ns]', 1114: 'datetime64[ns]',
+}
+_NAMED_TYPES = [
+    (('BIGINT', 'INTEGER', 'SMALLINT', 'TINYINT', 'UBIGINT', 'UINTEGER', 'USMALLINT', 'UTINYINT', 'INT'), 'Int64'),
+    (('DOUBLE', 'FLOAT', 'REAL', 'DECIMAL', 'NUMERIC'), 'float64'),
+    (('DATE', 'TIMESTAMP'), 'datetime64[ns]'),
+    (('BOOLEAN',), 'boolean'),
+]
+
+
+def description_dtypes(description) -> dict:
+    """
+    {column: dtype} of the columns whose type the cursor `description` declares (see _PG_TYPES);
+    other columns (e.g. text, or any column of sqlite) are not listed.
+    """
+    dtypes = {}
+    for column in description:
+        name, type_code = column[0], column[1]
+        if isinstance(type_code, int):
+            dtype = _PG_TYPES.get(type_code)
+        else:
+            type_name = str(type_code).upper()
+            dtype = next((t for prefixes, t in _NAMED_TYPES if type_name.split('(')[0] in prefixes), None)
+        if dtype is not None:
+            dtypes[name] = dtype
+    return dtypes
+
+
+def _apply_dtypes(df: pd.DataFrame, dtypes: dict) -> pd.DataFrame:
+    for col, dtype in dtypes.items():
+        if df[col].dtype == dtype:
+            continue
+        try:
+            df[col] = pd.to_datetime(df[col]) if dtype == 'datetime64[ns]' else df[col].astype(dtype)
+        except (pd.errors.OutOfBoundsDatetime, OverflowError):
+            pass # e.g. dates in year 9999 stay python objects
+    return df
+
+
+def _normalize_batch(df: pd.DataFrame, dtypes: Optional[dict] = None) -> pd.DataFrame:
+    """
+    Give the columns of a batch the `dtypes` the cursor declares (see description_dtypes), so every
+    batch of a result has the same schema, and turn the python objects of the other columns (date,
+    Decimal) into parquet-friendly dtypes. Integer columns the cursor does not describe are made
+    nullable (Int64) so that a NULL in a later batch does not change their type.
+    """
+    df = _apply_dtypes(df, dtypes or {})
+    for col in df.columns[df.dtypes == 'int64']:
+        df[col] = df[col].astype('Int64')
+    for col in df.columns[df.dtypes == object]:
+        non_null = df[col].dropna()
+        if non_null.empty:
+            continue
+        first = non_null.iloc[0]
+        if isinstance(first, (datetime.date, datetime.datetime)):
+            df[col] = pd.to_datetime(df[col])
+        elif isinstance(first, decimal.Decimal):
+            df[col] = df[col].astype(float)
+    return df
+
+
+def iter_sql_batches(db, sql: str, batch_size: int = 100_000, params=None) -> Iterator[pd.DataFrame]:
+    """
+    Yield the result of `sql` as DataFrames of at most `batch_size` rows.
+    """
+    cursor, close = open_stream_cursor(db)
+    try:
+        if hasattr(cursor, 'itersize'):
+            cursor.itersize = batch_size # rows per network round trip of a named cursor
+        if params is None:
+            cursor.execute(sql)
+        else:
+            cursor.execute(sql, params)
+        columns = None
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if columns is None:
+                columns = [d[0] for d in cursor.description]
+                dtypes = description_dtypes(cursor.description)
+            if not rows:
+                break
+            yield _normalize_batch(pd.DataFrame.from_records(rows, columns=columns, coerce_float=True), dtypes)
+    finally:
+        close()
+
+
+def stream_sql_to_parquet(
+        db,
+        sql: str,
+        path: str,
+        batch_size: int = 100_000,
+        params=None,
+        transform: Optional[Callable] = None,
+        partition_on: Optional[list] = None,
+        on_batch: Optional[Callable] = None,
+        verbose: bool = True,
+    ) -> dict:
+    """
+    Stream the result of `sql` to parquet with a bounded memory footprint.
+
+    Every batch is appended as its own row group (or, with `partition_on`, to a hive-partitioned
+    dataset directory), so at most one batch is held in memory.
+
+    Parameters
+    ----------
+    db : wrds.Connection or raw_sql-compatible stand-in
+    sql : str
+        Query to run.
+    path : str
+        Target parquet file (or dataset directory when `partition_on` is given). Overwritten.
+    batch_size : int, optional
+        Rows fetched and written per batch.
+    params : optional
+        Bound query parameters.
+    transform : callable, optional
+        Applied to every batch before it is written (e.g. the post-processing of a get_* method).
+    partition_on : list of str, optional
+        Columns to hive-partition the output on.
+    on_batch : callable, optional
+        Called with the statistics dict of every batch.
+    verbose : bool, optional
+        Print one line per batch.
+
+    Returns
+    -------
+    dict
+        Totals: path, batches, rows, bytes_in_memory (sum over batches), bytes_on_disk, seconds.
+    """
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    file_scheme = 'hive' if partition_on else 'simple'
+    start = time.time()
+    totals = {'path': path, 'batches': 0, 'rows': 0, 'bytes_in_memory': 0, 'bytes_on_disk': 0, 'seconds': 0.0}
+    dtypes = None
+
+    for df in iter_sql_batches(db, sql, batch_size=batch_size, params=params):
+        if transform is not None:
+            df = transform(df)
+        if dtypes is None:
+            dtypes = df.dtypes
+            all_null = [c for c in df.columns if dtypes[c] == object and df[c].isna().all()]
+        else:
+            # the batches have the types the cursor declares (see _normalize_batch); only a column of
+            # undeclared type that was all NULL in the first batch can still differ
+            undetermined = [c for c in all_null if df[c].dtype != object]
+            if undetermined:
+                raise ValueError(
+                    f"columns {undetermined} were all NULL in the first batch and have no type in the cursor description; "
+                    f"cast them in the SQL (e.g. CAST(... AS DATE)) to stream this query"
+                )
+            df = df.astype({c: t for c, t in dtypes.items() if df[c].dtype != t}, copy=False)
+
+        fastparquet.write(
+            path, df,
+            append=totals['batches'] > 0,
+            file_scheme=file_scheme,
+            partition_on=partition_on or [],
+            write_index=False,
+        )
+        batch_stats = {
+            'batch': totals['batches'],
+            'rows': len(df),
+            'bytes_in_memory': int(df.memory_usage(deep=True).sum()),
+            'seconds': round(time.time() - start, 3),
+        }
+        totals['batches'] += 1
+        totals['rows'] += batch_stats['rows']
+        totals['bytes_in_memory'] += batch_stats['bytes_in_memory']
+        if verbose:
+            print(f"batch {batch_stats['batch']}: {batch_stats['rows']} rows, {batch_stats['bytes_in_memory'] / 1e6:.1f} MB, total {totals['rows']} rows after {batch_stats['seconds']}s")
+        if on_batch is not None:
+            on_batch(batch_stats)
+
+    if totals['batches'] == 0:
+        print(f"query returned no rows, nothing written to {path}")
+    elif os.path.isdir(path):
+        totals['bytes_on_disk'] = sum(os.path.getsize(os.path.join(d, f)) for d, _, fs in os.walk(path) for f in fs)
+    else:
+        totals['bytes_on_disk'] = os.path.getsize(path)
+    totals['seconds'] = round(time.time() - start, 3)
+    return totals
@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+
+
+def _days(values) -> np.ndarray:
+    # dates (strings, datetime.date or datetime64) as datetime64[D]
+    return pd.to_datetime(pd.Series(values)).to_numpy().astype('datetime64[D]')
+
+
+def _symbols(sym_root, sym_suffix) -> pd.Series:
+    # one string per share class: root and suffix ('' if none)
+    return pd.Series(sym_root, dtype='string').fillna('').astype(str) + '.' + pd.Series(sym_suffix, dtype='string').fillna('').astype(str)
+
+
+class TAQLinkIndex():
+    """
+    The TAQ - CRSP link table (wrdsapps.taqmclink) of a date range held in memory, sorted by date
+    with the offsets of each date, so the symbols of a day and the (sym_root, sym_suffix, date) ->
+    permno lookup need no query:
+
+        link = TAQLinkIndex(wrds_manager.get_taq_link_table(date=None, start_date='2013-01-01', end_date='2024-12-31'))
+        link.symbols('2021-03-04', permnos=permno_list)  # sym_roots to query that day
+        df = link.attach_permno(df)                       # = inner merge with the link table
+    """
+    def __init__(self, link_df: pd.DataFrame):
+        days = _days(link_df['date'])
+        symbols = _symbols(link_df['sym_root'], link_df['sym_suffix'])
+        order = np.argsort(days, kind='stable')
+        self.days = days[order]
+        self.sym_root = link_df['sym_root'].astype(str).to_numpy()[order]
+        self.permno = pd.array(link_df['permno'], dtype='Int64')[order]
+        self.dates, self.offsets = np.unique(self.days, return_index=True)
+        self.offsets = np.append(self.offsets, len(self.days))
+
+        # (date, share class) keys as sorted integers for the permno lookup
+        self.symbol_codes, symbol_names = pd.factorize(symbols.to_numpy()[order])
+        self.symbol_names = pd.Index(symbol_names)
+        keys = self._key(np.searchsorted(self.dates, self.days), self.symbol_codes)
+        key_order = np.argsort(keys, kind='stable')
+        self.keys = keys[key_order]
+        self.key_permno = self.permno[key_order]
+
+    def _key(self, date_idx, symbol_codes):
+        return date_idx.astype(np.int64) * len(self.symbol_names) + symbol_codes
+
+    def __len__(self):
+        return len(self.days)
+
+    def _slice(self, date) -> slice:
+        day = np.datetime64(pd.Timestamp(date).date(), 'D')
+        i = np.searchsorted(self.dates, day)
+        if i == len(self.dates) or self.dates[i] != day:
+            return slice(0, 0)
+        return slice(self.offsets[i], self.offsets[i + 1])
+
+    def symbols(self, date, permnos=None) -> list:
+        """
+        The sym_roots linked on `date`, only those of `permnos` if given.
+        """
+        rows = self._slice(date)
+        sym_root = self.sym_root[rows]
+        if permnos is not None:
+            sym_root = sym_root[np.asarray(pd.Series(self.permno[rows]).isin(list(permnos)))]
+        return list(dict.fromkeys(sym_root)) # unique, in table order
+
+    def attach_permno(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        `df` (with date, sym_root and sym_suffix) with the linked permno, like an inner merge with
+        the link table on ['sym_root', 'sym_suffix', 'date']: rows without a link are dropped and a
+        row linked to several permnos is repeated. Rows keep their order.
+        """
+        days = _days(df['date'])
+        date_idx = np.searchsorted(self.dates, days)
+        known_day = date_idx < len(self.dates)
+        known_day[known_day] = self.dates[date_idx[known_day]] == days[known_day]
+        codes = self.symbol_names.get_indexer(_symbols(df['sym_root'], df['sym_suffix']).to_numpy())
+        keys = self._key(date_idx, codes)
+
+        first = np.searchsorted(self.keys, keys, side='left')
+        last = np.searchsorted(self.keys, keys, side='right')
+        counts = np.where(known_day & (codes >= 0), last - first, 0)
+        rows = np.repeat(np.arange(len(df)), counts)
+        # position of every output row in the sorted keys: first match of its row plus its rank among the matches
+        within = np.arange(len(rows)) - np.repeat(np.cumsum(counts) - counts, counts)
+        out = df.iloc[rows].reset_index(drop=True)
+        out['permno'] = self.key_permno[np.repeat(first, counts) + within]
+        return out
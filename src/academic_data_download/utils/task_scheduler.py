@@ -0,0 +1,176 @@
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Optional
+
+import tqdm
+
+from academic_data_download.utils.connection_pool import ConnectionPool, wrds_connection_factory
+
+# exception class names (anywhere in the MRO) treated as transient: lost connections, timeouts, server restarts
+TRANSIENT_ERRORS = {
+    'OperationalError',     # psycopg2 / sqlalchemy: connection closed, server terminated, statement timeout
+    'InterfaceError',       # psycopg2: connection already closed
+    'DisconnectionError',   # sqlalchemy
+    'TimeoutError',
+    'ConnectionError',      # includes ConnectionResetError, BrokenPipeError, ...
+    'IOException',          # duckdb
+}
+
+
+def is_transient(exc: BaseException) -> bool:
+    return any(cls.__name__ in TRANSIENT_ERRORS for cls in type(exc).__mro__)
+
+
+def describe_error(exc: BaseException, max_chars: int = 300) -> str:
+    # database errors embed the whole statement; its end holds the actual reason
+    message = ' '.join(str(exc).split())
+    if len(message) > max_chars:
+        message = '...' + message[-max_chars:]
+    return f'{type(exc).__name__}: {message}'
+
+
+class FailureLedger():
+    """
+    Tasks that failed after all retries, persisted as JSON so a later run can retry just those:
+
+        {"2021-03-04": {"attempts": 4, "error": "OperationalError(...)", "transient": true, "last_attempt": "..."}}
+
+    A task is removed from the ledger once it succeeds.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def record_failure(self, key: str, attempts: int, exc: BaseException):
+        with self._lock:
+            previous = self.entries.get(key, {}).get('attempts', 0)
+            self.entries[key] = {
+                'attempts': previous + attempts,
+                'error': describe_error(exc),
+                'transient': is_transient(exc),
+                'last_attempt': time.strftime('%Y-%m-%d %H:%M:%S'),
+            }
+            self._save()
+
+    def record_success(self, key: str):
+        with self._lock:
+            if self.entries.pop(key, None) is not None:
+                self._save()
+
+    def keys(self) -> list:
+        return sorted(self.entries)
+
+
+def run_with_retry(fn: Callable, retries: int = 3, backoff: float = 2.0, max_backoff: float = 60.0, on_retry: Optional[Callable] = None):
+    """
+    Call `fn()`; on a transient error wait backoff * 2**attempt seconds (with jitter, at most
+    max_backoff) and try again, up to `retries` more times. Other errors are raised at once.
+
+    Returns
+    -------
+    (result, attempts)
+    """
+    attempt = 0
+    while True:
+        try:
+            return fn(), attempt + 1
+        except Exception as e:
+            if attempt >= retries or not is_transient(e):
+                e.attempts = attempt + 1
+                raise
+            delay = min(backoff * 2 ** attempt, max_backoff) * random.uniform(0.5, 1.0)
+            if on_retry is not None:
+                on_retry(e, attempt + 1, delay)
+            time.sleep(delay)
+            attempt += 1
+
+
+def run_tasks(
+        keys: list,
+        fn: Callable,
+        db=None,
+        n_workers: int = 1,
+        connection_factory: Optional[Callable] = None,
+        retries: int = 3,
+        backoff: float = 2.0,
+        max_backoff: float = 60.0,
+        ledger: Optional[FailureLedger] = None,
+        desc: str = 'tasks',
+    ) -> dict:
+    """
+    Run `fn(key, conn)` for every key, `n_workers` at a time, with retries and a progress bar (with ETA).
+
+    With n_workers = 1 every task runs on `db`; otherwise on a pool of n_workers connections made
+    by `connection_factory` (default: new connections on the engine of `db`). A connection that
+    raised a transient error is dropped from the pool and replaced before the retry. Tasks that still
+    fail are recorded in `ledger` and do not stop the others.
+
+    Returns
+    -------
+    dict
+        done, failed (key -> error) and seconds.
+    """
+    start = time.time()
+    summary = {'done': [], 'failed': {}, 'seconds': 0.0}
+    lock = threading.Lock()
+    pool = None
+    if n_workers > 1:
+        pool = ConnectionPool(connection_factory or wrds_connection_factory(db), size=n_workers)
+
+    def attempt(key):
+        if pool is None:
+            return fn(key, db)
+        with pool.acquire() as conn:
+            try:
+                return fn(key, conn)
+            except Exception as e:
+                if is_transient(e):
+                    pool.discard(conn)
+                raise
+
+    def task(key):
+        on_retry = lambda e, n, delay: tqdm.tqdm.write(f"{key}: {describe_error(e)}, retry {n}/{retries} in {delay:.1f}s")
+        try:
+            run_with_retry(lambda: attempt(key), retries=retries, backoff=backoff, max_backoff=max_backoff, on_retry=on_retry)
+        except Exception as e:
+            if ledger is not None:
+                ledger.record_failure(str(key), getattr(e, 'attempts', 1), e)
+            with lock:
+                summary['failed'][key] = describe_error(e)
+            tqdm.tqdm.write(f"{key} failed: {describe_error(e)}")
+            return
+        if ledger is not None:
+            ledger.record_success(str(key))
+        with lock:
+            summary['done'].append(key)
+
+    with tqdm.tqdm(total=len(keys), desc=desc, unit='task') as pbar:
+        if pool is None:
+            for key in keys:
+                task(key)
+                pbar.update(1)
+        else:
+            with pool, ThreadPoolExecutor(max_workers=n_workers) as executor:
+                for future in as_completed([executor.submit(task, key) for key in keys]):
+                    future.result()
+                    pbar.update(1)
+                    pbar.set_postfix(failed=len(summary['failed']))
+
+    summary['seconds'] = round(time.time() - start, 1)
+    print(f"{desc}: {len(summary['done'])} done, {len(summary['failed'])} failed in {summary['seconds']}s")
+    return summary
@@ -1,7 +1,19 @@
 import wrds
+import os
 
 def connect_wrds(username, password):
     print(f"Connecting to WRDS with username: {username}")
     db = wrds.Connection(wrds_username=username, wrds_password=password, use_keyring=False)
     print("Connected to WRDS!")
     return db
+
+
+def connect_replay(path='data/replay/wrds_synthetic.duckdb', scale=1.0, **kwargs):
+    """
+    Offline drop-in for connect_wrds: synthetic WRDS tables in DuckDB (see db_manager/replay_backend.py).
+    """
+    from academic_data_download.db_manager.replay_backend import build_synthetic_wrds
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    print(f"Connecting to offline WRDS replay database: {path}")
+    return build_synthetic_wrds(path=path, scale=scale, **kwargs)
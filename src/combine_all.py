@@ -7,6 +7,8 @@ import pandas as pd
 import os
 import glob
 
+from academic_data_download.utils.partitioned_parquet import read_partitions, write_partitions, remove_dataset
+
 # hyperparameters
 start_year = 2010
 pricevol_path = 'data/pricevol/pricevol_processed.parquet'
@@ -60,10 +62,10 @@ print(factors_df.head())
 
 print("Step 3: Loading price/volume data...")
 # load pricevol
-pricevol_df = pd.read_parquet(pricevol_path)
+# only the years from start_year on are read
+pricevol_df = read_partitions(pricevol_path, start_date=f'{start_year}-01-01')
 print(f"  Price/volume data loaded from {pricevol_path}.")
 pricevol_df = pricevol_df.rename(columns={'date': 'trading_day_et'})
-pricevol_df = pricevol_df[pricevol_df['trading_day_et'] >= f'{start_year}-01-01']
 pricevol_df['trading_day_et'] = pd.to_datetime(pricevol_df['trading_day_et'])
 print("  Price/volume data after cleaning:")
 print(pricevol_df.head())
@@ -119,5 +121,7 @@ print("the shape of the dataframe is: ", df.shape)
 print(df.head())
 
 print(f"Step 7: Saving combined data to {combined_path} ...")
-df.to_parquet(combined_path)
+# one file per year, sorted by permno (see utils/partitioned_parquet.py); read it with read_partitions(combined_path, date_col='trading_day_et')
+remove_dataset(combined_path)
+write_partitions(df, combined_path, date_col='trading_day_et', sort_by=['permno', 'trading_day_et'])
 print(f'Saved to {combined_path}')
\ No newline at end of file
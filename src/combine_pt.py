@@ -20,11 +20,15 @@ Output files:
 
 import pandas as pd 
 
+from academic_data_download.utils.partitioned_parquet import read_partitions
+
 if __name__ == "__main__":
 
     # Load and preprocess the main stock data
     print("Reading all_data from parquet...")
-    all_data = pd.read_parquet('data/combined/all_data.parquet')
+    # only the row groups of securities with price targets are read
+    pt_permnos = pd.read_parquet('data/analysts_estimate/pt_detail_with_eps_estimate.parquet', columns=['permno'])['permno'].dropna().astype(int).unique()
+    all_data = read_partitions('data/combined/all_data.parquet', permnos=pt_permnos, date_col='trading_day_et')
     print("Converting trading_day_et to datetime...")
     all_data['trading_day_et'] = pd.to_datetime(all_data['trading_day_et'])
     all_data['permno'] = all_data['permno'].astype(int)
@@ -2,17 +2,16 @@
 This script combines TAQ (Trade and Quote) data with price target and earnings data for US equities.
 It performs the following steps:
 
-1. Loads TAQ data and processes symbol information.
-2. Loads and merges the TAQ link table to map symbols to PERMNOs.
-3. Loads price/volume data and merges it with TAQ data.
-4. Computes shifted TAQ and volume features for various time windows.
-5. Loads detailed price target revision data and filters by date.
-6. Loads earnings announcement dates and merges with price target data.
-7. Merges the enriched price target data with TAQ data on PERMNO and date.
-8. Saves the final combined dataset to disk.
+1. Opens the processed TAQ panel (base series and group index, with PERMNOs).
+2. Loads price/volume data and computes shifted volume features for various time windows.
+3. Loads detailed price target revision data and filters by date.
+4. Loads earnings announcement dates and merges with price target data.
+5. Joins the enriched price target data to the TAQ panel on PERMNO and date, deriving the
+   shifted TAQ features for the matched rows only, then merges the price/volume data.
+6. Saves the final combined dataset to disk.
 
 Input files:
-    - data/taq/taq_retail_markethour_100000_0_2013-01-01_2024-12-31.parquet
+    - data/taq/processed/taq_retail_markethour_processed_{cutoff_upper}_{cutoff_lower}/
     - data/pricevol/pricevol_processed.parquet
     - data/combined/price_target_detail_all_data.parquet
     - data/factors/single_factor/f_ep.parquet
@@ -35,6 +34,9 @@ import glob
 # compute factors
 from academic_data_download.factors_lab.taq_builder import TAQBuilder
 from academic_data_download.utils.wrds_connect import connect_wrds
+from academic_data_download.utils.partitioned_parquet import read_partitions
+from academic_data_download.utils.col_transform import panel_lead_lag
+from academic_data_download.utils.lead_lag_store import LeadLagPanel
 import dotenv
 dotenv.load_dotenv()
 
@@ -51,7 +53,8 @@ ravenpack_equities_path = 'data/ravenpack/f_rp_ess.parquet'
 ravenpack_global_macro_path = 'data/ravenpack/f_rp_global_macro.parquet'
 factors_path = 'data/factors/combined/factors_combined.parquet'
 bbg_macro_var_path = glob.glob('data/Macro variables/*.xlsx')
-taq_path = f'data/taq/processed/taq_retail_markethour_processed_{cutoff_upper}_{cutoff_lower}.parquet'
+taq_path = f'data/taq/processed/taq_retail_markethour_processed_{cutoff_upper}_{cutoff_lower}'
+taq_offsets = list(range(-5, 10)) + [-66, -22, 66, 132, 252]
 
 price_target_all_data_path = 'data/combined/price_target_detail_all_data.parquet'
 
@@ -61,36 +64,32 @@ combined_path = f'data/combined/price_target_all_data_with_taq_{cutoff_upper}_{c
 
 if __name__ == "__main__":
 
-    # Step 1: Load TAQ data and process symbol information
+    # Step 1: Open the TAQ panel; the shifted TAQ features are derived when joining in step 5
     print("Step 1: Loading taq data...")
-    taq_df = pd.read_parquet(taq_path).sort_values(by=['date'])
-    taq_df['date'] = pd.to_datetime(taq_df['date'])
-    taq_df.sort_values(by=['date'], inplace=True)
-    taq_df['sym_suffix'] = taq_df['sym_suffix'].fillna('')
-    taq_df['full_name'] = taq_df['sym_root'] + taq_df['sym_suffix']
-
-    # Step 3: Load price/volume data and merge with TAQ data
-    print("Step 3: Loading pricevol data... merging with taq data")
-    pricevol = pd.read_parquet(pricevol_path)[['permno', 'date', 'vol']]
+    taq_panel = LeadLagPanel(taq_path)
+    taq_columns = [c for c in taq_panel.series.columns if c not in ['permno', 'date']]
+    taq_columns += [f'{col}_in_{_day}d' for _day in taq_offsets for col in ['no', 'nob', 'nos', 's', 'sb', 'ss']]
+
+    # Step 2: Load price/volume data and compute the shifted volume features
+    print("Step 2: Loading pricevol data...")
+    # only the years from start_year on, the row groups of the TAQ securities and three columns are read
+    pricevol = read_partitions(pricevol_path, start_date=f'{start_year}-01-01', permnos=taq_panel.series['permno'].unique(), columns=['permno', 'date', 'vol'])
     pricevol['date'] = pd.to_datetime(pricevol['date'])
-    pricevol = pricevol[pricevol['date'] >= f'{start_year}-01-01']
     pricevol['vol'] = round(pricevol['vol']/1000, 0)  # Convert volume to thousands
-    # Step 4: Compute shifted TAQ and volume features for various time windows
+    # shifted volume features for the TAQ offsets
     # for _day in list(range(-5, 23)) + [-66, -22, 66, 132, 198, 252]:
-    for _day in list(range(-5, 10)) + [-66, -22, 66, 132, 252]:
-        pricevol[f'vol_in_{_day}d'] = pricevol.groupby('permno')['vol'].transform(lambda x: x.shift(-_day))
-
-    taq_df = pd.merge(taq_df, pricevol, left_on=['permno', 'date'], right_on=['permno', 'date'], how='left')
+    shifted = panel_lead_lag(pricevol, by='permno', cols=['vol'], offsets=taq_offsets)
+    pricevol = pd.concat([pricevol, shifted], axis=1)
     
-    # Step 5: Load detailed price target revision data and filter by date
-    print("Step 4: Loading price_target_all_data... ")
+    # Step 3: Load detailed price target revision data and filter by date
+    print("Step 3: Loading price_target_all_data... ")
     price_target_all_data = pd.read_parquet(price_target_all_data_path)
     price_target_all_data['ann_deemed_date'] = pd.to_datetime(price_target_all_data['ann_deemed_date'])
     print(f"  Price/volume data loaded from {price_target_all_data_path}.")
     print("price_target_all_data: ", price_target_all_data)
 
-    # Step 6: Load earnings announcement dates and merge with price target data
-    print("Step 5: Loading earnings date... merging with price_target_all_data")
+    # Step 4: Load earnings announcement dates and merge with price target data
+    print("Step 4: Loading earnings date... merging with price_target_all_data")
     earnings_date = pd.read_parquet('data/factors/single_factor/f_ep.parquet')
     earnings_date['date'] = pd.to_datetime(earnings_date['date'])
     price_target_all_data = pd.merge(
@@ -102,17 +101,18 @@ if __name__ == "__main__":
     )
     print("price_target_all_data with earnings date: ", price_target_all_data)
 
-    # Step 7: Merge the enriched price target data with TAQ data on PERMNO and date
-    print("Step 6: Taq data merging with price_target_all_data")
-    price_target_all_data = pd.merge(
-        price_target_all_data,
-        taq_df,
+    # Step 5: Merge the enriched price target data with TAQ data on PERMNO and date
+    print("Step 5: Taq data merging with price_target_all_data")
+    price_target_all_data = taq_panel.join(
+        price_target_all_data.drop(columns='date'),
         left_on=['permno', 'ann_deemed_date'],
         right_on=['permno', 'date'],
-        how='inner'
+        columns=taq_columns,
     )
+    price_target_all_data = pd.merge(price_target_all_data, pricevol, on=['permno', 'date'], how='left')
     print("price_target_all_data with taq data: ", price_target_all_data)
 
-    # Step 8: Save the final combined dataset to disk
+    # Step 6: Save the final combined dataset to disk
+    print("Step 6: Saving the combined data...")
     price_target_all_data.to_parquet(combined_path)
     print(f"saved price_target_all_data with taq data to {combined_path}")
\ No newline at end of file
@@ -18,4 +18,13 @@ permno_list = None
 PriceVolComputer = PriceVolComputer(permno_list=permno_list, verbose=True, db=db)
 # PriceVolComputer.pricevol_processed(name='pricevol_processed')
 # PriceVolComputer.marketcap(name='marketcap')
-PriceVolComputer.live_pricevol(name='live_pricevol', start_date='2025-10-08', end_date='2025-10-08')
\ No newline at end of file
+# full universe in shards of permnos (permcos) on all cores, about 4 GB per process
+# PriceVolComputer.pricevol_processed_sharded(name='pricevol_processed', n_workers=32, memory_budget=4e9)
+# PriceVolComputer.marketcap_sharded(name='marketcap', n_workers=32, memory_budget=4e9)
+# both outputs streamed in groups of securities, about 2 GB of memory whatever the universe
+# PriceVolComputer.pricevol_out_of_core(memory_budget=2e9)
+# memory-mapped permno x trading day arrays of pricevol_raw, shared by every process that opens them
+# panel = PriceVolComputer.pricevol_panel(name='pricevol_panel')
+PriceVolComputer.live_pricevol(name='live_pricevol', start_date='2025-10-08', end_date='2025-10-08')
+# daily screen with moving averages and volume z-scores; each run only queries the secd days since the last one
+# PriceVolComputer.live_screener()
\ No newline at end of file
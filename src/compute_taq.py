@@ -17,6 +17,8 @@ permno_list = None
 TAQBuilder = TAQBuilder(verbose=True, db=db)
 TAQBuilder.taq_peek(name='taq_peek', sym_root_list=['BRK'], year=2025, date='20251009')
 # TAQBuilder.taq_tables(name='taq_tables')
+# all dollar-size buckets from one scan per day, into parts/{upper}_{lower}/
+# TAQBuilder.taq_retail_markethour_buckets(buckets=[(100000, 0), (10000, 2000), (30000, 10000), (2000, 500)], start_date='2013-01-01', end_date='2024-12-31', n_workers=4)
 # TAQBuilder.taq_retail_markethour(name='taq_retail_markethour', retail_cutoff_upper=10000, retail_cutoff_lower=2000, start_date='2013-01-01', end_date='2024-12-31')
 # TAQBuilder.taq_retail_markethour(name='taq_retail_markethour', retail_cutoff_upper=30000, retail_cutoff_lower=10000, start_date='2019-12-31', end_date='2024-12-31')
 TAQBuilder.taq_retail_markethour_processed(retail_cutoff_upper=100000, retail_cutoff_lower=0)
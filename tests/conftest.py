@@ -0,0 +1,36 @@
+import os
+
+import pytest
+
+from academic_data_download.db_manager.replay_backend import ReplayConnection, build_synthetic_wrds
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+
+
+@pytest.fixture(scope='session')
+def replay_path(tmp_path_factory):
+    pytest.importorskip('duckdb') # the replay extra
+    # 30 securities over 2013-2014 with TAQ trades on the last two trading days
+    path = str(tmp_path_factory.mktemp('replay') / 'wrds.duckdb')
+    build_synthetic_wrds(path, scale=0.3, start_date='2013-01-01', end_date='2014-12-31', taq_days=2, verbose=False).close()
+    return path
+
+
+@pytest.fixture(scope='session')
+def workdir(tmp_path_factory):
+    """
+    The working directory of the session: the templates are looked up under ./src and the
+    caches (query cache, metrics) go to ./data, as when running from the repository root.
+    """
+    path = tmp_path_factory.mktemp('work')
+    os.symlink(SRC, path / 'src')
+    with pytest.MonkeyPatch.context() as mp:
+        mp.chdir(path)
+        yield path
+
+
+@pytest.fixture(scope='session')
+def replay_db(replay_path, workdir):
+    db = ReplayConnection(replay_path, read_only=True)
+    yield db
+    db.close()
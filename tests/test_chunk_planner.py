@@ -0,0 +1,50 @@
+import numpy as np
+
+from academic_data_download.utils.chunk_planner import AdaptiveChunker
+
+
+def _run(chunker, rows_of, bytes_per_row=100):
+    # drains the chunker as a download would, returns the true rows of every chunk
+    rows = []
+    while (chunk := chunker.next_chunk()) is not None:
+        n = sum(rows_of[k] for k in chunk)
+        chunker.observe(chunk, rows=n, nbytes=n * bytes_per_row, seconds=1.0)
+        rows.append(n)
+    return rows
+
+
+def test_biased_estimates_are_corrected():
+    # user-012: counts four times too low (e.g. over a shorter date range)
+    rng = np.random.default_rng(0)
+    keys = list(range(5_000))
+    rows_of = dict(zip(keys, rng.integers(50, 150, len(keys))))
+    chunker = AdaptiveChunker(keys, {k: rows_of[k] / 4 for k in keys}, target_rows=10_000)
+    rows = _run(chunker, rows_of)
+    assert rows[0] > 3 * 10_000
+    assert all(0.8 * 10_000 <= n <= 1.2 * 10_000 for n in rows[6:-1])
+    assert 3.5 < chunker.scale < 4.5
+    assert len(chunker.report()) == len(rows)
+
+
+def test_chunks_keep_the_key_order_and_respect_max_keys():
+    keys = [f'k{i}' for i in range(1_000)]
+    chunker = AdaptiveChunker(keys, {k: 1 for k in keys[:500]}, target_rows=300, max_keys=120) # half without an estimate
+    chunks = []
+    while (chunk := chunker.next_chunk()) is not None:
+        chunks.append(chunk)
+    assert [k for chunk in chunks for k in chunk] == keys
+    assert max(len(chunk) for chunk in chunks) == 120
+
+
+def test_target_bytes_bounds_the_chunks():
+    keys = list(range(2_000))
+    rows_of = {k: 100 for k in keys}
+    chunker = AdaptiveChunker(keys, rows_of, target_rows=50_000, target_bytes=1e6)
+    rows = _run(chunker, rows_of, bytes_per_row=200) # 5_000 rows fit in target_bytes
+    assert rows[0] == 50_000 # no bytes observed yet
+    assert all(n * 200 <= 1e6 for n in rows[1:]) and max(rows[1:]) == 5_000
+
+
+def test_a_key_above_the_budget_is_a_chunk_of_its_own():
+    chunker = AdaptiveChunker(['a', 'b', 'c'], {'a': 10, 'b': 1_000, 'c': 10}, target_rows=100)
+    assert [chunker.next_chunk() for _ in range(4)] == [['a'], ['b'], ['c'], None]
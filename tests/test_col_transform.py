@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+
+from academic_data_download.utils.col_transform import panel_lead_lag
+
+OFFSETS = [-22, -5, -1, 1, 2, 5, 66]
+
+
+def _panel(n=20_000, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'permno': rng.choice([f's{i}' for i in range(200)] + [None], n),
+        'no': rng.integers(0, 100, n),
+        'sb': pd.array(rng.integers(0, 100, n), dtype='Int64'),
+        'ret': rng.normal(size=n),
+        'date': pd.Timestamp('2020-01-01') + pd.to_timedelta(rng.integers(0, 1000, n), 'D'),
+        'side': rng.choice(['b', 's'], n).astype(object),
+    })
+    df.loc[df.sample(frac=0.05, random_state=1).index, 'sb'] = pd.NA
+    return df
+
+
+def test_panel_lead_lag_matches_groupby_shift():
+    # user-019: every offset equals df.groupby(by)[col].shift(-d), dtypes included
+    df = _panel()
+    cols = ['no', 'sb', 'ret', 'date', 'side']
+    out = panel_lead_lag(df, 'permno', cols, OFFSETS)
+    expected = {f'{c}_in_{d}d': df.groupby('permno')[c].shift(-d) for d in OFFSETS for c in cols}
+    assert list(out.columns) == list(expected)
+    for name, values in expected.items():
+        pd.testing.assert_series_equal(out[name], values, check_names=False, obj=name)
+
+
+def test_panel_lead_lag_order_by():
+    df = _panel().sample(frac=1, random_state=3)
+    out = panel_lead_lag(df, 'permno', ['ret'], [1, -2], order_by='date')
+    ordered = df.sort_values('date', kind='stable').groupby('permno')['ret']
+    pd.testing.assert_series_equal(out['ret_in_1d'], ordered.shift(-1).reindex(df.index), check_names=False)
+    pd.testing.assert_series_equal(out['ret_in_-2d'], ordered.shift(2).reindex(df.index), check_names=False)
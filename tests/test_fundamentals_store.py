@@ -0,0 +1,54 @@
+import json
+
+import pandas as pd
+
+from academic_data_download.db_manager.fundamentals_store import FundamentalsStore
+from academic_data_download.db_manager.wrds_sql import WRDSManager
+
+
+class _Manager():
+    # WRDSManager that records the fund lists it is asked for and can hide the last filings of WRDS
+    def __init__(self, db, drop_last=0):
+        self.wrds_manager = WRDSManager(db, verbose=False, cache_path=None, metrics_path=None)
+        self.drop_last = drop_last
+        self.fetched = []
+
+    def get_fundq(self, fund_list, gvkey_list=None, start_year=2000):
+        self.fetched.append(list(fund_list))
+        df = self.wrds_manager.get_fundq(fund_list=fund_list, gvkey_list=gvkey_list, start_year=start_year)
+        return df.sort_values(['gvkey', 'datadate']).groupby('gvkey').head(-self.drop_last) if self.drop_last else df
+
+
+def _sorted(df):
+    return df.sort_values(['gvkey', 'datadate', 'fyearq', 'fqtr']).reset_index(drop=True)
+
+
+def test_stored_columns_are_fetched_again_when_rows_change(replay_db, tmp_path, capsys):
+    before = _Manager(replay_db, drop_last=1) # the latest quarter is not filed yet
+    FundamentalsStore(before, path=str(tmp_path), verbose=False).prefetch('fundq', ['atq', 'saleq'])
+
+    after = _Manager(replay_db)
+    store = FundamentalsStore(after, path=str(tmp_path), verbose=False)
+    df = store.get_fundq(['atq', 'ibq'])
+    assert after.fetched == [['ibq'], ['atq', 'saleq', 'ibq']]
+    assert sorted(store.stored_columns('fundq')) == ['atq', 'ibq', 'saleq']
+
+    fresh = FundamentalsStore(_Manager(replay_db), path=str(tmp_path / 'fresh'), verbose=False).get_fundq(['atq', 'ibq'])
+    assert len(df) > len(before.get_fundq(['atq']))
+    pd.testing.assert_frame_equal(_sorted(df), _sorted(fresh))
+    assert capsys.readouterr().out == '' # verbose=False
+
+
+def test_stored_columns_are_fetched_again_after_the_ttl(replay_db, tmp_path):
+    manager = _Manager(replay_db)
+    store = FundamentalsStore(manager, path=str(tmp_path), ttl=60, verbose=False)
+    first = store.get_fundq(['atq'])
+    store.get_fundq(['atq'])
+    assert manager.fetched == [['atq']] and not store.is_stale('fundq')
+
+    fetched_at = store.fetched_at('fundq')
+    with open(f'{tmp_path}/all_2000/fundq/_meta.json', 'w') as f:
+        json.dump({'fetched_at': fetched_at - 61}, f)
+    assert store.is_stale('fundq')
+    pd.testing.assert_frame_equal(store.get_fundq(['atq']), first)
+    assert manager.fetched == [['atq'], ['atq']] and not store.is_stale('fundq')
@@ -0,0 +1,71 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from academic_data_download.utils.partitioned_parquet import PartitionAppender, max_date, partition_files, read_partitions, write_partitions
+
+
+def _panel(n=5_000, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'permno': rng.integers(10000, 10100, n),
+        'date': pd.Timestamp('2018-01-01') + pd.to_timedelta(rng.integers(0, 3 * 365, n), 'D'),
+        'prc': np.round(rng.uniform(1, 100, n), 2),
+    })
+    df['ticker'] = pd.Categorical('T' + (df['permno'] % 7).astype(str))
+    return df
+
+
+def _sorted(df):
+    return df.sort_values(['permno', 'date', 'prc']).reset_index(drop=True)
+
+
+def test_write_and_filtered_reads(tmp_path):
+    df = _panel()
+    root = f'{tmp_path}/panel.parquet'
+    write_partitions(df, root, sort_by=['permno', 'date'], row_group_size=500)
+    assert list(partition_files(root)) == [2018, 2019, 2020]
+    expected = df.astype({'ticker': object})
+    pd.testing.assert_frame_equal(_sorted(read_partitions(root)), _sorted(expected))
+
+    permnos = [10003, 10050, 99999]
+    part = read_partitions(root, start_date='2019-03-15', end_date='2020-02-01', permnos=permnos, columns=['prc'])
+    keep = expected['date'].between('2019-03-15', '2020-02-01') & expected['permno'].isin(permnos)
+    assert list(part.columns) == ['prc']
+    assert sorted(part['prc']) == sorted(expected.loc[keep, 'prc'])
+    assert read_partitions(root, start_date='2030-01-01', columns=['prc']).empty
+    assert max_date(root) == df['date'].max()
+
+    # rewriting one year leaves the others untouched
+    mtime = os.path.getmtime(f'{root}/2018.parquet')
+    write_partitions(df[df['date'].dt.year != 2019], root, years=[2019], sort_by=['permno', 'date'])
+    assert list(partition_files(root)) == [2018, 2020] and os.path.getmtime(f'{root}/2018.parquet') == mtime
+
+
+def test_appended_chunks_match_one_write(tmp_path):
+    df = _panel()
+    write_partitions(df, f'{tmp_path}/whole.parquet', sort_by=['permno', 'date'])
+    appender = PartitionAppender(f'{tmp_path}/appended.parquet', sort_by=['permno', 'date'], row_group_size=500)
+    for permnos in np.array_split(np.arange(10000, 10100), 4): # chunks of contiguous securities
+        appender.append(df[df['permno'].isin(permnos)].astype({'prc': 'float32'} if permnos[0] > 10000 else {}))
+    appender.append(df.iloc[:0])
+    assert appender.close() == len(df)
+    assert not os.path.exists(f'{tmp_path}/appended.parquet.tmp')
+    whole = read_partitions(f'{tmp_path}/whole.parquet')
+    appended = read_partitions(f'{tmp_path}/appended.parquet')
+    pd.testing.assert_frame_equal(appended, whole) # sorted within the chunks, chunks in permno order
+    assert read_partitions(f'{tmp_path}/appended.parquet', permnos=[10042])['permno'].eq(10042).all()
+
+
+def test_max_date_of_missing_or_partial_dataset(tmp_path):
+    # user-010: callers download in full when nothing complete is stored
+    root = f'{tmp_path}/panel.parquet'
+    assert max_date(root) is None
+    os.makedirs(root)
+    assert max_date(root) is None
+    _panel().to_parquet(f'{root}/2018.parquet.tmp') # interrupted write of the first year
+    assert max_date(root) is None
+    df = _panel()
+    write_partitions(df[df['date'].dt.year == 2018], root)
+    assert max_date(root) == df.loc[df['date'].dt.year == 2018, 'date'].max()
@@ -0,0 +1,117 @@
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from academic_data_download.factors_lab.pricevol_builder import RETURN_WINDOWS, PriceVolComputer, add_returns
+from academic_data_download.utils.partitioned_parquet import read_partitions, write_partitions
+
+
+def _rolling_returns(df, col, window):
+    # the rolling np.prod that add_returns replaced
+    cum = round(df.groupby('permno')[col].transform(lambda x: x.rolling(window=window).apply(lambda y: np.prod(1 + y) - 1, raw=True)), 4)
+    return cum, round(cum.groupby(df['permno']).shift(-window), 4)
+
+
+def _synthetic_returns(n=20_000, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({'permno': np.sort(rng.integers(0, 40, n)), 'date': pd.Timestamp('2000-01-01') + pd.to_timedelta(np.arange(n) % 3000, 'D')})
+    df['ret'] = pd.array(np.round(rng.normal(0, 0.03, n), 4), dtype='Float64')
+    df.loc[rng.random(n) < 0.01, 'ret'] = pd.NA
+    df.loc[rng.random(n) < 0.001, 'ret'] = -1.0
+    df['retx'] = df['ret'] * 0.99
+    df['prc'], df['cfacpr'] = 10.0, 1.0
+    return df
+
+
+def _computer(db, save_path):
+    pvc = PriceVolComputer(verbose=False, db=db, permno_list=None)
+    pvc.save_path = str(save_path)
+    return pvc
+
+
+@pytest.fixture(scope='session')
+def raw_cache(replay_db, workdir):
+    # the CRSP daily cache every computer below starts from
+    ref = _computer(replay_db, workdir / 'ref')
+    ref.pricevol_raw()
+    return workdir / 'ref' / 'pricevol_raw.parquet'
+
+
+def test_add_returns_matches_rolling_prod(replay_db, raw_cache):
+    # user-021: the closed-form returns equal the rolling product to the 4 decimals kept
+    for df in [read_partitions(str(raw_cache)), _synthetic_returns()]:
+        out = add_returns(df.copy())
+        for col, suffix in [('ret', ''), ('retx', '_excl_div')]:
+            for window in RETURN_WINDOWS:
+                cum, fwd = _rolling_returns(out, col, window)
+                for name, expected in [(f'cum_ret_{window}d{suffix}', cum), (f'fwd_ret_{window}d{suffix}', fwd)]:
+                    expected = expected.to_numpy(dtype=np.float64, na_value=np.nan)
+                    np.testing.assert_array_equal(np.isnan(out[name].to_numpy()), np.isnan(expected), err_msg=name)
+                    np.testing.assert_allclose(out[name].to_numpy(), expected, rtol=0, atol=1.0001e-4, err_msg=name)
+
+
+def test_sharded_matches_in_memory(replay_db, raw_cache, workdir):
+    # user-022: the sharded outputs hold the same rows, in the same order, as the in-memory ones
+    ref = _computer(replay_db, workdir / 'ref')
+    ref.pricevol_processed()
+    ref.marketcap()
+    shutil.copytree(raw_cache, workdir / 'sharded' / 'pricevol_raw.parquet')
+    sharded = _computer(replay_db, workdir / 'sharded')
+    assert sharded.pricevol_processed_sharded(n_workers=2, memory_budget=1200 * 2000)['shards'] > 1
+    assert sharded.marketcap_sharded(n_workers=2, memory_budget=400 * 1500)['shards'] > 1
+    for name in ['pricevol_processed', 'marketcap']:
+        pd.testing.assert_frame_equal(read_partitions(f'{workdir}/sharded/{name}.parquet'), read_partitions(f'{workdir}/ref/{name}.parquet'), obj=name)
+
+
+def test_out_of_core_matches_in_memory(replay_db, raw_cache, workdir):
+    # user-024: same rows as pricevol_processed and marketcap, sorted per group of securities within a year
+    ref = _computer(replay_db, workdir / 'ref')
+    ref.pricevol_processed()
+    ref.marketcap()
+    shutil.copytree(raw_cache, workdir / 'out_of_core' / 'pricevol_raw.parquet')
+    stats = _computer(replay_db, workdir / 'out_of_core').pricevol_out_of_core(memory_budget=1200 * 1600)
+    assert stats['groups'] > 1
+    for name, keys in [('pricevol_processed', ['permno', 'date']), ('marketcap', ['permco', 'date'])]:
+        expected = read_partitions(f'{workdir}/ref/{name}.parquet').sort_values(keys).reset_index(drop=True)
+        result = read_partitions(f'{workdir}/out_of_core/{name}.parquet').sort_values(keys).reset_index(drop=True)
+        pd.testing.assert_frame_equal(result, expected, obj=name)
+
+
+def test_refresh_matches_full_rebuild(replay_db, raw_cache, workdir, tmp_path):
+    # user-009: a cache refreshed from an earlier cut holds the outputs of a full rebuild
+    ref = _computer(replay_db, workdir / 'ref')
+    ref.pricevol_processed()
+    ref.marketcap()
+    raw = read_partitions(str(raw_cache))
+    stale = raw[pd.to_datetime(raw['date']) <= '2014-11-14'].copy()
+    revised = pd.to_datetime(stale['date']) >= '2014-11-03' # rows CRSP revised after the first download
+    stale.loc[revised, 'prc'] = stale.loc[revised, 'prc'] * 1.1
+    write_partitions(stale, f'{tmp_path}/pricevol_raw.parquet', sort_by=['permno', 'date'])
+    pvc = _computer(replay_db, tmp_path)
+    pvc.pricevol_processed()
+    pvc.marketcap()
+
+    stats = pvc.refresh(lookback_days=30)
+    assert stats['window_start'] == pd.Timestamp('2014-10-15') and stats['last_date_after'] == pd.Timestamp('2014-12-31')
+    for name, keys in [('pricevol_raw', ['permno', 'date']), ('pricevol_processed', ['permno', 'date']), ('marketcap', ['permco', 'date'])]:
+        expected = read_partitions(f'{workdir}/ref/{name}.parquet').sort_values(keys).reset_index(drop=True)
+        result = read_partitions(f'{tmp_path}/{name}.parquet').sort_values(keys).reset_index(drop=True)
+        pd.testing.assert_frame_equal(result, expected, obj=name)
+
+
+def test_refresh_of_empty_cache_downloads_in_full(replay_db, raw_cache, workdir, tmp_path):
+    # user-010: an interrupted first download leaves empty dataset dirs, refresh then rebuilds everything
+    ref = _computer(replay_db, workdir / 'ref')
+    ref.pricevol_processed()
+    ref.marketcap()
+    for name in ['pricevol_raw', 'pricevol_processed']:
+        os.makedirs(f'{tmp_path}/{name}.parquet')
+    stats = _computer(replay_db, tmp_path).refresh(lookback_days=30)
+    assert stats['window_start'] is None and stats['last_date_after'] == pd.Timestamp('2014-12-31')
+    for name, keys in [('pricevol_raw', ['permno', 'date']), ('pricevol_processed', ['permno', 'date']), ('marketcap', ['permco', 'date'])]:
+        expected = read_partitions(f'{workdir}/ref/{name}.parquet').sort_values(keys).reset_index(drop=True)
+        result = read_partitions(f'{tmp_path}/{name}.parquet').sort_values(keys).reset_index(drop=True)
+        pd.testing.assert_frame_equal(result, expected, obj=name)
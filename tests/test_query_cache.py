@@ -0,0 +1,60 @@
+import glob
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from academic_data_download.db_manager.query_cache import QueryCache
+
+FAMILY = 'link_table/ccmxpf_linktable.sql.j2'
+
+
+def _df(rows=100):
+    return pd.DataFrame({'permno': range(rows), 'gvkey': [f'{i:06d}' for i in range(rows)]})
+
+
+def test_entries_expire_after_their_ttl(tmp_path):
+    cache = QueryCache(str(tmp_path), ttl={'link_table/*': 60}, verbose=False)
+    cache.put('SELECT 1', None, _df(), family=FAMILY)
+    pd.testing.assert_frame_equal(cache.get('SELECT 1', None, family=FAMILY), _df())
+    (key,) = cache.entries
+    cache.entries[key]['created'] -= 61
+    assert cache.get('SELECT 1', None, family=FAMILY) is None
+    assert not os.path.exists(f'{tmp_path}/{key}.parquet')
+
+
+def test_taq_results_are_not_cached(tmp_path):
+    cache = QueryCache(str(tmp_path), verbose=False)
+    for family in ['taq/taq_retail_markethour.sql.j2', 'taq/taq_retail_markethour_buckets.sql.j2']:
+        cache.put('SELECT 2', None, _df(), family=family)
+        assert cache.get('SELECT 2', None, family=family) is None
+    assert cache.entries == {} and not glob.glob(f'{tmp_path}/*.parquet')
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = QueryCache(str(tmp_path), max_bytes=1e9, verbose=False)
+    cache.put('SELECT a', None, _df(), family=FAMILY)
+    one_entry = cache.entries[cache.key('SELECT a')]['bytes']
+    cache.max_bytes = 2.5 * one_entry
+    cache.put('SELECT b', None, _df(), family=FAMILY)
+    cache.get('SELECT a', None, family=FAMILY) # a is now used more recently than b
+    cache.put('SELECT c', None, _df(), family=FAMILY)
+    assert cache.get('SELECT b', None, family=FAMILY) is None
+    assert cache.get('SELECT a', None, family=FAMILY) is not None and cache.get('SELECT c', None, family=FAMILY) is not None
+    assert sorted(glob.glob(f'{tmp_path}/*.parquet')) == sorted(f'{tmp_path}/{key}.parquet' for key in cache.entries)
+
+
+def _put_many(path, worker, n):
+    cache = QueryCache(path, verbose=False)
+    for i in range(n):
+        cache.put(f'SELECT {worker}, {i}', None, _df(10), family=FAMILY)
+
+
+def test_processes_sharing_the_cache_keep_all_entries(tmp_path):
+    with ProcessPoolExecutor(max_workers=4) as executor:
+        list(executor.map(_put_many, [str(tmp_path)] * 4, range(4), [25] * 4))
+    with open(f'{tmp_path}/index.json') as f:
+        index = json.load(f)
+    assert len(index) == 100
+    assert sorted(glob.glob(f'{tmp_path}/*.parquet')) == sorted(f'{tmp_path}/{key}.parquet' for key in index)
@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+
+from academic_data_download.factors_lab.pricevol_builder import LIVE_FIELDS, PriceVolComputer, secd_metrics
+
+WINDOWS = [5, 20]
+
+
+def _full_recompute(secd, end):
+    # the features of live_screener from the whole secd history up to `end`, with pandas
+    secd = secd[pd.to_datetime(secd['datadate']) <= end].copy()
+    secd['security'] = secd['gvkey'].astype(str) + '_' + secd['iid'].astype(str)
+    days = pd.to_datetime(secd['datadate'])
+    wide = {field: secd.pivot_table(index=days, columns='security', values=field, aggfunc='last', dropna=False).sort_index().astype('float64') for field in LIVE_FIELDS}
+    window = {field: df.tail(max(WINDOWS) + 1) for field, df in wide.items()}
+    df = pd.DataFrame({field: window[field].iloc[-1] for field in LIVE_FIELDS})
+    for w in WINDOWS:
+        for field in LIVE_FIELDS:
+            df[f'{field}_ma{w}'] = window[field].tail(w).mean()
+        before = window['cshtrd'].iloc[-w - 1:-1]
+        mean, std, count = before.mean(), before.std(ddof=0), before.count()
+        df[f'cshtrd_z{w}'] = ((df['cshtrd'] - mean) / std).where((count >= 2) & (std > 0))
+    # securities without any row in the window are dropped from the state
+    return df[pd.concat([w.notna().any() for w in window.values()], axis=1).any(axis=1)]
+
+
+def test_daily_runs_match_full_rolling_recompute(replay_db, workdir, tmp_path):
+    # user-025: the rolling state advanced day by day gives the features of the whole history
+    pvc = PriceVolComputer(verbose=False, db=replay_db, permno_list=None)
+    pvc.save_path = str(tmp_path)
+    secd = secd_metrics(pvc.wrds_manager.get_secd_daily(start_date='2014-09-01', end_date='2014-12-31'))
+    days = sorted(pd.to_datetime(secd['datadate']).unique())
+
+    pvc.live_screener(date=days[-8], windows=WINDOWS) # bootstrap
+    for day in days[-7:]:
+        results = pvc.live_screener(date=day, windows=WINDOWS)
+        features = results['features'].set_index('security')
+        assert (features['date'] == day).all() and features['cshtrd_z20'].notna().any()
+        expected = _full_recompute(secd, day)
+        assert sorted(features.index) == sorted(expected.index)
+        for col in expected.columns:
+            np.testing.assert_allclose(features.loc[expected.index, col].to_numpy(dtype=np.float64), expected[col].to_numpy(), rtol=1e-5, atol=1e-6, err_msg=f'{col} on {day}')
+    assert set(results) == {'high_turnover', 'volume_spike', 'turnover_breakout', 'features'}
@@ -0,0 +1,93 @@
+import glob
+import json
+import os
+
+import pandas as pd
+import pytest
+
+from academic_data_download.utils.sql_execution import ChunkManifest, sql_execution_in_chunks
+
+
+def _renderer(keys):
+    return f"SELECT permno, date, prc, ret FROM crsp.dsf WHERE permno IN ({', '.join(str(k) for k in keys)}) ORDER BY date"
+
+
+def _permnos(db):
+    return db.raw_sql("SELECT DISTINCT permno FROM crsp.dsf ORDER BY permno")['permno'].tolist()
+
+
+def test_pooled_matches_serial(replay_db, tmp_path):
+    # user-002: same rows in the same order whatever the number of connections and the chunking
+    permnos = _permnos(replay_db)
+    serial = sql_execution_in_chunks(replay_db, _renderer, permnos, f'{tmp_path}/serial/crsp.parquet', chunk_size=4, key_column='permno')
+    pooled = sql_execution_in_chunks(replay_db, _renderer, permnos, f'{tmp_path}/pooled/crsp.parquet', chunk_size=4, n_workers=3, max_in_flight=2, key_column='permno')
+    adaptive = sql_execution_in_chunks(replay_db, _renderer, permnos, f'{tmp_path}/adaptive/crsp.parquet', n_workers=3, target_rows=1500, row_estimates={k: 500 for k in permnos}, key_column='permno')
+    assert len(serial) == len(replay_db.raw_sql("SELECT permno FROM crsp.dsf"))
+    assert serial['permno'].is_monotonic_increasing
+    pd.testing.assert_frame_equal(pooled, serial)
+    pd.testing.assert_frame_equal(adaptive, serial)
+
+
+class _Renderer():
+    # _renderer that records the chunks it renders and fails for the chunks holding a key of `fail`
+    def __init__(self, n_keys, fail=()):
+        self.n_keys = n_keys
+        self.fail = set(fail)
+        self.chunks = []
+
+    def __call__(self, keys):
+        if len(keys) < self.n_keys: # not the rendering of the whole job
+            self.chunks.append(list(keys))
+            if self.fail.intersection(keys):
+                raise ConnectionError("server closed the connection unexpectedly")
+        return _renderer(keys)
+
+
+def _manifest(root):
+    (path,) = glob.glob(f'{root}/parts/*/manifest.json')
+    with open(path) as f:
+        return os.path.dirname(path), json.load(f)
+
+
+def test_resume_skips_done_chunks(replay_db, tmp_path):
+    # user-003: a rerun after a failed chunk executes only that chunk
+    permnos = _permnos(replay_db)
+    cache_path = f'{tmp_path}/resumed/crsp.parquet'
+    failing = _Renderer(len(permnos), fail=[permnos[7]])
+    with pytest.raises(RuntimeError, match='1 chunk'):
+        sql_execution_in_chunks(replay_db, failing, permnos, cache_path, chunk_size=6, key_column='permno')
+    _, manifest = _manifest(f'{tmp_path}/resumed')
+    assert sorted(c['status'] for c in manifest['chunks'].values()) == ['done'] * 5 + ['failed']
+
+    rerun = _Renderer(len(permnos))
+    resumed = sql_execution_in_chunks(replay_db, rerun, permnos, cache_path, chunk_size=6, key_column='permno')
+    assert len(rerun.chunks) == 1 and permnos[7] in rerun.chunks[0]
+    full = sql_execution_in_chunks(replay_db, _renderer, permnos, f'{tmp_path}/full/crsp.parquet', chunk_size=6, key_column='permno')
+    pd.testing.assert_frame_equal(resumed, full)
+
+
+def test_resume_redoes_corrupted_parts_and_ignores_foreign_files(replay_db, tmp_path):
+    permnos = _permnos(replay_db)
+    cache_path = f'{tmp_path}/crsp.parquet'
+    full = sql_execution_in_chunks(replay_db, _renderer, permnos, cache_path, chunk_size=6, key_column='permno')
+    job_dir, manifest = _manifest(tmp_path)
+    corrupted = next(iter(manifest['chunks']))
+    with open(f'{job_dir}/{corrupted}.parquet', 'ab') as f:
+        f.write(b'\0') # checksum mismatch
+    with open(f'{job_dir}/{corrupted}.parquet.tmp', 'wb') as f:
+        f.write(b'PAR1') # left by an interrupted write
+    full.head(10).to_parquet(f'{job_dir}/foreign.parquet', index=False) # not in the manifest
+
+    rerun = _Renderer(len(permnos))
+    resumed = sql_execution_in_chunks(replay_db, rerun, permnos, cache_path, chunk_size=6, key_column='permno')
+    assert rerun.chunks == [manifest['chunks'][corrupted]['keys']]
+    assert not glob.glob(f'{job_dir}/*.tmp')
+    pd.testing.assert_frame_equal(resumed, full)
+
+
+def test_manifest_of_another_job_is_refused(tmp_path):
+    manifest = ChunkManifest(str(tmp_path), 'job_a', n_keys=2)
+    manifest.update(ChunkManifest.chunk_id([1, 2]), keys=[1, 2], status='done', checksum='0')
+    assert not manifest.is_valid(ChunkManifest.chunk_id([1, 2])) # no part file
+    with pytest.raises(ValueError, match='belongs to job job_a'):
+        ChunkManifest(str(tmp_path), 'job_b', n_keys=2)
@@ -0,0 +1,47 @@
+import pandas as pd
+import pytest
+
+from academic_data_download.db_manager.wrds_sql import WRDSManager
+
+BUCKETS = [(100000, 0), (10000, 2000), (30000, 10000), (2000, 500), (None, None)]
+KEYS = ['date', 'sym_root', 'sym_suffix']
+
+
+@pytest.mark.parametrize('date', ['2014-12-30', '2014-12-31'])
+def test_buckets_match_single_bucket_queries(replay_db, date):
+    # user-016: one scan for several dollar-size buckets gives the rows of one query per bucket
+    manager = WRDSManager(replay_db, verbose=False, metrics_path=None)
+    table = f"taqm_{date[:4]}.wct_{date.replace('-', '')}"
+    symbols = replay_db.raw_sql(f"SELECT DISTINCT sym_root FROM {table} ORDER BY sym_root")['sym_root'].tolist()[:8]
+
+    multi = manager.get_taq_retail_markethour_buckets(date=date, sym_root_list=symbols, buckets=BUCKETS)
+    assert len(multi)
+    for upper, lower in BUCKETS:
+        single = manager.get_taq_retail_markethour(date=date, sym_root_list=symbols, retail_cutoff_upper=upper, retail_cutoff_lower=lower)
+        part = multi[(multi['retail_cutoff_upper'] == (upper or 0)) & (multi['retail_cutoff_lower'] == (lower or 0))]
+        part = part.drop(columns=['retail_cutoff_upper', 'retail_cutoff_lower'])
+        assert single.sort_values(KEYS).reset_index(drop=True).equals(part.sort_values(KEYS).reset_index(drop=True)), (upper, lower)
+
+
+@pytest.mark.parametrize('date', ['2014-12-30', '2014-12-31'])
+def test_intraday_bins_sum_to_daily_totals(replay_db, date):
+    # user-017: the bins of every size partition the trades of the day
+    manager = WRDSManager(replay_db, verbose=False, metrics_path=None)
+    buckets = BUCKETS[:3]
+    df = manager.get_taq_retail_markethour_buckets(date=date, buckets=buckets, bin_minutes=[5, 30, 60])
+    group = KEYS + ['retail_cutoff_upper', 'retail_cutoff_lower']
+    counts = ['no', 'nob', 'nos', 's', 'sb', 'ss']
+    daily = df[df['bin_minutes'] == 0].drop(columns=['bin_minutes', 'bin_start']).set_index(group).sort_index()
+    assert len(daily) and (df.loc[df['bin_minutes'] == 0, 'bin_start'] == 570).all()
+
+    plain = manager.get_taq_retail_markethour_buckets(date=date, buckets=buckets).set_index(group).sort_index()
+    assert plain.equals(daily)
+    for m in [5, 30, 60]:
+        bins = df[df['bin_minutes'] == m]
+        assert ((bins['bin_start'] - 570) % m == 0).all() and bins['bin_start'].between(570, 960 - 1).all()
+        summed = bins.groupby(group, dropna=False)[daily.columns.tolist()].sum().sort_index()
+        pd.testing.assert_frame_equal(summed[counts], daily[counts], check_dtype=False, obj=f'{m} minute bins')
+        # v, vb and vs are rounded to 3 decimals row by row
+        n_bins = bins.groupby(group, dropna=False).size().sort_index()
+        for col in ['v', 'vb', 'vs']:
+            assert ((summed[col] - daily[col]).abs() <= 0.0005 * n_bins + 1e-9).all(), (m, col)
@@ -0,0 +1,26 @@
+import pandas as pd
+
+from academic_data_download.factors_lab.taq_builder import TAQBuilder
+
+
+def _builder(db, save_path, permnos):
+    builder = TAQBuilder(verbose=False, db=db, save_path=str(save_path))
+    builder.analyst_estimation_builder.price_target_detail = lambda: pd.DataFrame({'permno': permnos})
+    return builder
+
+
+def test_day_without_linked_symbols_is_done_with_empty_parts(replay_db, tmp_path):
+    # user-015: e.g. a narrow permno list before the IPO; not a failure to retry on every run
+    builder = _builder(replay_db, tmp_path, permnos=[1]) # no link on any day
+    summary = builder.taq_retail_markethour_buckets(buckets=[(100000, 0)], start_date='2014-12-29', end_date='2014-12-31')
+    assert summary['done'] == ['2014-12-30'] and not summary['failed']
+    part = pd.read_parquet(f'{tmp_path}/parts/100000_0/taq_retail_markethour_2014-12-30.parquet')
+    assert part.empty and 'no' in part.columns
+    assert builder.taq_retail_markethour_buckets(buckets=[(100000, 0)], start_date='2014-12-29', end_date='2014-12-31')['done'] == []
+
+
+def test_linked_symbols_are_downloaded(replay_db, tmp_path):
+    builder = _builder(replay_db, tmp_path, permnos=[14593]) # AAPL
+    builder.taq_retail_markethour_buckets(buckets=[(100000, 0)], start_date='2014-12-29', end_date='2014-12-31')
+    part = pd.read_parquet(f'{tmp_path}/parts/100000_0/taq_retail_markethour_2014-12-30.parquet')
+    assert part['sym_root'].tolist() == ['AAPL'] and part['no'].iloc[0] > 0